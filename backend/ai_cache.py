@@ -0,0 +1,122 @@
+"""
+AI Response Cache
+Stale-while-revalidate cache for LLM responses whose prompt inputs rarely change
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Entry:
+    __slots__ = ('value', 'fingerprint', 'created')
+
+    def __init__(self, value, fingerprint):
+        self.value = value
+        self.fingerprint = fingerprint
+        self.created = time.monotonic()
+
+
+class StaleWhileRevalidateCache:
+    """
+    Cache that serves the last good value instantly and refreshes it in the background
+
+    An entry is fresh while its fingerprint (e.g. the graph revision the prompt was
+    built from) matches the caller's and it is younger than the TTL. Stale entries are
+    still returned immediately while a single background refresh recomputes them.
+    """
+
+    def __init__(self, ttl=600, max_workers=2):
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-cache')
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, key, fingerprint, compute, is_valid=None):
+        """
+        Get a cached value, computing it on a cold miss
+
+        Args:
+            key: Cache key built from the prompt inputs
+            fingerprint: Value identifying the data the entry must reflect
+            compute: Zero-argument callable producing a fresh value
+            is_valid: Optional predicate; values failing it (e.g. error texts) are not cached
+
+        Returns:
+            tuple: (value, status) where status is 'hit', 'stale' or 'miss'
+        """
+        cached = self.lookup(key, fingerprint, compute, is_valid)
+        if cached is not None:
+            return cached
+
+        value = compute()
+        self.put(key, fingerprint, value, is_valid)
+        return value, 'miss'
+
+    def lookup(self, key, fingerprint, refresh=None, is_valid=None):
+        """
+        Get a cached value without computing it on a miss
+
+        Stale entries are returned and, when a refresh callable is given,
+        recomputed in the background.
+
+        Returns:
+            tuple: (value, 'hit' or 'stale'), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.fingerprint == fingerprint and time.monotonic() - entry.created < self.ttl:
+                self.hits += 1
+                return entry.value, 'hit'
+            self.stale_hits += 1
+            if refresh is not None and key not in self._refreshing:
+                self._refreshing.add(key)
+                self._executor.submit(self._refresh, key, fingerprint, refresh, is_valid)
+            return entry.value, 'stale'
+
+    def _refresh(self, key, fingerprint, compute, is_valid):
+        try:
+            value = compute()
+            self.put(key, fingerprint, value, is_valid)
+        except Exception as e:
+            print(f"AI cache refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+                self.refreshes += 1
+
+    def put(self, key, fingerprint, value, is_valid=None):
+        """Store a freshly computed value, unless it fails the is_valid predicate"""
+        if is_valid is not None and not is_valid(value):
+            return
+        with self._lock:
+            self._entries[key] = _Entry(value, fingerprint)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or every entry when no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Return hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'staleHits': self.stale_hits,
+                'misses': self.misses,
+                'backgroundRefreshes': self.refreshes,
+                'hitRatio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,81 @@
+"""
+AI Follow-up Tasks
+Runs independent LLM calls (explanations, related queries...) concurrently in the
+background and keeps their results available as a follow-up resource
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class FollowUpStore:
+    """Bounded store of background LLM tasks, grouped per follow-up ID"""
+
+    def __init__(self, max_workers=4, max_entries=1000, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-followup')
+
+    def submit(self, tasks):
+        """
+        Start every task concurrently
+
+        Args:
+            tasks: Dict of result name -> zero-argument callable
+
+        Returns:
+            str: Follow-up ID to retrieve the results with
+        """
+        followup_id = uuid.uuid4().hex
+        futures = {name: self._executor.submit(fn) for name, fn in tasks.items()}
+        with self._lock:
+            self._entries[followup_id] = (time.monotonic(), futures)
+            self._evict()
+        return followup_id
+
+    def get(self, followup_id, wait_seconds=0):
+        """
+        Get the results of a follow-up, optionally waiting for them
+
+        Returns:
+            dict: 'status' ('pending' or 'done') and one key per task (None until done),
+            or None for an unknown or expired ID
+        """
+        with self._lock:
+            entry = self._entries.get(followup_id)
+        if entry is None:
+            return None
+
+        futures = entry[1]
+        if wait_seconds > 0:
+            wait(list(futures.values()), timeout=wait_seconds)
+
+        result = {'status': 'done'}
+        for name, future in futures.items():
+            if future.done():
+                try:
+                    result[name] = future.result()
+                except Exception as e:
+                    result[name] = None
+                    result.setdefault('errors', {})[name] = str(e)
+            else:
+                result[name] = None
+                result['status'] = 'pending'
+        return result
+
+    def run(self, tasks, timeout):
+        """Run tasks concurrently and wait for them; the slowest one sets the latency"""
+        return self.get(self.submit(tasks), wait_seconds=timeout)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            created, _ = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_entries and now - created < self.ttl:
+                break
+            self._entries.popitem(last=False)
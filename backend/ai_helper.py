@@ -1,19 +1,17 @@
-import google.generativeai as genai
-import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables. Please check your .env file.")
+from llm_backend import get_backend
 
-genai.configure(api_key=GEMINI_API_KEY)
+# The Gemini API key is checked when the backend is first used (see features.py),
+# so a missing key disables the AI endpoints instead of the whole API
 
-# Initialize Gemini model (using free tier - gemini-2.5-flash is the stable free model)
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Fallback texts returned when Gemini fails (callers must not cache these)
+SPARQL_ERROR_PREFIX = "Error generating SPARQL"
+SUGGESTIONS_ERROR_PREFIX = "Error getting suggestions"
+INSIGHTS_UNAVAILABLE = "Impossible de générer des insights pour le moment."
 
 def generate_sparql_from_natural_language(user_query):
     """
@@ -62,8 +60,7 @@ Generate a SPARQL query that answers this question. Return ONLY the SPARQL query
 """
     
     try:
-        response = model.generate_content(prompt)
-        sparql_query = response.text.strip()
+        sparql_query = get_backend().generate(prompt).strip()
         
         # Clean up the response (remove markdown code blocks if present)
         if sparql_query.startswith('```sparql'):
@@ -73,14 +70,18 @@ Generate a SPARQL query that answers this question. Return ONLY the SPARQL query
         
         return sparql_query
     except Exception as e:
-        return f"Error generating SPARQL: {str(e)}"
+        return f"{SPARQL_ERROR_PREFIX}: {str(e)}"
 
 
-def get_ai_suggestions(context):
-    """
-    Get AI suggestions based on current context
-    """
-    prompt = f"""
+def _stream_text(prompt):
+    """Yield the text chunks of an LLM response as they are generated"""
+    for text in get_backend().stream(prompt):
+        if text:
+            yield text
+
+
+def _suggestions_prompt(context):
+    return f"""
 You are a helpful assistant for a Smart City & Mobility semantic web application.
 
 Based on this context: {context}
@@ -91,12 +92,18 @@ Each suggestion should be on a new line, formatted as:
 
 Keep suggestions practical and relevant to smart city mobility.
 """
+
+
+def get_ai_suggestions(context):
+    """
+    Get AI suggestions based on current context
+    """
+    prompt = _suggestions_prompt(context)
     
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return get_backend().generate(prompt).strip()
     except Exception as e:
-        return f"Error getting suggestions: {str(e)}"
+        return f"{SUGGESTIONS_ERROR_PREFIX}: {str(e)}"
 
 
 def explain_sparql_results(query, results_count):
@@ -113,29 +120,45 @@ Keep the explanation simple and user-friendly in French.
 """
     
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return get_backend().generate(prompt).strip()
     except Exception as e:
         return "Résultats de la requête SPARQL"
 
 
-def get_smart_city_insights(data_summary):
+def stream_ai_suggestions(context):
     """
-    Generate AI insights about the smart city data
+    Stream AI suggestions chunk by chunk while Gemini generates them
     """
-    prompt = f"""
+    return _stream_text(_suggestions_prompt(context))
+
+
+def _insights_prompt(data_summary):
+    return f"""
 Based on this Smart City & Mobility data summary:
 {data_summary}
 
 Provide 2-3 actionable insights or observations about the urban mobility situation.
 Write in French, keep it concise and professional.
 """
+
+
+def get_smart_city_insights(data_summary):
+    """
+    Generate AI insights about the smart city data
+    """
+    prompt = _insights_prompt(data_summary)
     
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return get_backend().generate(prompt).strip()
     except Exception as e:
-        return "Impossible de générer des insights pour le moment."
+        return INSIGHTS_UNAVAILABLE
+
+
+def stream_smart_city_insights(data_summary):
+    """
+    Stream AI insights chunk by chunk while Gemini generates them
+    """
+    return _stream_text(_insights_prompt(data_summary))
 
 
 def suggest_related_queries(current_query):
@@ -152,8 +175,7 @@ Separate them with "---"
 """
     
     try:
-        response = model.generate_content(prompt)
-        suggestions = response.text.strip().split('---')
+        suggestions = get_backend().generate(prompt).strip().split('---')
         return [s.strip() for s in suggestions if s.strip()]
     except Exception as e:
         return []
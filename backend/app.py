@@ -1,19 +1,50 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, has_request_context, request, jsonify, send_from_directory
 from flask_cors import CORS
-from rdflib import Graph, Namespace, RDF, RDFS, OWL
-from rdflib.plugins.sparql import prepareQuery
+from rdflib import Namespace, RDF, RDFS, OWL, URIRef
+from rdflib.plugins.sparql import prepareQuery, prepareUpdate
 import os
+import itertools
 import json
-import requests
+import math
+import threading
+import time
 from datetime import datetime
-from ai_helper import (
-    generate_sparql_from_natural_language,
-    get_ai_suggestions,
-    explain_sparql_results,
-    get_smart_city_insights,
-    suggest_related_queries
+from dotenv import load_dotenv
+from ai_cache import StaleWhileRevalidateCache
+from ai_followups import FollowUpStore
+from query_templates import match_natural_query, match_keywords, get_template_stats, EXAMPLE_QUESTIONS
+from features import FeatureUnavailable, require as require_feature, status as get_feature_status
+from jobs import JobQueue, QueueFull
+from asset_manager import AssetManager
+from user_index import UserIndex
+from id_sequences import IdSequences
+from transactions import TransactionalGraph
+from compact_store import CompactStore
+from sharding import ShardedStore
+from ingest import Ingestor, detect_format
+from query_optimizer import QueryOptimizer
+from query_log import QueryLog
+from request_profiler import RequestProfiler
+import metrics
+from export import (
+    FORMAT_ALIASES,
+    GRAPH_FORMATS,
+    RESULT_FORMATS,
+    run_query,
+    stream_graph,
+    stream_result_graph,
+    stream_results
 )
-from cloudinary_helper import upload_profile_image, delete_profile_image, upload_station_image
+from uploads import (
+    MAX_UPLOAD_BYTES,
+    UploadRejected,
+    discard as discard_upload,
+    spool_base64 as spool_upload_base64,
+    spool_stream as spool_upload_stream
+)
+
+# Load environment variables
+load_dotenv()
 
 app = Flask(__name__)
 
@@ -22,15 +53,30 @@ CORS(app,
      resources={r"/api/*": {
          "origins": "*",
          "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-         "allow_headers": ["Content-Type", "Authorization"],
-         "expose_headers": ["Content-Type"],
+         "allow_headers": ["Content-Type", "Authorization", "X-Profile", "X-Profile-Token"],
+         "expose_headers": ["Content-Type", "X-Profile-Id"],
          "supports_credentials": False
      }})
 
-# Load RDF ontology
-g = Graph()
+# Load RDF ontology (RDF_STORE=compact: dictionary-encoded store, several times less memory per triple)
+g = TransactionalGraph(store=CompactStore() if os.getenv('RDF_STORE', 'memory') == 'compact' else 'default')
 rdf_file = os.path.join(os.path.dirname(__file__), '..', 'Projet.rdf')
-g.parse(rdf_file, format='xml')
+
+# Optional sharded storage: a directory of RDF files loaded in parallel, saved per file
+shards = None
+if os.getenv('RDF_DATA_DIR'):
+    g.track_changes()
+    shards = ShardedStore(os.getenv('RDF_DATA_DIR'), workers=int(os.getenv('RDF_LOAD_WORKERS', '0')) or None)
+    if shards.load_into(g):
+        print(f"🗂️ Loaded {len(shards.files)} RDF shards in {shards.load_seconds:.2f} s")
+    else:
+        # First start: split Projet.rdf into the directory
+        g.parse(rdf_file, format='xml')
+        shards.save(g, set(g.subjects()))
+        print(f"🗂️ Split {rdf_file} into {len(shards.files)} shards")
+    g.dirty_subjects.clear()
+else:
+    g.parse(rdf_file, format='xml')
 
 # Define namespaces
 SMARTCITY = Namespace("http://example.org/smartcity#")
@@ -40,11 +86,218 @@ ONT = Namespace("http://www.co-ode.org/ontologies/ont.owl#")
 g.bind("smartcity", SMARTCITY)
 g.bind("ont", ONT)
 
+# Name of the graph in N-Quads exports
+GRAPH_NAME = URIRef("http://www.co-ode.org/ontologies/ont.owl")
+
+# Revision of the graph contents, bumped on every persisted mutation and every imported batch
+graph_revision = 0
+
+# Per-prefix ID counters (Bus_12, Station_4...), persisted in a file next to the RDF data
+id_sequences = IdSequences(g, ONT, os.getenv('ID_SEQUENCES_FILE', os.path.splitext(rdf_file)[0] + '.sequences.json'))
+id_sequences.load()
+
+# Name/email -> URI index for registration and login, kept in sync by the user routes
+user_index = UserIndex((ONT.Citoyen, ONT.Touriste), ONT.Nom, ONT.Email)
+user_index.rebuild(g)
+
+# Cache for AI responses, refreshed in the background when the graph changes
+ai_cache = StaleWhileRevalidateCache(ttl=int(os.getenv('AI_CACHE_TTL', '1800')))
+
+# Background LLM calls whose results are delivered after the main response
+ai_followups = FollowUpStore()
+AI_FOLLOWUP_TIMEOUT = 30
+
+# Serializes graph mutations and saves made outside the request threads
+graph_lock = threading.RLock()
+
+# Latency per query fingerprint; executions over SLOW_QUERY_MS are kept and logged to a rotating file
+query_log = QueryLog(
+    os.getenv('SLOW_QUERY_LOG', os.path.join(os.path.dirname(__file__), 'logs', 'slow_queries.jsonl')),
+    threshold_ms=float(os.getenv('SLOW_QUERY_MS', '200')),
+    max_bytes=int(os.getenv('SLOW_QUERY_LOG_BYTES', str(5 * 1024 * 1024))),
+    backups=int(os.getenv('SLOW_QUERY_LOG_BACKUPS', '5'))
+)
+
+# Parsed SPARQL queries, evaluated in an order chosen from the graph's cardinality statistics
+query_optimizer = QueryOptimizer(
+    g, graph_lock,
+    enabled=os.getenv('QUERY_OPTIMIZER', 'on') != 'off',
+    max_age=int(os.getenv('QUERY_STATS_MAX_AGE', '300')),
+    query_log=query_log,
+    log_source=lambda: request.path if has_request_context() else None
+)
+
+# Image uploads: accepted at once, sent to Cloudinary by a bounded worker pool
+upload_jobs = JobQueue(
+    max_workers=int(os.getenv('UPLOAD_WORKERS', '4')),
+    max_pending=int(os.getenv('UPLOAD_QUEUE_SIZE', '32')),
+    name='upload'
+)
+UPLOAD_WAIT_LIMIT = 30
+MAX_BULK_IMAGES = 50
+
+# Largest batch accepted by the /api/<collection>/bulk endpoints
+BULK_MAX_OPERATIONS = int(os.getenv('BULK_MAX_OPERATIONS', '5000'))
+
+# RDF imports: one at a time, streamed into the graph in batches
+import_jobs = JobQueue(max_workers=1, max_pending=int(os.getenv('IMPORT_QUEUE_SIZE', '2')), name='import')
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '10000'))
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(2 * 1024 ** 3)))
+IMPORT_MAX_TRIPLES = int(os.getenv('IMPORT_MAX_TRIPLES', '20000000'))
+
+# Bulk image uploads and garbage collection of images no entity references
+asset_manager = AssetManager(
+    batch_size=int(os.getenv('ASSET_GC_BATCH_SIZE', '100')),
+    rate_per_minute=int(os.getenv('ASSET_GC_RATE_PER_MINUTE', '30')),
+    grace_seconds=int(os.getenv('ASSET_GC_GRACE_SECONDS', '3600'))
+)
+
+# Requests run under a profiler on demand (X-Profile + X-Profile-Token headers) or sampled,
+# read back through /api/admin/profiles
+request_profiler = RequestProfiler(
+    token=os.getenv('PROFILE_TOKEN') or None,
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    keep=int(os.getenv('PROFILE_KEEP', '50')),
+    interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+)
+
+# Prometheus metrics served by /api/metrics; METRICS=off skips the per-request timing
+METRICS_ENABLED = os.getenv('METRICS', 'on') != 'off'
+REQUEST_SECONDS = metrics.histogram(
+    'smartcity_http_request_seconds', "Request handling time per route (streamed bodies: until the first chunk)",
+    ['method', 'route']
+)
+REQUESTS = metrics.counter('smartcity_http_requests_total', "Requests per route and status code",
+                           ['method', 'route', 'status'])
+REQUEST_ERRORS = metrics.counter('smartcity_http_request_errors_total', "Requests answered with a 5xx status",
+                                 ['method', 'route'])
+SAVE_SECONDS = metrics.histogram('smartcity_graph_save_seconds', "save_graph() serialization time", ['storage'])
+SAVE_BYTES = metrics.gauge('smartcity_graph_save_bytes', "Bytes written by the last save_graph()", ['storage'])
+SAVE_FAILURES = metrics.counter('smartcity_graph_save_failures_total', "save_graph() calls that failed", ['storage'])
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "message": "Smart City API is running"})
 
+@app.before_request
+def start_request_profile():
+    """Registered first so the profile covers the other hooks too"""
+    session = request_profiler.begin(request.headers.get('X-Profile'), request.headers.get('X-Profile-Token'))
+    if session is not None:
+        request.environ['smartcity.profile'] = session
+
+@app.after_request
+def finish_request_profile(response):
+    """Keep the profile of a profiled request and send its ID back as X-Profile-Id"""
+    session = request.environ.pop('smartcity.profile', None)
+    if session is not None:
+        profile_id = request_profiler.finish(
+            session,
+            method=request.method,
+            path=request.path,
+            route=request.url_rule.rule if request.url_rule is not None else None,
+            status=response.status_code
+        )
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@app.teardown_request
+def abort_request_profile(exc):
+    """A request that failed before its after_request hooks: stop the profiler anyway"""
+    session = request.environ.pop('smartcity.profile', None)
+    if session is not None:
+        request_profiler.abort(session)
+
+@app.before_request
+def start_request_timer():
+    if METRICS_ENABLED:
+        request.environ['smartcity.start'] = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latency and status per route; the URL rule (/api/buses/<bus_id>) keeps the label set small"""
+    current = request._get_current_object()
+    start = current.environ.get('smartcity.start')
+    if start is not None:
+        rule = current.url_rule
+        route = rule.rule if rule is not None else 'unmatched'
+        method, status = current.method, response.status_code
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method, route)
+        REQUESTS.inc(method, route, status)
+        if status >= 500:
+            REQUEST_ERRORS.inc(method, route)
+    return response
+
+@app.before_request
+def start_query_profiling():
+    """?profile=1 on any endpoint: profile the SPARQL queries it runs"""
+    query_optimizer.captured()
+    if request.args.get('profile') == '1':
+        query_optimizer.capture()
+
+@app.after_request
+def attach_query_profiles(response):
+    """Add the captured query profiles to JSON answers as queryProfiles (lists become {"results": [...]})"""
+    reports = query_optimizer.captured()
+    if reports is not None and response.is_json and not response.is_streamed:
+        body = response.get_json()
+        if not isinstance(body, dict):
+            body = {'results': body}
+        body['queryProfiles'] = reports
+        response.set_data(app.json.dumps(body))
+    return response
+
+@app.errorhandler(FeatureUnavailable)
+def feature_unavailable(e):
+    """Optional integrations that cannot load answer 503, the graph API keeps running"""
+    return jsonify({"success": False, "error": str(e), "feature": e.feature}), 503
+
+@app.route('/api/features', methods=['GET'])
+def get_features():
+    """Get the load state of the optional integrations"""
+    return jsonify({"success": True, "features": get_feature_status()})
+
+def cache_counters():
+    """(hits, misses) of each cache, for the metrics endpoint"""
+    ai = ai_cache.stats()
+    templates = get_template_stats()
+    counters = {
+        'ai_response': (ai['hits'] + ai['staleHits'], ai['misses']),
+        'query_plan': (query_optimizer.hits, query_optimizer.misses),
+        'query_template': (templates['hits'], templates['misses'])
+    }
+    if get_feature_status()['images']['loaded']:
+        uploads = require_feature('images').get_upload_stats()
+        counters['image_dedup'] = (uploads['deduplicated'], uploads['uploads'])
+    return counters
+
+def cache_hit_ratios():
+    return {
+        (name,): round(hits / (hits + misses), 4) if hits + misses else None
+        for name, (hits, misses) in cache_counters().items()
+    }
+
+def llm_shed_calls():
+    if not get_feature_status()['llm']['loaded']:
+        return {}
+    return {(reason,): count for reason, count in require_feature('llm').get_backend().stats().get('shed', {}).items()}
+
+metrics.callback('smartcity_graph_triples', "Triples in the graph", lambda: len(g))
+metrics.callback('smartcity_graph_revision', "Graph mutations (saves and imported batches) since startup", lambda: graph_revision)
+metrics.callback('smartcity_cache_hits_total', "Cache hits (stale AI answers included)",
+                 lambda: {(name,): hits for name, (hits, _) in cache_counters().items()}, 'counter', ['cache'])
+metrics.callback('smartcity_cache_misses_total', "Cache misses",
+                 lambda: {(name,): misses for name, (_, misses) in cache_counters().items()}, 'counter', ['cache'])
+metrics.callback('smartcity_cache_hit_ratio', "Hits / lookups since startup", cache_hit_ratios, labels=['cache'])
+metrics.callback('smartcity_llm_calls_shed_total', "LLM calls shed by the circuit breaker or rate limiter",
+                 llm_shed_calls, 'counter', ['reason'])
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics: latency and errors per route, subsystem timers, cache hit ratios, graph size"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get overall statistics"""
@@ -68,7 +321,7 @@ def get_stats():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     for row in results:
         return jsonify({
             "totalUsers": int(row.totalUsers),
@@ -104,7 +357,7 @@ def get_users():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     users = []
     user_dict = {}
     
@@ -156,7 +409,7 @@ def get_transports():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     transports = []
     transport_dict = {}
     
@@ -200,7 +453,7 @@ def get_stations():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     stations = []
     
     for row in results:
@@ -240,7 +493,7 @@ def get_events():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     events = []
     
     for row in results:
@@ -279,7 +532,7 @@ def get_trajets():
     }
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     trajets = []
     
     for row in results:
@@ -295,14 +548,86 @@ def get_trajets():
     
     return jsonify(trajets)
 
+def negotiate_format(offered, default):
+    """Pick a response type from ?format= (e.g. csv, nt) or the Accept header"""
+    requested = request.args.get('format')
+    if requested:
+        mimetype = FORMAT_ALIASES.get(requested.lower(), requested.lower())
+        return mimetype if mimetype in offered else None
+    return request.accept_mimetypes.best_match(offered, default=default)
+
+def locked_stream(chunks):
+    """
+    Produce each chunk under the graph lock, releasing it before the chunk is sent
+    
+    A chunk holds at most CHUNK_SIZE characters of rows, so writers wait for one
+    chunk to be computed, never for a slow client to download it. As with
+    stream_graph, a query streaming while the graph changes may see part of the
+    changes (the stores tolerate writes between two steps of an iteration).
+    """
+    chunks = iter(chunks)
+    while True:
+        with graph_lock:
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+def logged_stream(chunks, query_string, query_type, source):
+    """Record a streamed query in the metrics and query log once its last chunk was produced"""
+    start = time.perf_counter()
+    yield from chunks
+    query_optimizer.record(query_string, time.perf_counter() - start, query_type=query_type, source=source)
+
 @app.route('/api/query', methods=['POST'])
 def execute_sparql():
-    """Execute custom SPARQL query"""
+    """
+    Execute custom SPARQL query
+    
+    Answers the usual JSON by default. Clients asking for a SPARQL 1.1 result format
+    (Accept: application/sparql-results+json, text/csv or text/tab-separated-values,
+    or ?format=json|csv|tsv), or N-Triples/N-Quads for CONSTRUCT and DESCRIBE, get the
+    rows streamed as they are computed instead.
+    """
     data = request.get_json()
     query_string = data.get('query', '')
     
+    # EXPLAIN (plan only) or PROFILE (run it, rows and time per operator)
+    mode = request.args.get('mode') or data.get('mode')
+    if mode in ('explain', 'profile'):
+        try:
+            if mode == 'explain':
+                report = query_optimizer.explain(query_string)
+            else:
+                _, report = query_optimizer.profile(query_string)
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, **report})
+    
+    offered = ['application/json', *RESULT_FORMATS, *GRAPH_FORMATS]
+    mimetype = negotiate_format(offered, 'application/json')
+    if mimetype is None:
+        return jsonify({"success": False, "error": f"Supported formats: {', '.join(offered)}"}), 406
+    if mimetype != 'application/json':
+        try:
+            with graph_lock:
+                result = run_query(g, query_optimizer.prepare(query_string))
+                if mimetype in GRAPH_FORMATS:
+                    if result['type_'] not in ('CONSTRUCT', 'DESCRIBE'):
+                        raise ValueError(f"{result['type_']} results are tables, ask for a SPARQL result format")
+                    graph_name = GRAPH_NAME if GRAPH_FORMATS[mimetype] == 'nquads' else None
+                    chunks = stream_result_graph(result, graph_name)
+                else:
+                    chunks = stream_results(result, RESULT_FORMATS[mimetype])
+                    # First chunk now: a query of the wrong type fails with 400 instead of a broken 200.
+                    # Later chunks are each computed under their own lock acquisition (locked_stream)
+                    chunks = itertools.chain([next(chunks)], chunks)
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return Response(logged_stream(locked_stream(chunks), query_string, result['type_'], request.path), mimetype=mimetype)
+    
     try:
-        results = g.query(query_string)
+        results = query_optimizer.query(query_string)
         result_list = []
         
         for row in results:
@@ -324,6 +649,64 @@ def execute_sparql():
             "error": str(e)
         }), 400
 
+# SPARQL Update operations allowed on /api/update: the default graph only, no LOAD/CLEAR/DROP
+UPDATE_OPERATIONS = {'InsertData', 'DeleteData', 'DeleteWhere', 'Modify'}
+
+def check_update(update):
+    """Reject update operations that would bypass the transaction (named graphs, remote loads)"""
+    for operation in update.algebra:
+        if operation.name not in UPDATE_OPERATIONS:
+            raise ValueError(f"{operation.name} is not allowed, use INSERT DATA, DELETE DATA or DELETE/INSERT WHERE")
+        if operation.name == 'Modify':
+            named = operation.using or operation.withClause or any(
+                clause is not None and clause.quads for clause in (operation.delete, operation.insert)
+            )
+        else:
+            named = bool(operation.quads)
+        if named:
+            raise ValueError("Named graphs (GRAPH, WITH, USING) are not supported, the store has a single graph")
+
+@app.route('/api/update', methods=['POST'])
+def execute_sparql_update():
+    """
+    Execute a SPARQL 1.1 Update request atomically
+    
+    The update is the raw body (Content-Type: application/sparql-update), a JSON
+    {"update": "..."} or an 'update' form field. All its operations are applied in
+    one transaction: if any fails, none is kept. The RDF file is saved once.
+    """
+    if request.mimetype == 'application/sparql-update':
+        update_string = request.get_data(as_text=True)
+    elif request.is_json:
+        update_string = (request.get_json(silent=True) or {}).get('update', '')
+    else:
+        update_string = request.form.get('update', '')
+    if not update_string.strip():
+        return jsonify({"success": False, "error": "update is required"}), 400
+    
+    try:
+        update = prepareUpdate(update_string, initNs=dict(g.namespaces()))
+        check_update(update)
+        with graph_lock:
+            with g.transaction():
+                g.update(update)
+                changes = g.changes()
+            inserted = sum(1 for added, _ in changes if added)
+            deleted = len(changes) - inserted
+            if changes:
+                refresh_derived_indexes([triple for _, triple in changes])
+                save_graph()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    return jsonify({
+        "success": True,
+        "operations": len(update.algebra),
+        "inserted": inserted,
+        "deleted": deleted,
+        "revision": graph_revision
+    })
+
 @app.route('/api/search', methods=['POST'])
 def semantic_search():
     """Semantic search with AI enhancement"""
@@ -381,7 +764,7 @@ def semantic_search():
         """
     
     try:
-        results = g.query(query)
+        results = query_optimizer.query(query)
         result_list = []
         
         for row in results:
@@ -426,7 +809,7 @@ def get_zones():
     GROUP BY ?zone ?nom ?type
     """
     
-    results = g.query(query)
+    results = query_optimizer.query(query)
     zones = []
     
     for row in results:
@@ -444,16 +827,41 @@ def natural_language_query():
     """Convert natural language to SPARQL and execute it"""
     data = request.get_json()
     user_question = data.get('question', '')
+    # 'deferred' (default): explanation fetched later, 'inline': wait for it, 'none': skip it
+    explain_mode = data.get('explain', 'deferred')
     
     if not user_question:
         return jsonify({"success": False, "error": "No question provided"}), 400
     
     try:
-        # Generate SPARQL from natural language using Gemini AI
-        sparql_query = generate_sparql_from_natural_language(user_question)
+        # Try the local templates first, only fall back to Gemini AI when none matches
+        template_match = match_natural_query(user_question)
+        source = "template" if template_match else "ai"
+        ai = None
+        if not template_match:
+            try:
+                ai = require_feature('ai')
+                sparql_query = ai.generate_sparql_from_natural_language(user_question)
+                llm_failed = sparql_query.startswith(ai.SPARQL_ERROR_PREFIX)
+            except FeatureUnavailable as e:
+                sparql_query, llm_failed = str(e), True
+            if llm_failed:
+                # LLM unavailable (open circuit, quota...): answer from keywords when possible
+                template_match = match_keywords(user_question)
+                if not template_match:
+                    return jsonify({
+                        "success": False,
+                        "error": sparql_query,
+                        "degraded": True,
+                        "question": user_question,
+                        "examples": EXAMPLE_QUESTIONS
+                    }), 503
+                source = "degraded"
+        if template_match:
+            sparql_query = template_match['query']
         
         # Execute the generated query
-        results = g.query(sparql_query)
+        results = query_optimizer.query(sparql_query)
         result_list = []
         
         for row in results:
@@ -464,17 +872,44 @@ def natural_language_query():
                     result_dict[str(var)] = str(value)
             result_list.append(result_dict)
         
-        # Get explanation of results
-        explanation = explain_sparql_results(sparql_query, len(result_list))
-        
-        return jsonify({
+        response = {
             "success": True,
             "question": user_question,
             "generatedQuery": sparql_query,
+            "source": source,
+            "template": template_match['template'] if template_match else None,
             "results": result_list,
             "count": len(result_list),
-            "explanation": explanation
-        })
+            "explanation": template_match['explanation'] if template_match else None
+        }
+        
+        # Independent LLM calls run concurrently: the explanation (templates carry
+        # their own) and, on request, related follow-up queries
+        result_count = len(result_list)
+        tasks = {}
+        if data.get('related') and ai is None:
+            try:
+                ai = require_feature('ai')
+            except FeatureUnavailable as e:
+                print(f"⚠️ Related queries skipped: {e}")
+        if ai is not None and not template_match and explain_mode != 'none':
+            tasks['explanation'] = lambda: ai.explain_sparql_results(sparql_query, result_count)
+        if ai is not None and data.get('related'):
+            tasks['relatedQueries'] = lambda: ai.suggest_related_queries(sparql_query)
+        
+        if tasks and explain_mode == 'inline':
+            followup = ai_followups.run(tasks, timeout=AI_FOLLOWUP_TIMEOUT)
+            for name in tasks:
+                response[name] = followup.get(name)
+        elif tasks:
+            # Return the results now, the caller fetches the rest when ready
+            followup_id = ai_followups.submit(tasks)
+            response["followUp"] = {
+                "id": followup_id,
+                "url": f"/api/ai/natural-query/{followup_id}"
+            }
+        
+        return jsonify(response)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -482,14 +917,145 @@ def natural_language_query():
             "question": user_question
         }), 400
 
+def wait_seconds_arg(limit):
+    """
+    ?wait=<seconds> of a long-poll endpoint, clamped to [0, limit]
+    
+    Raises:
+        ValueError: When the value is not a number
+    """
+    value = float(request.args.get('wait', 0))
+    if math.isnan(value) or value < 0:
+        return 0.0
+    return min(value, limit)
+
+@app.route('/api/ai/natural-query/<followup_id>', methods=['GET'])
+def get_natural_query_followup(followup_id):
+    """Get the deferred explanation and related queries of a natural language query"""
+    try:
+        wait_seconds = wait_seconds_arg(AI_FOLLOWUP_TIMEOUT)
+    except ValueError:
+        return jsonify({"success": False, "error": "wait must be a number of seconds"}), 400
+    followup = ai_followups.get(followup_id, wait_seconds=wait_seconds)
+    if followup is None:
+        return jsonify({"success": False, "error": "Unknown or expired follow-up"}), 404
+    
+    return jsonify({"success": True, **followup})
+
+@app.route('/api/ai/backend-stats', methods=['GET'])
+def get_llm_backend_stats():
+    """Get call/coalescing counters, circuit breaker states and shed calls of the LLM backend"""
+    llm = require_feature('llm')
+    try:
+        return jsonify({"success": True, "stats": llm.get_backend().stats()})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/ai/template-stats', methods=['GET'])
+def get_natural_query_template_stats():
+    """Get hit-rate metrics of the local natural language query templates"""
+    return jsonify({
+        "success": True,
+        "stats": get_template_stats()
+    })
+
+@app.route('/api/ai/cache-stats', methods=['GET'])
+def get_ai_cache_stats():
+    """Get hit/miss counters of the AI response cache"""
+    return jsonify({
+        "success": True,
+        "revision": graph_revision,
+        "stats": ai_cache.stats()
+    })
+
+def wants_event_stream():
+    """Whether the client asked for Server-Sent Events instead of a buffered JSON body"""
+    return request.args.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_ai_text(chunks, cached, on_complete, fallback_text):
+    """
+    Forward generated text as Server-Sent Events while the LLM is still writing
+    
+    Emits 'token' events with each chunk, then a 'done' event with the full text.
+    A cached text is sent at once as a single token.
+    """
+    def generate():
+        if cached is not None:
+            text, status = cached
+            yield sse_event('token', {'text': text})
+            yield sse_event('done', {'text': text, 'cache': status})
+            return
+        
+        parts = []
+        try:
+            for chunk in chunks():
+                parts.append(chunk)
+                yield sse_event('token', {'text': chunk})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e), 'text': fallback_text})
+            return
+        
+        text = ''.join(parts).strip()
+        on_complete(text)
+        yield sse_event('done', {'text': text, 'cache': 'miss'})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def degraded_ai_answer(field, text, error, **extra):
+    """
+    Answer of an AI route whose LLM feature cannot load (no key...): the local
+    fallback text, as the JSON body or the 'error' event of a stream
+    """
+    if wants_event_stream():
+        return Response(sse_event('error', {'error': str(error), 'text': text}), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    return jsonify({"success": True, field: text, "cache": None, "degraded": True, "details": str(error), **extra})
+
+# Served when the LLM is unavailable: questions the local templates answer
+DEGRADED_SUGGESTIONS = "\n".join(f"Description: {question}" for question in EXAMPLE_QUESTIONS)
+
 @app.route('/api/ai/suggestions', methods=['GET'])
 def get_suggestions():
-    """Get AI-powered query suggestions"""
+    """Get AI-powered query suggestions, streamed as Server-Sent Events on request"""
     try:
-        suggestions_text = get_ai_suggestions("Smart City & Mobility data")
+        ai = require_feature('ai')
+    except FeatureUnavailable as e:
+        return degraded_ai_answer("suggestions", DEGRADED_SUGGESTIONS, e)
+    try:
+        context = "Smart City & Mobility data"
+        key = ('suggestions', context)
+        is_valid = lambda text: not text.startswith(ai.SUGGESTIONS_ERROR_PREFIX)
+        degraded_text = DEGRADED_SUGGESTIONS
+        
+        if wants_event_stream():
+            cached = ai_cache.lookup(key, graph_revision, lambda: ai.get_ai_suggestions(context), is_valid)
+            revision = graph_revision
+            return stream_ai_text(
+                lambda: ai.stream_ai_suggestions(context),
+                cached,
+                lambda text: ai_cache.put(key, revision, text, is_valid),
+                fallback_text=degraded_text
+            )
+        
+        suggestions_text, cache_status = ai_cache.get(
+            key,
+            graph_revision,
+            lambda: ai.get_ai_suggestions(context),
+            is_valid=is_valid
+        )
+        degraded = not is_valid(suggestions_text)
         return jsonify({
             "success": True,
-            "suggestions": suggestions_text
+            "suggestions": degraded_text if degraded else suggestions_text,
+            "cache": cache_status,
+            "degraded": degraded
         })
     except Exception as e:
         return jsonify({
@@ -497,38 +1063,84 @@ def get_suggestions():
             "error": str(e)
         }), 400
 
+_insights_summary = {'revision': None, 'summary': ""}
+
+def get_insights_summary():
+    """Build the data summary given to the insights prompt, once per graph revision"""
+    if _insights_summary['revision'] == graph_revision:
+        return _insights_summary['summary']
+    
+    revision = graph_revision
+    stats_query = """
+    PREFIX smartcity: <http://example.org/smartcity#>
+    PREFIX ont: <http://www.co-ode.org/ontologies/ont.owl#>
+    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+    
+    SELECT 
+        (COUNT(DISTINCT ?user) as ?totalUsers)
+        (COUNT(DISTINCT ?transport) as ?totalTransports)
+        (COUNT(DISTINCT ?event) as ?totalEvents)
+    WHERE {
+        OPTIONAL { ?user rdf:type/rdfs:subClassOf* smartcity:Utilisateur }
+        OPTIONAL { ?transport rdf:type/rdfs:subClassOf* smartcity:Transport }
+        OPTIONAL { ?event rdf:type/rdfs:subClassOf* smartcity:EvenementDeCirculation }
+    }
+    """
+    
+    results = query_optimizer.query(stats_query)
+    data_summary = ""
+    for row in results:
+        data_summary = f"Users: {row.totalUsers}, Transports: {row.totalTransports}, Events: {row.totalEvents}"
+    
+    _insights_summary['revision'] = revision
+    _insights_summary['summary'] = data_summary
+    return data_summary
+
 @app.route('/api/ai/insights', methods=['GET'])
 def get_insights():
-    """Get AI insights about the smart city data"""
+    """Get AI insights about the smart city data, streamed as Server-Sent Events on request"""
     try:
-        # Get stats for context
-        stats_query = """
-        PREFIX smartcity: <http://example.org/smartcity#>
-        PREFIX ont: <http://www.co-ode.org/ontologies/ont.owl#>
-        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-        
-        SELECT 
-            (COUNT(DISTINCT ?user) as ?totalUsers)
-            (COUNT(DISTINCT ?transport) as ?totalTransports)
-            (COUNT(DISTINCT ?event) as ?totalEvents)
-        WHERE {
-            OPTIONAL { ?user rdf:type/rdfs:subClassOf* smartcity:Utilisateur }
-            OPTIONAL { ?transport rdf:type/rdfs:subClassOf* smartcity:Transport }
-            OPTIONAL { ?event rdf:type/rdfs:subClassOf* smartcity:EvenementDeCirculation }
-        }
-        """
-        
-        results = g.query(stats_query)
-        data_summary = ""
-        for row in results:
-            data_summary = f"Users: {row.totalUsers}, Transports: {row.totalTransports}, Events: {row.totalEvents}"
-        
-        insights = get_smart_city_insights(data_summary)
-        
-        return jsonify({
+        ai = require_feature('ai')
+    except FeatureUnavailable as e:
+        try:
+            data_summary = get_insights_summary()
+        except Exception as summary_error:
+            return jsonify({"success": False, "error": str(summary_error)}), 400
+        return degraded_ai_answer("insights", f"Analyse IA indisponible. Données actuelles : {data_summary}", e,
+                                  summary=data_summary)
+    try:
+        data_summary = get_insights_summary()
+        key = ('insights',)
+        # The prompt only depends on the counts: edits that leave them unchanged keep the insights
+        fingerprint = data_summary
+        is_valid = lambda text: text != ai.INSIGHTS_UNAVAILABLE
+        
+        if wants_event_stream():
+            cached = ai_cache.lookup(key, fingerprint, lambda: ai.get_smart_city_insights(data_summary), is_valid)
+            return stream_ai_text(
+                lambda: ai.stream_smart_city_insights(data_summary),
+                cached,
+                lambda text: ai_cache.put(key, fingerprint, text, is_valid),
+                fallback_text=ai.INSIGHTS_UNAVAILABLE
+            )
+        
+        insights, cache_status = ai_cache.get(
+            key,
+            fingerprint,
+            lambda: ai.get_smart_city_insights(data_summary),
+            is_valid=is_valid
+        )
+        
+        degraded = not is_valid(insights)
+        response = {
             "success": True,
-            "insights": insights
-        })
+            "insights": insights,
+            "cache": cache_status,
+            "degraded": degraded
+        }
+        if degraded:
+            response["summary"] = data_summary
+        return jsonify(response)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -551,37 +1163,24 @@ def register():
         if not username or not email or not password:
             return jsonify({'success': False, 'error': 'All fields are required'}), 400
         
-        # Check if username already exists
-        query = f"""
-        SELECT ?user WHERE {{
-            ?user ont:Nom "{username}" .
-        }}
-        """
-        results = g.query(query)
-        if len(list(results)) > 0:
-            return jsonify({'success': False, 'error': 'Username already exists'}), 400
-        
-        # Check if email already exists
-        query = f"""
-        SELECT ?user WHERE {{
-            ?user ont:Email "{email}" .
-        }}
-        """
-        results = g.query(query)
-        if len(list(results)) > 0:
-            return jsonify({'success': False, 'error': 'Email already exists'}), 400
-        
-        # Create new user
-        user_count = len(list(g.subjects(RDF.type, ONT.Citoyen))) + len(list(g.subjects(RDF.type, ONT.Touriste)))
-        user_id = f"Utilisateur_{user_count + 1}"
-        user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
-        
-        # Add user triples
-        g.add((user_uri, RDF.type, ONT.Citoyen))
-        g.add((user_uri, ONT.Nom, Literal(username)))
-        g.add((user_uri, ONT.Email, Literal(email)))
-        g.add((user_uri, ONT.MotDePasse, Literal(password)))  # In production, use hashing!
-        g.add((user_uri, ONT.Age, Literal(25, datatype=XSD.decimal)))  # Default age
+        # Check and insert atomically so concurrent sign-ups cannot take the same name
+        with graph_lock:
+            if user_index.name_taken(username):
+                return jsonify({'success': False, 'error': 'Username already exists'}), 400
+            if user_index.email_taken(email):
+                return jsonify({'success': False, 'error': 'Email already exists'}), 400
+            
+            # Create new user
+            user_id = id_sequences.next_id('Utilisateur')
+            user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
+            
+            # Add user triples
+            g.add((user_uri, RDF.type, ONT.Citoyen))
+            g.add((user_uri, ONT.Nom, Literal(username)))
+            g.add((user_uri, ONT.Email, Literal(email)))
+            g.add((user_uri, ONT.MotDePasse, Literal(password)))  # In production, use hashing!
+            g.add((user_uri, ONT.Age, Literal(25, datatype=XSD.decimal)))  # Default age
+            user_index.add(user_uri, username, email)
         
         save_graph()
         
@@ -609,24 +1208,13 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'error': 'Username and password are required'}), 400
         
-        # Query for user with matching username and password
-        query = f"""
-        SELECT ?user ?email ?age WHERE {{
-            ?user ont:Nom "{username}" .
-            ?user ont:MotDePasse "{password}" .
-            OPTIONAL {{ ?user ont:Email ?email }}
-            OPTIONAL {{ ?user ont:Age ?age }}
-        }}
-        """
-        results = list(g.query(query))
-        
-        if len(results) == 0:
+        user_uri = user_index.authenticate(g, username, password, ONT.MotDePasse)
+        if user_uri is None:
             return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
         
-        # User found
-        user_data = results[0]
-        user_uri = str(user_data[0])
-        user_id = user_uri.split('#')[-1]
+        user_id = str(user_uri).split('#')[-1]
+        email = g.value(user_uri, ONT.Email)
+        age = g.value(user_uri, ONT.Age)
         
         return jsonify({
             'success': True,
@@ -634,135 +1222,298 @@ def login():
             'user': {
                 'id': user_id,
                 'username': username,
-                'email': str(user_data[1]) if user_data[1] else '',
-                'age': int(user_data[2]) if user_data[2] else 0
+                'email': str(email) if email else '',
+                'age': int(age) if age else 0
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Entity kind -> (ID field of the legacy JSON body, upload function, image URL property)
+IMAGE_UPLOADS = {
+    'profile': ('user_id', 'upload_profile_image', ONT.ImageURL),
+    'station': ('station_id', 'upload_station_image', ONT.ImageURL),
+    'transport': ('transport_id', 'upload_station_image', ONT.ImageURL),  # Reuse station upload function
+    'event': ('event_id', 'upload_station_image', ONT.imageUrl),
+}
+
+IMAGE_URL_PROPERTIES = (ONT.ImageURL, ONT.imageUrl)
+
+def referenced_image_ids(images):
+    """Public IDs of every image the graph still points to, by ID or by URL"""
+    with graph_lock:
+        public_ids = {str(o) for o in g.objects(None, ONT.ImagePublicId)}
+        urls = [str(o) for prop in IMAGE_URL_PROPERTIES for o in g.objects(None, prop)]
+    public_ids.update(filter(None, (images.store.public_id_from_url(url) for url in urls)))
+    return public_ids
+
+def entity_image_ids(entity_uri):
+    """Public IDs of the images of one entity, or an empty set when images are disabled"""
+    try:
+        images = require_feature('images')
+    except FeatureUnavailable:
+        return set()
+    public_ids = {str(o) for o in g.objects(entity_uri, ONT.ImagePublicId)}
+    for prop in IMAGE_URL_PROPERTIES:
+        public_ids.update(filter(None, (images.store.public_id_from_url(str(o)) for o in g.objects(entity_uri, prop))))
+    return public_ids
+
+def record_entity_image(entity_id, url_property, result):
+    """
+    Point an existing entity to its uploaded image; call with graph_lock held
+    
+    New entities upload their image before they are created: only existing ones are updated.
+    
+    Returns:
+        set: Public IDs of the images the entity no longer references, or None if it does not exist
+    """
+    from rdflib import Literal, URIRef
+    entity_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{entity_id}")
+    if (entity_uri, RDF.type, None) not in g:
+        return None
+    previous = entity_image_ids(entity_uri)
+    g.remove((entity_uri, url_property, None))
+    g.remove((entity_uri, ONT.ImagePublicId, None))
+    g.add((entity_uri, url_property, Literal(result['url'])))
+    g.add((entity_uri, ONT.ImagePublicId, Literal(result['public_id'])))
+    return previous - {result['public_id']}
+
+def run_image_upload(job, kind, entity_id, path):
+    """Background job: send a spooled image to Cloudinary, then record its URL on the entity"""
+    _, upload_function, url_property = IMAGE_UPLOADS[kind]
+    try:
+        job.report(stage='uploading')
+        result = getattr(require_feature('images'), upload_function)(path, entity_id)
+    finally:
+        discard_upload(path)
+    
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    
+    job.report(stage='saving')
+    with graph_lock:
+        replaced = record_entity_image(entity_id, url_property, result)
+        result['graphUpdated'] = replaced is not None
+        if replaced is not None:
+            save_graph()
+    if replaced:
+        schedule_asset_gc(replaced)
+    return result
+
+def run_bulk_image_upload(job, kind, items):
+    """Background job: upload several spooled images, then record them with a single save"""
+    _, upload_function, url_property = IMAGE_UPLOADS[kind]
+    try:
+        results = asset_manager.upload_batch(
+            require_feature('images'),
+            [{'upload': upload_function, 'entityId': entity_id, 'path': path} for entity_id, path in items],
+            job=job
+        )
+    finally:
+        for _, path in items:
+            discard_upload(path)
+    
+    job.report(stage='saving')
+    replaced = set()
+    with graph_lock:
+        for result in results:
+            if 'error' not in result:
+                previous = record_entity_image(result['entityId'], url_property, result)
+                result['graphUpdated'] = previous is not None
+                replaced |= previous or set()
+        if any(result.get('graphUpdated') for result in results):
+            save_graph()
+    if replaced:
+        schedule_asset_gc(replaced)
+    return {
+        'uploaded': sum(1 for result in results if 'error' not in result),
+        'failed': sum(1 for result in results if 'error' in result),
+        'images': results
+    }
+
+def run_asset_gc(job, candidates=None, dry_run=False):
+    """Background job: delete hosted images no entity references any more"""
+    images = require_feature('images')
+    return asset_manager.collect(images, lambda: referenced_image_ids(images),
+                                 candidates=candidates, dry_run=dry_run, job=job)
+
+def schedule_asset_gc(candidates=None, dry_run=False):
+    """Queue a garbage collection pass, over some public IDs or every managed asset"""
+    if candidates is not None and not candidates:
+        return None
+    try:
+        return upload_jobs.submit('asset-gc', run_asset_gc, sorted(candidates) if candidates else None, dry_run,
+                                  meta={'targeted': candidates is not None})
+    except QueueFull as e:
+        print(f"⚠️ Asset GC not scheduled: {e}")
+        return None
+
+def accept_image_upload(kind):
+    """
+    Spool an uploaded image to disk and queue its upload to Cloudinary
+    
+    Accepts multipart/form-data (field 'image', plus the entity ID field) or the
+    legacy JSON body with base64 'image_data'. Answers 202 with the job to poll.
+    """
+    require_feature('images')
+    id_field = IMAGE_UPLOADS[kind][0]
+    
+    # Base64 JSON bodies are 4/3 of the image size, multipart adds a little framing
+    if request.content_length and request.content_length > MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024:
+        return jsonify({'success': False, 'error': f'Image larger than {MAX_UPLOAD_BYTES} bytes'}), 413
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            image = request.files.get('image') or request.files.get('file')
+            entity_id = request.form.get(id_field) or request.form.get('id')
+            if not entity_id or image is None:
+                return jsonify({'success': False, 'error': f'{id_field} and image are required'}), 400
+            path, size = spool_upload_stream(image.stream, image.mimetype)
+        else:
+            data = request.get_json(silent=True) or {}
+            entity_id = data.get(id_field)
+            image_data = data.get('image_data')
+            if not entity_id or not image_data:
+                return jsonify({'success': False, 'error': f'{id_field} and image_data are required'}), 400
+            path, size = spool_upload_base64(image_data)
+    except UploadRejected as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    
+    try:
+        job = upload_jobs.submit('image-upload', run_image_upload, kind, entity_id, path,
+                                 meta={'entity': kind, 'entityId': entity_id, 'bytes': size})
+    except QueueFull as e:
+        discard_upload(path)
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    return jsonify({
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f"/api/upload/jobs/{job.id}"
+    }), 202
+
 @app.route('/api/upload/profile-image', methods=['POST'])
 def upload_user_profile_image():
     """Upload user profile image to Cloudinary"""
-    try:
-        data = request.json
-        user_id = data.get('user_id')
-        image_data = data.get('image_data')
-        
-        if not user_id or not image_data:
-            return jsonify({'success': False, 'error': 'user_id and image_data are required'}), 400
-        
-        # Upload to Cloudinary
-        result = upload_profile_image(image_data, user_id)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        # Update user's image URL in RDF
-        from rdflib import Literal, URIRef
-        user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
-        
-        # Remove old image URL
-        g.remove((user_uri, ONT.ImageURL, None))
-        
-        # Add new image URL
-        g.add((user_uri, ONT.ImageURL, Literal(result['url'])))
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'url': result['url'],
-            'public_id': result['public_id']
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+    return accept_image_upload('profile')
 
 @app.route('/api/upload/transport-image', methods=['POST'])
 def upload_transport_image_endpoint():
     """Upload transport image to Cloudinary"""
-    try:
-        data = request.json
-        transport_id = data.get('transport_id')
-        image_data = data.get('image_data')
-        
-        if not transport_id or not image_data:
-            return jsonify({'success': False, 'error': 'transport_id and image_data are required'}), 400
-        
-        # Upload to Cloudinary  
-        from cloudinary_helper import upload_station_image
-        result = upload_station_image(image_data, transport_id)  # Reuse station upload function
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({
-            'success': True,
-            'url': result['url'],
-            'public_id': result['public_id']
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+    return accept_image_upload('transport')
 
 @app.route('/api/upload/station-image', methods=['POST'])
 def upload_station_image_endpoint():
     """Upload station image to Cloudinary"""
-    try:
-        data = request.json
-        station_id = data.get('station_id')
-        image_data = data.get('image_data')
-        
-        if not station_id or not image_data:
-            return jsonify({'success': False, 'error': 'station_id and image_data are required'}), 400
-        
-        # Upload to Cloudinary
-        result = upload_station_image(image_data, station_id)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        # Update station's image URL in RDF
-        from rdflib import Literal, URIRef
-        station_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{station_id}")
-        
-        # Remove old image URL
-        g.remove((station_uri, ONT.ImageURL, None))
-        
-        # Add new image URL
-        g.add((station_uri, ONT.ImageURL, Literal(result['url'])))
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'url': result['url'],
-            'public_id': result['public_id']
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+    return accept_image_upload('station')
 
 @app.route('/api/upload/event-image', methods=['POST'])
 def upload_event_image_endpoint():
     """Upload event image to Cloudinary"""
+    return accept_image_upload('event')
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Get the status of an image upload job (?wait=<seconds> to long-poll until it finishes)"""
     try:
-        data = request.json
-        event_id = data.get('event_id')
-        image_data = data.get('image_data')
-        
-        if not event_id or not image_data:
-            return jsonify({'success': False, 'error': 'event_id and image_data are required'}), 400
-        
-        # Upload to Cloudinary - reuse station upload function
-        result = upload_station_image(image_data, event_id)
-        
-        if 'error' in result:
-            return jsonify({'success': False, 'error': result['error']}), 400
-        
-        return jsonify({
-            'success': True,
-            'url': result['url'],
-            'public_id': result['public_id']
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+        wait_seconds = wait_seconds_arg(UPLOAD_WAIT_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'wait must be a number of seconds'}), 400
+    job = upload_jobs.get(job_id, wait_seconds=wait_seconds)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired upload job'}), 404
+    
+    response = {'success': True, **job.to_dict()}
+    if job.status == 'done' and 'url' in job.result:
+        response['url'] = job.result['url']
+        response['public_id'] = job.result['public_id']
+    return jsonify(response)
+
+@app.route('/api/upload/jobs', methods=['GET'])
+def get_upload_job_stats():
+    """Get queue counters of the image upload pool, and bytes saved by deduplication and resizing"""
+    images = require_feature('images')
+    return jsonify({
+        'success': True,
+        'stats': upload_jobs.stats(),
+        'images': images.get_upload_stats()
+    })
+
+@app.route('/api/upload/bulk', methods=['POST'])
+def upload_images_bulk():
+    """
+    Upload several images at once (multipart: 'entity', then one 'ids' field per 'images' file, in order)
+    
+    Answers 202 with a single job; the graph is saved once when every upload is done.
+    """
+    require_feature('images')
+    kind = request.form.get('entity', '')
+    if kind not in IMAGE_UPLOADS:
+        return jsonify({'success': False, 'error': f"entity must be one of {', '.join(IMAGE_UPLOADS)}"}), 400
+    
+    files = request.files.getlist('images')
+    entity_ids = request.form.getlist('ids')
+    if not files or len(files) != len(entity_ids):
+        return jsonify({'success': False, 'error': 'Send one ids field per images file'}), 400
+    if len(files) > MAX_BULK_IMAGES:
+        return jsonify({'success': False, 'error': f'At most {MAX_BULK_IMAGES} images per request'}), 400
+    
+    items = []
+    try:
+        for entity_id, image in zip(entity_ids, files):
+            path, _ = spool_upload_stream(image.stream, image.mimetype)
+            items.append((entity_id, path))
+        job = upload_jobs.submit('image-bulk-upload', run_bulk_image_upload, kind, items,
+                                 meta={'entity': kind, 'count': len(items)})
+    except UploadRejected as e:
+        for _, path in items:
+            discard_upload(path)
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except QueueFull as e:
+        for _, path in items:
+            discard_upload(path)
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    return jsonify({
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f"/api/upload/jobs/{job.id}"
+    }), 202
+
+@app.route('/api/assets/gc', methods=['POST'])
+def collect_image_assets():
+    """Queue a garbage collection pass over the hosted images ({"dryRun": true} only reports)"""
+    require_feature('images')
+    data = request.get_json(silent=True) or {}
+    job = schedule_asset_gc(dry_run=bool(data.get('dryRun')))
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job queue full, try again later'}), 503, {'Retry-After': '5'}
+    return jsonify({
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f"/api/upload/jobs/{job.id}"
+    }), 202
+
+@app.route('/api/assets', methods=['GET'])
+def get_image_assets_stats():
+    """Get bulk upload and garbage collection counters"""
+    images = require_feature('images')
+    return jsonify({
+        'success': True,
+        'referenced': len(referenced_image_ids(images)),
+        'stats': asset_manager.stats()
+    })
+
+@app.route('/media/<path:filename>', methods=['GET'])
+def get_local_image(filename):
+    """Serve images kept by the local image store (IMAGE_STORE=local)"""
+    images = require_feature('images')
+    if images.store.name != 'local':
+        return jsonify({'error': 'Images are hosted on Cloudinary'}), 404
+    return send_from_directory(images.store.root, filename)
 
 @app.route('/api/ai/related-queries', methods=['POST'])
 def get_related_queries():
@@ -773,8 +1524,9 @@ def get_related_queries():
     if not current_query:
         return jsonify({"success": False, "error": "No query provided"}), 400
     
+    ai = require_feature('ai')
     try:
-        related = suggest_related_queries(current_query)
+        related = ai.suggest_related_queries(current_query)
         return jsonify({
             "success": True,
             "relatedQueries": related
@@ -789,481 +1541,828 @@ def get_related_queries():
 
 def save_graph():
     """Helper function to save the graph to RDF file"""
+    global graph_revision
+    storage = 'file' if shards is None else 'shards'
     try:
-        g.serialize(destination=rdf_file, format='xml')
+        with graph_lock:
+            graph_revision += 1
+            start = time.perf_counter()
+            if shards is None:
+                g.serialize(destination=rdf_file, format='xml')
+                written = os.path.getsize(rdf_file)
+            else:
+                # Only the files owning changed subjects are rewritten
+                changed, g.dirty_subjects = g.dirty_subjects, set()
+                try:
+                    names = shards.save(g, changed)
+                except Exception:
+                    g.dirty_subjects |= changed
+                    raise
+                written = sum(os.path.getsize(shards.files[name]) for name in names)
+            id_sequences.save()
+            SAVE_SECONDS.observe(time.perf_counter() - start, storage)
+            SAVE_BYTES.set(written, storage)
         return True
     except Exception as e:
+        SAVE_FAILURES.inc(storage)
         print(f"Error saving graph: {e}")
         return False
 
-# ========== USER CRUD ==========
-@app.route('/api/users', methods=['POST'])
-def create_user():
-    """Create a new user"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        
-        # Generate unique ID
-        user_count = len(list(g.subjects(RDF.type, ONT.Citoyen))) + len(list(g.subjects(RDF.type, ONT.Touriste)))
-        user_id = f"Utilisateur_{user_count + 1}"
-        user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
-        
-        # Determine user type
-        user_type = ONT.Citoyen if data.get('type') == 'Citoyen' else ONT.Touriste
-        
-        # Add triples
-        g.add((user_uri, RDF.type, user_type))
-        g.add((user_uri, ONT.Nom, Literal(data['nom'])))
-        g.add((user_uri, ONT.Age, Literal(int(data['age']), datatype=XSD.decimal)))
-        g.add((user_uri, ONT.Email, Literal(data['email'])))
-        
-        if data.get('carteAbonnement'):
-            g.add((user_uri, ONT.CarteAbonnement, Literal(data['carteAbonnement'] == 'true', datatype=XSD.boolean)))
-        
-        # Save to file
+# ========== ENTITY HELPERS ==========
+# Shared by the single CRUD routes and the bulk endpoints: they change the
+# graph (and the user index) but never save it, the caller does
+
+class EntityNotFound(Exception):
+    """Raised when an update or delete targets an unknown entity"""
+
+def entity_uri(entity_id):
+    from rdflib import URIRef
+    return URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{entity_id}")
+
+def require_entity(entity_id, label):
+    """URI of an existing entity, or EntityNotFound"""
+    uri = entity_uri(entity_id)
+    if not (uri, RDF.type, None) in g:
+        raise EntityNotFound(f'{label} not found')
+    return uri
+
+def delete_entity(entity_id, label):
+    """
+    Remove an entity and every triple pointing to it
+    
+    Returns:
+        set: Public IDs of its images, for garbage collection once saved
+    """
+    uri = require_entity(entity_id, label)
+    images = entity_image_ids(uri)
+    g.remove((uri, None, None))
+    g.remove((None, None, uri))
+    user_index.refresh(g, uri)
+    return images
+
+def release_replaced_image(uri, data, images):
+    """
+    Drop the recorded public ID once the image URL no longer points to it
+    
+    Returns:
+        set: Public IDs of the images the entity stopped using
+    """
+    for public_id in list(g.objects(uri, ONT.ImagePublicId)):
+        if str(public_id) not in (data.get('imageUrl') or ''):
+            g.remove((uri, ONT.ImagePublicId, public_id))
+    return images - entity_image_ids(uri)
+
+def create_user_entity(data):
+    from rdflib import Literal, XSD
+    
+    # Generate unique ID
+    user_id = id_sequences.next_id('Utilisateur')
+    user_uri = entity_uri(user_id)
+    
+    # Determine user type
+    user_type = ONT.Citoyen if data.get('type') == 'Citoyen' else ONT.Touriste
+    
+    # Add triples
+    g.add((user_uri, RDF.type, user_type))
+    g.add((user_uri, ONT.Nom, Literal(data['nom'])))
+    g.add((user_uri, ONT.Age, Literal(int(data['age']), datatype=XSD.decimal)))
+    g.add((user_uri, ONT.Email, Literal(data['email'])))
+    
+    if data.get('carteAbonnement'):
+        g.add((user_uri, ONT.CarteAbonnement, Literal(data['carteAbonnement'] == 'true', datatype=XSD.boolean)))
+    user_index.refresh(g, user_uri)
+    return user_id
+
+def update_user_entity(user_id, data):
+    from rdflib import Literal, XSD
+    user_uri = require_entity(user_id, 'User')
+    
+    # Remove old properties
+    g.remove((user_uri, ONT.Nom, None))
+    g.remove((user_uri, ONT.Age, None))
+    g.remove((user_uri, ONT.Email, None))
+    g.remove((user_uri, ONT.CarteAbonnement, None))
+    
+    # Add new properties
+    g.add((user_uri, ONT.Nom, Literal(data['nom'])))
+    g.add((user_uri, ONT.Age, Literal(int(data['age']), datatype=XSD.decimal)))
+    g.add((user_uri, ONT.Email, Literal(data['email'])))
+    
+    if data.get('carteAbonnement'):
+        g.add((user_uri, ONT.CarteAbonnement, Literal(data['carteAbonnement'] == 'true', datatype=XSD.boolean)))
+    user_index.refresh(g, user_uri)
+    return set()
+
+def create_transport_entity(data):
+    from rdflib import Literal, XSD
+    
+    # Generate unique ID
+    transport_id = id_sequences.next_id(data.get('type', 'Transport'))
+    transport_uri = entity_uri(transport_id)
+    
+    # Determine transport type
+    type_map = {
+        'Bus': ONT.Bus,
+        'Métro': ONT.Métro,
+        'Vélo': ONT.Vélo,
+        'VoiturePartagée': ONT.VoiturePartagée,
+        'Trottinette': ONT.Trottinette
+    }
+    transport_type = type_map.get(data.get('type'), ONT.Bus)
+    
+    # Add triples
+    g.add((transport_uri, RDF.type, transport_type))
+    if data.get('nom'):
+        g.add((transport_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('capacite'):
+        g.add((transport_uri, ONT.Capacite, Literal(int(data['capacite']), datatype=XSD.decimal)))
+    if data.get('immatriculation'):
+        g.add((transport_uri, ONT.Immatriculation, Literal(data['immatriculation'])))
+    if data.get('vitesseMax'):
+        g.add((transport_uri, ONT.VitesseMax, Literal(int(data['vitesseMax']), datatype=XSD.decimal)))
+    if 'electrique' in data:
+        g.add((transport_uri, ONT.estElectrique, Literal(data['electrique'] == 'true', datatype=XSD.boolean)))
+    if data.get('imageUrl'):
+        g.add((transport_uri, ONT.ImageURL, Literal(data['imageUrl'])))
+    return transport_id
+
+def update_transport_entity(transport_id, data):
+    from rdflib import Literal, XSD
+    transport_uri = require_entity(transport_id, 'Transport')
+    
+    # Remove old properties
+    g.remove((transport_uri, ONT.Nom, None))
+    g.remove((transport_uri, ONT.Capacite, None))
+    g.remove((transport_uri, ONT.Immatriculation, None))
+    g.remove((transport_uri, ONT.VitesseMax, None))
+    g.remove((transport_uri, ONT.estElectrique, None))
+    images = entity_image_ids(transport_uri)
+    g.remove((transport_uri, ONT.ImageURL, None))
+    
+    # Add new properties
+    if data.get('nom'):
+        g.add((transport_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('capacite'):
+        g.add((transport_uri, ONT.Capacite, Literal(int(data['capacite']), datatype=XSD.decimal)))
+    if data.get('immatriculation'):
+        g.add((transport_uri, ONT.Immatriculation, Literal(data['immatriculation'])))
+    if data.get('vitesseMax'):
+        g.add((transport_uri, ONT.VitesseMax, Literal(int(data['vitesseMax']), datatype=XSD.decimal)))
+    if 'electrique' in data:
+        g.add((transport_uri, ONT.estElectrique, Literal(data['electrique'] == 'true', datatype=XSD.boolean)))
+    if data.get('imageUrl'):
+        g.add((transport_uri, ONT.ImageURL, Literal(data['imageUrl'])))
+    return release_replaced_image(transport_uri, data, images)
+
+def create_station_entity(data):
+    from rdflib import Literal, XSD
+    
+    station_id = id_sequences.next_id('Station')
+    station_uri = entity_uri(station_id)
+    
+    # Determine station type
+    type_map = {
+        'StationBus': ONT.StationBus,
+        'StationMétro': ONT.StationMétro,
+        'Parking': ONT.Parking
+    }
+    station_type = type_map.get(data.get('type'), ONT.StationBus)
+    
+    g.add((station_uri, RDF.type, station_type))
+    if data.get('nom'):
+        g.add((station_uri, ONT.aNomStation, Literal(data['nom'])))
+    if data.get('latitude'):
+        g.add((station_uri, ONT.aLatitude, Literal(float(data['latitude']), datatype=XSD.decimal)))
+    if data.get('longitude'):
+        g.add((station_uri, ONT.aLongitude, Literal(float(data['longitude']), datatype=XSD.decimal)))
+    return station_id
+
+def update_station_entity(station_id, data):
+    from rdflib import Literal, XSD
+    station_uri = require_entity(station_id, 'Station')
+    
+    g.remove((station_uri, ONT.aNomStation, None))
+    g.remove((station_uri, ONT.aLatitude, None))
+    g.remove((station_uri, ONT.aLongitude, None))
+    
+    if data.get('nom'):
+        g.add((station_uri, ONT.aNomStation, Literal(data['nom'])))
+    if data.get('latitude'):
+        g.add((station_uri, ONT.aLatitude, Literal(float(data['latitude']), datatype=XSD.decimal)))
+    if data.get('longitude'):
+        g.add((station_uri, ONT.aLongitude, Literal(float(data['longitude']), datatype=XSD.decimal)))
+    return set()
+
+def create_event_entity(data):
+    from rdflib import Literal, XSD
+    
+    event_id = id_sequences.next_id(data.get('type', 'Event'))
+    event_uri = entity_uri(event_id)
+    
+    type_map = {
+        'Accident': ONT.Accident,
+        'Embouteillage': ONT.Embouteillage,
+        'Travaux': SMARTCITY.EvenementDeCirculation  # Generic type for construction
+    }
+    event_type = type_map.get(data.get('type'), ONT.Accident)
+    
+    g.add((event_uri, RDF.type, event_type))
+    if data.get('nom'):
+        g.add((event_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('description'):
+        g.add((event_uri, ONT.aDescription, Literal(data['description'])))
+    if data.get('gravite'):
+        g.add((event_uri, ONT.aGravite, Literal(int(data['gravite']), datatype=XSD.int)))
+    if data.get('date'):
+        g.add((event_uri, ONT.aDateEvenement, Literal(data['date'], datatype=XSD.dateTime)))
+    if data.get('imageUrl'):
+        g.add((event_uri, ONT.imageUrl, Literal(data['imageUrl'])))
+    return event_id
+
+def update_event_entity(event_id, data):
+    from rdflib import Literal, XSD
+    event_uri = require_entity(event_id, 'Event')
+    
+    g.remove((event_uri, ONT.Nom, None))
+    g.remove((event_uri, ONT.aDescription, None))
+    g.remove((event_uri, ONT.aGravite, None))
+    g.remove((event_uri, ONT.aDateEvenement, None))
+    images = entity_image_ids(event_uri)
+    g.remove((event_uri, ONT.imageUrl, None))
+    
+    if data.get('nom'):
+        g.add((event_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('description'):
+        g.add((event_uri, ONT.aDescription, Literal(data['description'])))
+    if data.get('gravite'):
+        g.add((event_uri, ONT.aGravite, Literal(int(data['gravite']), datatype=XSD.int)))
+    if data.get('date'):
+        g.add((event_uri, ONT.aDateEvenement, Literal(data['date'], datatype=XSD.dateTime)))
+    if data.get('imageUrl'):
+        g.add((event_uri, ONT.imageUrl, Literal(data['imageUrl'])))
+    return release_replaced_image(event_uri, data, images)
+
+def create_zone_entity(data):
+    from rdflib import Literal, XSD
+    
+    zone_id = id_sequences.next_id('Zone')
+    zone_uri = entity_uri(zone_id)
+    
+    type_map = {
+        'CentreVille': ONT.CentreVille,
+        'Banlieue': ONT.Banlieue,
+        'ZoneIndustrielle': ONT.ZoneIndustrielle
+    }
+    zone_type = type_map.get(data.get('type'), ONT.CentreVille)
+    
+    g.add((zone_uri, RDF.type, zone_type))
+    if data.get('nom'):
+        g.add((zone_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('superficie'):
+        g.add((zone_uri, ONT.Superficie, Literal(float(data['superficie']), datatype=XSD.decimal)))
+    if data.get('population'):
+        g.add((zone_uri, ONT.Population, Literal(int(data['population']), datatype=XSD.int)))
+    if data.get('description'):
+        g.add((zone_uri, ONT.aDescription, Literal(data['description'])))
+    return zone_id
+
+def update_zone_entity(zone_id, data):
+    from rdflib import Literal, XSD
+    zone_uri = require_entity(zone_id, 'Zone')
+    
+    g.remove((zone_uri, ONT.Nom, None))
+    g.remove((zone_uri, ONT.Superficie, None))
+    g.remove((zone_uri, ONT.Population, None))
+    g.remove((zone_uri, ONT.aDescription, None))
+    
+    if data.get('nom'):
+        g.add((zone_uri, ONT.Nom, Literal(data['nom'])))
+    if data.get('superficie'):
+        g.add((zone_uri, ONT.Superficie, Literal(float(data['superficie']), datatype=XSD.decimal)))
+    if data.get('population'):
+        g.add((zone_uri, ONT.Population, Literal(int(data['population']), datatype=XSD.int)))
+    if data.get('description'):
+        g.add((zone_uri, ONT.aDescription, Literal(data['description'])))
+    return set()
+
+# Collection -> (label, create helper, update helper)
+ENTITY_COLLECTIONS = {
+    'users': ('User', create_user_entity, update_user_entity),
+    'transports': ('Transport', create_transport_entity, update_transport_entity),
+    'stations': ('Station', create_station_entity, update_station_entity),
+    'events': ('Event', create_event_entity, update_event_entity),
+    'zones': ('Zone', create_zone_entity, update_zone_entity),
+}
+
+def create_entity_response(collection):
+    """POST /api/<collection>: create one entity in a transaction"""
+    label, create, _ = ENTITY_COLLECTIONS[collection]
+    try:
+        with graph_lock, g.transaction():
+            entity_id = create(request.json)
         save_graph()
         
         return jsonify({
             'success': True,
-            'message': 'User created successfully',
-            'id': user_id
+            'message': f'{label} created successfully',
+            'id': entity_id
         }), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-@app.route('/api/users/<user_id>', methods=['PUT'])
-def update_user(user_id):
-    """Update an existing user"""
+def update_entity_response(collection, entity_id):
+    """PUT /api/<collection>/<id>: update one entity in a transaction"""
+    label, _, update = ENTITY_COLLECTIONS[collection]
     try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
-        
-        # Check if user exists
-        if not (user_uri, RDF.type, None) in g:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Remove old properties
-        g.remove((user_uri, ONT.Nom, None))
-        g.remove((user_uri, ONT.Age, None))
-        g.remove((user_uri, ONT.Email, None))
-        g.remove((user_uri, ONT.CarteAbonnement, None))
-        
-        # Add new properties
-        g.add((user_uri, ONT.Nom, Literal(data['nom'])))
-        g.add((user_uri, ONT.Age, Literal(int(data['age']), datatype=XSD.decimal)))
-        g.add((user_uri, ONT.Email, Literal(data['email'])))
-        
-        if data.get('carteAbonnement'):
-            g.add((user_uri, ONT.CarteAbonnement, Literal(data['carteAbonnement'] == 'true', datatype=XSD.boolean)))
-        
+        with graph_lock, g.transaction():
+            released = update(entity_id, request.json)
         save_graph()
+        schedule_asset_gc(released)
         
-        return jsonify({'success': True, 'message': 'User updated successfully'})
+        return jsonify({'success': True, 'message': f'{label} updated successfully'})
+    except EntityNotFound as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-@app.route('/api/users/<user_id>', methods=['DELETE'])
-def delete_user(user_id):
-    """Delete a user"""
+def delete_entity_response(collection, entity_id):
+    """DELETE /api/<collection>/<id>: delete one entity and collect its images"""
+    label = ENTITY_COLLECTIONS[collection][0]
     try:
-        from rdflib import URIRef
-        user_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{user_id}")
-        
-        # Check if user exists
-        if not (user_uri, RDF.type, None) in g:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Remove all triples related to this user
-        g.remove((user_uri, None, None))
-        g.remove((None, None, user_uri))
-        
+        with graph_lock, g.transaction():
+            images = delete_entity(entity_id, label)
         save_graph()
+        schedule_asset_gc(images)
         
-        return jsonify({'success': True, 'message': 'User deleted successfully'})
+        return jsonify({'success': True, 'message': f'{label} deleted successfully'})
+    except EntityNotFound as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def apply_bulk_operation(collection, operation):
+    """
+    Apply one operation of a bulk request
+    
+    Returns:
+        tuple: (entity ID, public IDs of the images it released)
+    """
+    label, create, update = ENTITY_COLLECTIONS[collection]
+    if not isinstance(operation, dict):
+        raise ValueError('Each operation must be an object')
+    op = operation.get('op')
+    data = operation.get('data') or {}
+    if op not in ('create', 'update', 'delete'):
+        raise ValueError(f"Unknown op '{op}', expected create, update or delete")
+    if op == 'create':
+        return create(data), set()
+    entity_id = operation.get('id')
+    if not entity_id:
+        raise ValueError(f"'{op}' operations need an id")
+    if op == 'update':
+        return entity_id, update(entity_id, data)
+    return entity_id, delete_entity(entity_id, label)
+
+# ========== USER CRUD ==========
+@app.route('/api/users', methods=['POST'])
+def create_user():
+    """Create a new user"""
+    return create_entity_response('users')
+
+@app.route('/api/users/<user_id>', methods=['PUT'])
+def update_user(user_id):
+    """Update an existing user"""
+    return update_entity_response('users', user_id)
+
+@app.route('/api/users/<user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    """Delete a user"""
+    return delete_entity_response('users', user_id)
+
 # ========== TRANSPORT CRUD ==========
 @app.route('/api/transports', methods=['POST'])
 def create_transport():
     """Create a new transport"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        
-        # Generate unique ID
-        transport_count = len(list(g.subjects(RDF.type, ONT.Bus))) + len(list(g.subjects(RDF.type, ONT.Métro)))
-        transport_id = f"{data.get('type', 'Transport')}_{transport_count + 1}"
-        transport_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{transport_id}")
-        
-        # Determine transport type
-        type_map = {
-            'Bus': ONT.Bus,
-            'Métro': ONT.Métro,
-            'Vélo': ONT.Vélo,
-            'VoiturePartagée': ONT.VoiturePartagée,
-            'Trottinette': ONT.Trottinette
-        }
-        transport_type = type_map.get(data.get('type'), ONT.Bus)
-        
-        # Add triples
-        g.add((transport_uri, RDF.type, transport_type))
-        if data.get('nom'):
-            g.add((transport_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('capacite'):
-            g.add((transport_uri, ONT.Capacite, Literal(int(data['capacite']), datatype=XSD.decimal)))
-        if data.get('immatriculation'):
-            g.add((transport_uri, ONT.Immatriculation, Literal(data['immatriculation'])))
-        if data.get('vitesseMax'):
-            g.add((transport_uri, ONT.VitesseMax, Literal(int(data['vitesseMax']), datatype=XSD.decimal)))
-        if 'electrique' in data:
-            g.add((transport_uri, ONT.estElectrique, Literal(data['electrique'] == 'true', datatype=XSD.boolean)))
-        if data.get('imageUrl'):
-            g.add((transport_uri, ONT.ImageURL, Literal(data['imageUrl'])))
-        
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Transport created successfully',
-            'id': transport_id
-        }), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return create_entity_response('transports')
 
 @app.route('/api/transports/<transport_id>', methods=['PUT'])
 def update_transport(transport_id):
     """Update an existing transport"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        transport_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{transport_id}")
-        
-        if not (transport_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Transport not found'}), 404
-        
-        # Remove old properties
-        g.remove((transport_uri, ONT.Nom, None))
-        g.remove((transport_uri, ONT.Capacite, None))
-        g.remove((transport_uri, ONT.Immatriculation, None))
-        g.remove((transport_uri, ONT.VitesseMax, None))
-        g.remove((transport_uri, ONT.estElectrique, None))
-        g.remove((transport_uri, ONT.ImageURL, None))
-        
-        # Add new properties
-        if data.get('nom'):
-            g.add((transport_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('capacite'):
-            g.add((transport_uri, ONT.Capacite, Literal(int(data['capacite']), datatype=XSD.decimal)))
-        if data.get('immatriculation'):
-            g.add((transport_uri, ONT.Immatriculation, Literal(data['immatriculation'])))
-        if data.get('vitesseMax'):
-            g.add((transport_uri, ONT.VitesseMax, Literal(int(data['vitesseMax']), datatype=XSD.decimal)))
-        if 'electrique' in data:
-            g.add((transport_uri, ONT.estElectrique, Literal(data['electrique'] == 'true', datatype=XSD.boolean)))
-        if data.get('imageUrl'):
-            g.add((transport_uri, ONT.ImageURL, Literal(data['imageUrl'])))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Transport updated successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return update_entity_response('transports', transport_id)
 
 @app.route('/api/transports/<transport_id>', methods=['DELETE'])
 def delete_transport(transport_id):
     """Delete a transport"""
-    try:
-        from rdflib import URIRef
-        transport_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{transport_id}")
-        
-        if not (transport_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Transport not found'}), 404
-        
-        g.remove((transport_uri, None, None))
-        g.remove((None, None, transport_uri))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Transport deleted successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return delete_entity_response('transports', transport_id)
 
 # ========== STATION CRUD ==========
 @app.route('/api/stations', methods=['POST'])
 def create_station():
     """Create a new station"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        
-        station_count = len(list(g.subjects(RDF.type, ONT.StationBus))) + len(list(g.subjects(RDF.type, ONT.StationMétro)))
-        station_id = f"Station_{station_count + 1}"
-        station_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{station_id}")
-        
-        # Determine station type
-        type_map = {
-            'StationBus': ONT.StationBus,
-            'StationMétro': ONT.StationMétro,
-            'Parking': ONT.Parking
-        }
-        station_type = type_map.get(data.get('type'), ONT.StationBus)
-        
-        g.add((station_uri, RDF.type, station_type))
-        if data.get('nom'):
-            g.add((station_uri, ONT.aNomStation, Literal(data['nom'])))
-        if data.get('latitude'):
-            g.add((station_uri, ONT.aLatitude, Literal(float(data['latitude']), datatype=XSD.decimal)))
-        if data.get('longitude'):
-            g.add((station_uri, ONT.aLongitude, Literal(float(data['longitude']), datatype=XSD.decimal)))
-        
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Station created successfully',
-            'id': station_id
-        }), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return create_entity_response('stations')
 
 @app.route('/api/stations/<station_id>', methods=['PUT'])
 def update_station(station_id):
     """Update an existing station"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        station_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{station_id}")
-        
-        if not (station_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Station not found'}), 404
-        
-        g.remove((station_uri, ONT.aNomStation, None))
-        g.remove((station_uri, ONT.aLatitude, None))
-        g.remove((station_uri, ONT.aLongitude, None))
-        
-        if data.get('nom'):
-            g.add((station_uri, ONT.aNomStation, Literal(data['nom'])))
-        if data.get('latitude'):
-            g.add((station_uri, ONT.aLatitude, Literal(float(data['latitude']), datatype=XSD.decimal)))
-        if data.get('longitude'):
-            g.add((station_uri, ONT.aLongitude, Literal(float(data['longitude']), datatype=XSD.decimal)))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Station updated successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return update_entity_response('stations', station_id)
 
 @app.route('/api/stations/<station_id>', methods=['DELETE'])
 def delete_station(station_id):
     """Delete a station"""
-    try:
-        from rdflib import URIRef
-        station_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{station_id}")
-        
-        if not (station_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Station not found'}), 404
-        
-        g.remove((station_uri, None, None))
-        g.remove((None, None, station_uri))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Station deleted successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return delete_entity_response('stations', station_id)
 
 # ========== EVENT CRUD ==========
 @app.route('/api/events', methods=['POST'])
 def create_event():
     """Create a new event"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        
-        event_count = len(list(g.subjects(RDF.type, ONT.Accident))) + len(list(g.subjects(RDF.type, ONT.Embouteillage)))
-        event_id = f"{data.get('type', 'Event')}_{event_count + 1}"
-        event_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{event_id}")
-        
-        type_map = {
-            'Accident': ONT.Accident,
-            'Embouteillage': ONT.Embouteillage,
-            'Travaux': SMARTCITY.EvenementDeCirculation  # Generic type for construction
-        }
-        event_type = type_map.get(data.get('type'), ONT.Accident)
-        
-        g.add((event_uri, RDF.type, event_type))
-        if data.get('nom'):
-            g.add((event_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('description'):
-            g.add((event_uri, ONT.aDescription, Literal(data['description'])))
-        if data.get('gravite'):
-            g.add((event_uri, ONT.aGravite, Literal(int(data['gravite']), datatype=XSD.int)))
-        if data.get('date'):
-            g.add((event_uri, ONT.aDateEvenement, Literal(data['date'], datatype=XSD.dateTime)))
-        if data.get('imageUrl'):
-            g.add((event_uri, ONT.imageUrl, Literal(data['imageUrl'])))
-        
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Event created successfully',
-            'id': event_id
-        }), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return create_entity_response('events')
 
 @app.route('/api/events/<event_id>', methods=['PUT'])
 def update_event(event_id):
     """Update an existing event"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        event_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{event_id}")
-        
-        if not (event_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Event not found'}), 404
-        
-        g.remove((event_uri, ONT.Nom, None))
-        g.remove((event_uri, ONT.aDescription, None))
-        g.remove((event_uri, ONT.aGravite, None))
-        g.remove((event_uri, ONT.aDateEvenement, None))
-        g.remove((event_uri, ONT.imageUrl, None))
-        
-        if data.get('nom'):
-            g.add((event_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('description'):
-            g.add((event_uri, ONT.aDescription, Literal(data['description'])))
-        if data.get('gravite'):
-            g.add((event_uri, ONT.aGravite, Literal(int(data['gravite']), datatype=XSD.int)))
-        if data.get('date'):
-            g.add((event_uri, ONT.aDateEvenement, Literal(data['date'], datatype=XSD.dateTime)))
-        if data.get('imageUrl'):
-            g.add((event_uri, ONT.imageUrl, Literal(data['imageUrl'])))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Event updated successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return update_entity_response('events', event_id)
 
 @app.route('/api/events/<event_id>', methods=['DELETE'])
 def delete_event(event_id):
     """Delete an event"""
-    try:
-        from rdflib import URIRef
-        event_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{event_id}")
-        
-        if not (event_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Event not found'}), 404
-        
-        g.remove((event_uri, None, None))
-        g.remove((None, None, event_uri))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Event deleted successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return delete_entity_response('events', event_id)
 
 # ========== ZONE CRUD ==========
 @app.route('/api/zones', methods=['POST'])
 def create_zone():
     """Create a new zone"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        
-        zone_count = len(list(g.subjects(RDF.type, ONT.CentreVille))) + len(list(g.subjects(RDF.type, ONT.Banlieue)))
-        zone_id = f"Zone_{zone_count + 1}"
-        zone_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{zone_id}")
-        
-        type_map = {
-            'CentreVille': ONT.CentreVille,
-            'Banlieue': ONT.Banlieue,
-            'ZoneIndustrielle': ONT.ZoneIndustrielle
-        }
-        zone_type = type_map.get(data.get('type'), ONT.CentreVille)
-        
-        g.add((zone_uri, RDF.type, zone_type))
-        if data.get('nom'):
-            g.add((zone_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('superficie'):
-            g.add((zone_uri, ONT.Superficie, Literal(float(data['superficie']), datatype=XSD.decimal)))
-        if data.get('population'):
-            g.add((zone_uri, ONT.Population, Literal(int(data['population']), datatype=XSD.int)))
-        if data.get('description'):
-            g.add((zone_uri, ONT.aDescription, Literal(data['description'])))
-        
-        save_graph()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Zone created successfully',
-            'id': zone_id
-        }), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return create_entity_response('zones')
 
 @app.route('/api/zones/<zone_id>', methods=['PUT'])
 def update_zone(zone_id):
     """Update an existing zone"""
-    try:
-        from rdflib import Literal, URIRef, XSD
-        data = request.json
-        zone_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{zone_id}")
-        
-        if not (zone_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Zone not found'}), 404
-        
-        g.remove((zone_uri, ONT.Nom, None))
-        g.remove((zone_uri, ONT.Superficie, None))
-        g.remove((zone_uri, ONT.Population, None))
-        g.remove((zone_uri, ONT.aDescription, None))
-        
-        if data.get('nom'):
-            g.add((zone_uri, ONT.Nom, Literal(data['nom'])))
-        if data.get('superficie'):
-            g.add((zone_uri, ONT.Superficie, Literal(float(data['superficie']), datatype=XSD.decimal)))
-        if data.get('population'):
-            g.add((zone_uri, ONT.Population, Literal(int(data['population']), datatype=XSD.int)))
-        if data.get('description'):
-            g.add((zone_uri, ONT.aDescription, Literal(data['description'])))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Zone updated successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    return update_entity_response('zones', zone_id)
 
 @app.route('/api/zones/<zone_id>', methods=['DELETE'])
 def delete_zone(zone_id):
     """Delete a zone"""
+    return delete_entity_response('zones', zone_id)
+
+# ========== BULK OPERATIONS ==========
+@app.route('/api/<collection>/bulk', methods=['POST'])
+def bulk_entities(collection):
+    """
+    Apply many create/update/delete operations with a single save
+    
+    Body: {"operations": [{"op": "create", "data": {...}}, {"op": "update", "id": "Bus_1", "data": {...}},
+    {"op": "delete", "id": "Station_2"}], "atomic": true}. Atomic batches (the default) are all
+    applied or, if any operation fails, none; otherwise failed operations are skipped. The graph
+    is saved once, and every operation gets its own result.
+    """
+    if collection not in ENTITY_COLLECTIONS:
+        return jsonify({'success': False, 'error': f"Unknown collection '{collection}'"}), 404
+    
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    atomic = data.get('atomic', True) if isinstance(data, dict) else True
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'operations must be a non-empty array'}), 400
+    if len(operations) > BULK_MAX_OPERATIONS:
+        return jsonify({'success': False, 'error': f'At most {BULK_MAX_OPERATIONS} operations per request'}), 413
+    
+    results = []
+    released = set()
+    failed = False
+    with graph_lock:
+        try:
+            with g.transaction():
+                for index, operation in enumerate(operations):
+                    op = operation.get('op') if isinstance(operation, dict) else None
+                    try:
+                        # Savepoint: a failed operation never leaves partial changes
+                        with g.transaction():
+                            entity_id, images = apply_bulk_operation(collection, operation)
+                    except Exception as e:
+                        failed = True
+                        results.append({
+                            'index': index, 'op': op, 'success': False,
+                            'status': 404 if isinstance(e, EntityNotFound) else 400, 'error': str(e)
+                        })
+                        if atomic:
+                            raise
+                        continue
+                    released |= images
+                    results.append({'index': index, 'op': op, 'id': entity_id, 'success': True})
+        except Exception:
+            # Rolled back: user entries indexed by earlier operations are stale
+            for result in results:
+                if result['success']:
+                    user_index.refresh(g, entity_uri(result['id']))
+                    result['success'] = False
+                    result['rolledBack'] = True
+        
+        applied = sum(1 for result in results if result['success'])
+        if applied:
+            save_graph()
+    schedule_asset_gc(released)
+    
+    return jsonify({
+        'success': not failed,
+        'committed': applied > 0,
+        'applied': applied,
+        'failed': sum(1 for result in results if 'error' in result),
+        'results': results
+    }), 400 if failed and atomic else 200
+
+# ========== EXPORT ==========
+@app.route('/api/export', methods=['GET'])
+def export_graph():
+    """
+    Download the whole graph
+    
+    N-Triples (default) and N-Quads are streamed a chunk of subjects at a time;
+    RDF/XML and Turtle are serialized in one piece.
+    """
+    offered = [*GRAPH_FORMATS, 'application/rdf+xml', 'text/turtle']
+    mimetype = negotiate_format(offered, 'application/n-triples')
+    if mimetype is None:
+        return jsonify({'success': False, 'error': f"Supported formats: {', '.join(offered)}"}), 406
+    
+    extension = {'application/n-triples': 'nt', 'application/n-quads': 'nq',
+                 'application/rdf+xml': 'rdf', 'text/turtle': 'ttl'}[mimetype]
+    headers = {'Content-Disposition': f'attachment; filename="smart_city.{extension}"'}
+    if mimetype in GRAPH_FORMATS:
+        graph_name = None
+        if GRAPH_FORMATS[mimetype] == 'nquads':
+            # Sharded storage: each shard is a named graph
+            graph_name = shards.graph_name if shards is not None else GRAPH_NAME
+        return Response(stream_graph(g, graph_lock, graph_name), mimetype=mimetype, headers=headers)
+    
+    with graph_lock:
+        body = g.serialize(format='xml' if mimetype == 'application/rdf+xml' else 'turtle')
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/api/shards', methods=['GET'])
+def get_shards():
+    """Files of the sharded storage (RDF_DATA_DIR) with their subjects and sizes"""
+    if shards is None:
+        return jsonify({'success': True, 'enabled': False, 'file': os.path.abspath(rdf_file)})
+    with graph_lock:
+        return jsonify({'success': True, 'enabled': True, **shards.stats()})
+
+@app.route('/api/query/slow', methods=['GET'])
+def get_slow_queries():
+    """Query fingerprints costing the most (?sort=total|p95|max|mean|count|slow, ?limit=20)"""
     try:
-        from rdflib import URIRef
-        zone_uri = URIRef(f"http://www.co-ode.org/ontologies/ont.owl#{zone_id}")
-        
-        if not (zone_uri, RDF.type, None) in g:
-            return jsonify({'error': 'Zone not found'}), 404
-        
-        g.remove((zone_uri, None, None))
-        g.remove((None, None, zone_uri))
-        
-        save_graph()
-        
-        return jsonify({'success': True, 'message': 'Zone deleted successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+        top = query_log.top(int(request.args.get('limit', 20)), request.args.get('sort', 'total'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **query_log.stats(), 'queries': top})
+
+@app.route('/api/query/slow/<fingerprint>', methods=['GET'])
+def get_slow_query(fingerprint):
+    """Aggregates and slow samples of one query fingerprint"""
+    summary = query_log.get(fingerprint)
+    if summary is None:
+        return jsonify({'success': False, 'error': 'Unknown fingerprint'}), 404
+    return jsonify({'success': True, **summary})
+
+@app.route('/api/query/slow', methods=['DELETE'])
+def reset_slow_queries():
+    """Forget the aggregates (the log file is kept)"""
+    query_log.reset()
+    return jsonify({'success': True})
+
+def profile_access_denied():
+    """403 answer unless the request carries the PROFILE_TOKEN as X-Profile-Token, else None"""
+    if not request_profiler.token:
+        return jsonify({'success': False, 'error': 'Set PROFILE_TOKEN to use the profiling endpoints'}), 403
+    if not request_profiler.authorized(request.headers.get('X-Profile-Token')):
+        return jsonify({'success': False, 'error': 'Invalid or missing X-Profile-Token'}), 403
+    return None
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def get_request_profiles():
+    """Profiled requests, most recent first"""
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    return jsonify({'success': True, **request_profiler.stats(), 'profiles': request_profiler.list()})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_request_profile(profile_id):
+    """
+    One request profile
+    
+    ?format=json (default): the most expensive functions (?sort=cumulative|tottime|calls, ?limit=30)
+    ?format=folded: folded stacks for flamegraph.pl or speedscope
+    ?format=pstats: .prof file for pstats or snakeviz (cprofile profiles only)
+    """
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    fmt = request.args.get('format', 'json')
+    if fmt == 'pstats':
+        data = request_profiler.pstats_dump(profile_id)
+        if data is None:
+            return jsonify({'success': False, 'error': 'Unknown profile, or not a cprofile profile'}), 404
+        return Response(data, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=profile-{profile_id}.prof'})
+    if fmt == 'folded':
+        text = request_profiler.folded(profile_id)
+        if text is None:
+            return jsonify({'success': False, 'error': 'Unknown profile'}), 404
+        return Response(text, mimetype='text/plain')
+    try:
+        report = request_profiler.report(profile_id, request.args.get('sort', 'cumulative'),
+                                         int(request.args.get('limit', 30)))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if report is None:
+        return jsonify({'success': False, 'error': 'Unknown profile'}), 404
+    return jsonify({'success': True, **report})
+
+@app.route('/api/admin/profiles', methods=['DELETE'])
+def clear_request_profiles():
+    """Forget every kept profile"""
+    denied = profile_access_denied()
+    if denied:
+        return denied
+    request_profiler.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/query/statistics', methods=['GET'])
+def get_query_statistics():
+    """Cardinality statistics used to order query patterns, and the parsed query cache"""
+    if request.args.get('refresh') == '1':
+        query_optimizer.refresh(force=True)
+    return jsonify({'success': True, **query_optimizer.stats()})
+
+# ========== BULK IMPORT ==========
+def refresh_derived_indexes(triples):
+    """Keep the ID sequences and user index in step with triples added or removed in bulk"""
+    typed = {s for s, p, o in triples if p == RDF.type}
+    id_sequences.observe(typed)
+    touched_users = {s for s, p, o in triples if p in (RDF.type, ONT.Nom, ONT.Email)}
+    with graph_lock:
+        for subject in touched_users:
+            user_index.refresh(g, subject)
+
+def bump_graph_revision(triples=None):
+    """Mark the graph changed without saving it, so caches keyed on graph_revision recompute"""
+    global graph_revision
+    with graph_lock:
+        graph_revision += 1
+
+def run_import(job, path, fmt, persist):
+    """Background job: stream an RDF file into the graph, then save it once"""
+    ingestor = Ingestor(g, graph_lock, batch_size=IMPORT_BATCH_SIZE,
+                        on_batch=(refresh_derived_indexes, bump_graph_revision), max_triples=IMPORT_MAX_TRIPLES)
+    try:
+        summary = ingestor.ingest(path, fmt, report=job.report)
+    finally:
+        discard_upload(path)
+    
+    if persist and summary['added']:
+        job.report(stage='saving')
+        summary['saved'] = save_graph()
+    summary['graphTriples'] = len(g)
+    print(f"📥 Imported {summary['triples']} triples at {summary['triplesPerSecond']} triples/s")
+    return summary
+
+@app.route('/api/import', methods=['POST'])
+def import_rdf():
+    """
+    Import an RDF file (N-Triples, Turtle or RDF/XML) in the background
+    
+    Send the file as the raw body (format from ?format= or the Content-Type) or as
+    the 'file' field of a multipart form. Answers 202 with the job to poll;
+    ?persist=false keeps the triples in memory only.
+    """
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    try:
+        fmt = detect_format(
+            upload.filename if upload else None,
+            (upload.mimetype if upload else request.mimetype) or None,
+            request.args.get('format')
+        )
+        path, size = spool_upload_stream(upload.stream if upload else request.stream, None,
+                                         IMPORT_MAX_BYTES, allowed_types=None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 415
+    except UploadRejected as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    
+    persist = request.args.get('persist', 'true').lower() != 'false'
+    try:
+        job = import_jobs.submit('rdf-import', run_import, path, fmt, persist,
+                                 meta={'format': fmt, 'bytes': size})
+    except QueueFull as e:
+        discard_upload(path)
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '30'}
+    
+    return jsonify({
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f"/api/import/jobs/{job.id}"
+    }), 202
+
+@app.route('/api/import/jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """Progress of an import job: triples, bytes read and rate (?wait=<seconds> to long-poll)"""
+    try:
+        wait_seconds = wait_seconds_arg(UPLOAD_WAIT_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'wait must be a number of seconds'}), 400
+    job = import_jobs.get(job_id, wait_seconds=wait_seconds)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired import job'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+def parse_recommendations(text):
+    """Parse the JSON array of station recommendations returned by Gemini"""
+    # Clean up the response (remove markdown if present)
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text.replace('```json', '').replace('```', '').strip()
+    elif text.startswith('```'):
+        text = text.replace('```', '').strip()
+    
+    recommendations = json.loads(text)
+    if not isinstance(recommendations, list):
+        raise ValueError("Expected a JSON array of recommendations")
+    return recommendations
+
+def get_event_demand_points():
+    """Traffic events with coordinates, weighted by their gravité, for station planning"""
+    query = """
+    PREFIX smartcity: <http://example.org/smartcity#>
+    PREFIX ont: <http://www.co-ode.org/ontologies/ont.owl#>
+    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+    
+    SELECT ?latitude ?longitude ?gravite
+    WHERE {
+        ?event rdf:type/rdfs:subClassOf* smartcity:EvenementDeCirculation .
+        ?event ont:aLatitude ?latitude .
+        ?event ont:aLongitude ?longitude .
+        OPTIONAL { ?event ont:aGravite ?gravite }
+    }
+    """
+    return [
+        (float(row.latitude), float(row.longitude), float(row.gravite) if row.gravite else 1.0)
+        for row in query_optimizer.query(query)
+    ]
+
+def explain_recommendations(recommendations, backend):
+    """Ask the LLM to name and justify locally computed recommendations, in place"""
+    candidates = [
+        {'latitude': r['latitude'], 'longitude': r['longitude'],
+         'nearestStationKm': r['nearestStationKm'], 'demand': r['demand']}
+        for r in recommendations
+    ]
+    prompt = f"""These locations for new {recommendations[0]['type']} stations were selected because they are
+the least covered by the existing stations of a smart city (Tunisia/North Africa):
+{json.dumps(candidates)}
+
+For each location, in the same order, suggest a realistic station name and a brief reason in French.
+Respond ONLY with a valid JSON array of {len(candidates)} objects in this exact format:
+[{{"name": "Station Name", "reason": "Brief explanation"}}]
+
+No markdown, no code blocks, just the JSON array."""
+    
+    dispatch = require_feature('dispatch').generate_hedged(prompt, backend, parse=parse_recommendations)
+    for recommendation, explained in zip(recommendations, dispatch['value']):
+        if isinstance(explained, dict):
+            recommendation['name'] = explained.get('name') or recommendation['name']
+            recommendation['reason'] = explained.get('reason') or recommendation['reason']
+    return dispatch['model']
+
+def plan_recommendations(existing_stations, data):
+    """Deterministic local placement from the coverage/distance field"""
+    planner = require_feature('planner')
+    coordinates = [
+        (station['latitude'], station['longitude'])
+        for station in existing_stations
+        if station['latitude'] is not None and station['longitude'] is not None
+    ]
+    demand_points = get_event_demand_points() if data.get('weightByEvents', True) else []
+    for point in data.get('demandPoints', []):
+        demand_points.append((float(point['latitude']), float(point['longitude']), float(point.get('weight', 1))))
+    
+    map_center = data.get('mapCenter') or {}
+    picks = planner.recommend_locations(
+        coordinates,
+        count=min(int(data.get('count', 3)), 20),
+        demand_points=demand_points,
+        center=(float(map_center.get('lat', 36.8065)), float(map_center.get('lng', 10.1815)))
+    )
+    recommendations = planner.describe_recommendations(picks, data.get('type', 'StationBus'))
+    print(f"🧭 Planned {len(recommendations)} locations locally")
+    return recommendations
 
 @app.route('/api/ai/recommend-stations', methods=['POST'])
 def recommend_stations():
-    """AI-powered station recommendation using Gemini API"""
+    """Station recommendation from the local coverage planner, or fully by Gemini with mode=ai"""
     try:
         print("🤖 AI Recommendation Request Started")
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', 'local')
         
         # Get existing stations from the RDF graph
         query = """
@@ -1281,7 +2380,7 @@ def recommend_stations():
         }
         """
         
-        results = g.query(query)
+        results = query_optimizer.query(query)
         existing_stations = []
         for row in results:
             existing_stations.append({
@@ -1293,13 +2392,41 @@ def recommend_stations():
         
         print(f"📍 Found {len(existing_stations)} existing stations")
         
-        # Use Gemini to analyze and recommend new station locations
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            print("❌ GEMINI_API_KEY not found in environment")
-            return jsonify({'error': 'GEMINI_API_KEY not configured'}), 500
+        if mode != 'ai':
+            recommendations = plan_recommendations(existing_stations, data)
+            
+            # Optional LLM step: better names and reasons, same locations
+            model_used = None
+            if data.get('explain') and recommendations:
+                dispatch = require_feature('dispatch')
+                try:
+                    model_used = explain_recommendations(recommendations, require_feature('llm').get_backend())
+                except (ValueError, FeatureUnavailable, dispatch.GeminiDispatchError) as e:
+                    print(f"⚠️ Explanation skipped: {e}")
+            
+            return jsonify({
+                'success': True,
+                'recommendations': recommendations,
+                'engine': 'local',
+                'model': model_used
+            })
+        
+        # Use the LLM backend to analyze and recommend new station locations
+        try:
+            backend = require_feature('llm').get_backend()
+            dispatch = require_feature('dispatch')
+        except (ValueError, FeatureUnavailable) as e:
+            print(f"⚠️ {e}, falling back to the local planner")
+            return jsonify({
+                'success': True,
+                'recommendations': plan_recommendations(existing_stations, data),
+                'engine': 'local',
+                'model': None,
+                'degraded': True,
+                'details': str(e)
+            })
         
-        print(f"🔑 API Key found: {api_key[:10]}...")
+        print(f"🔑 LLM backend: {backend.name}")
         
         # Prepare the prompt for Gemini
         prompt = f"""Based on these existing stations in a smart city:
@@ -1327,102 +2454,37 @@ Respond ONLY with a valid JSON array in this exact format:
 
 No markdown, no code blocks, just the JSON array."""
         
-        # Try different API endpoints for Gemini free tier
-        # Based on actual available models from API
-        model_configs = [
-            ('gemini-2.5-flash', 'v1beta'),          # Stable release - BEST FOR FREE TIER
-            ('gemini-2.0-flash', 'v1beta'),          # Also stable
-            ('gemini-flash-latest', 'v1beta'),       # Latest version
-            ('gemini-2.5-flash-lite', 'v1beta'),     # Lighter version
-            ('gemini-2.0-flash-lite', 'v1beta'),     # Lighter 2.0
-        ]
-        
-        response = None
-        last_error = None
-        
-        for model_name, api_version in model_configs:
-            try:
-                print(f"🔄 Trying model: {model_name} with API version: {api_version}")
-                
-                # Call Gemini API with appropriate version
-                url = f'https://generativelanguage.googleapis.com/{api_version}/models/{model_name}:generateContent?key={api_key}'
-                
-                payload = {
-                    "contents": [{
-                        "parts": [{
-                            "text": prompt
-                        }]
-                    }],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "maxOutputTokens": 2048,
-                    }
-                }
-                
-                print(f"🌐 Calling: {url[:80]}...")
-                response = requests.post(url, json=payload, headers={'Content-Type': 'application/json'}, timeout=30)
-                
-                print(f"📡 Response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    print(f"✅ Success with model: {model_name}")
-                    break
-                else:
-                    last_error = f"Model {model_name} returned {response.status_code}: {response.text[:200]}"
-                    print(f"⚠️ {last_error}")
-                    
-            except Exception as e:
-                last_error = f"Model {model_name} failed: {str(e)}"
-                print(f"❌ {last_error}")
-                continue
-        
-        if not response or response.status_code != 200:
-            error_msg = last_error or f'All models failed. Last response: {response.text[:500] if response else "No response"}'
-            print(f"❌ Final error: {error_msg}")
-            return jsonify({
-                'error': 'Gemini API error',
-                'details': error_msg,
-                'status_code': response.status_code if response else 'N/A'
-            }), 500
-        
-        result = response.json()
-        print(f"📦 Got response from Gemini")
-        
-        # Extract the text from Gemini response
-        if 'candidates' in result and len(result['candidates']) > 0:
-            text = result['candidates'][0]['content']['parts'][0]['text']
-            print(f"📝 AI Response length: {len(text)} characters")
-            
-            # Clean up the response (remove markdown if present)
-            text = text.strip()
-            if text.startswith('```json'):
-                text = text.replace('```json', '').replace('```', '').strip()
-            elif text.startswith('```'):
-                text = text.replace('```', '').strip()
-            
-            print(f"🧹 Cleaned response preview: {text[:100]}...")
-            
-            # Parse the JSON recommendations
-            recommendations = json.loads(text)
-            
-            print(f"✅ Successfully parsed {len(recommendations)} recommendations")
-            
+        # Hedged dispatch over the free tier models: the next model starts after a
+        # short delay instead of waiting for the previous one to time out
+        try:
+            result = dispatch.generate_hedged(prompt, backend, parse=parse_recommendations)
+        except dispatch.GeminiDispatchError as e:
+            for attempt in e.attempts:
+                print(f"⚠️ {attempt['model']} failed after {attempt['elapsed']:.2f}s: {attempt.get('error')}")
+            print(f"❌ Final error: {e}, falling back to the local planner")
+            # Degraded answer: same shape, computed locally
             return jsonify({
                 'success': True,
-                'recommendations': recommendations
+                'recommendations': plan_recommendations(existing_stations, data),
+                'engine': 'local',
+                'model': None,
+                'degraded': True,
+                'details': str(e),
+                'attempts': e.attempts
             })
-        else:
-            print(f"❌ No candidates in response: {result}")
-            return jsonify({'error': 'No response from Gemini API', 'details': str(result)}), 500
-            
-    except json.JSONDecodeError as e:
-        error_msg = f"Failed to parse AI response: {str(e)}"
-        print(f"❌ {error_msg}")
+        
+        recommendations = result['value']
+        print(f"✅ Success with model: {result['model']} in {result['elapsed']:.2f}s")
+        print(f"✅ Successfully parsed {len(recommendations)} recommendations")
+        
         return jsonify({
-            'error': 'Failed to parse AI response',
-            'details': str(e),
-            'raw_response': text[:500] if 'text' in locals() else 'N/A'
-        }), 500
+            'success': True,
+            'recommendations': recommendations,
+            'engine': 'ai',
+            'model': result['model']
+        })
+    except FeatureUnavailable:
+        raise
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         print(f"❌ {error_msg}")
@@ -0,0 +1,165 @@
+"""
+Image Asset Manager
+Bulk image uploads and garbage collection of hosted images that no entity of
+the graph references any more
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from resilience import TokenBucket
+
+
+class AssetManager:
+    """
+    Batched operations on the image store
+
+    Garbage collection deletes the assets of the managed folders that are not in
+    the referenced set, in batches of at most batch_size, with every store API
+    call (listing page or batch delete) taken from a token bucket so a large
+    pass stays within the provider's rate limits. Assets created or reused less
+    than grace_seconds ago are kept: new entities upload their image before
+    they are created.
+    """
+
+    def __init__(self, batch_size=100, rate_per_minute=30, grace_seconds=3600, upload_workers=4):
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self.upload_workers = upload_workers
+        self._bucket = TokenBucket(rate_per_minute=rate_per_minute, burst=max(1, rate_per_minute // 6))
+        self._lock = threading.Lock()
+        self.totals = {'gcPasses': 0, 'deleted': 0, 'bulkUploads': 0, 'bulkImages': 0}
+        self.last_pass = None
+
+    def _throttle(self):
+        # Wait as long as needed: GC runs in the background, nobody is waiting on it
+        while not self._bucket.acquire(max_wait=60):
+            pass
+
+    def upload_batch(self, images, items, job=None):
+        """
+        Upload several images concurrently
+
+        Args:
+            images: The image helper module (cloudinary_helper)
+            items: Dicts with 'upload' (name of the helper's upload function),
+                'entityId' and 'path'
+            job: Optional background job to report progress to
+
+        Returns:
+            list: One dict per item, in order, with 'entityId' and either
+            'url'/'public_id' or 'error'
+        """
+        results = [None] * len(items)
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix='asset-upload') as pool:
+            futures = {
+                pool.submit(getattr(images, item['upload']), item['path'], item['entityId']): index
+                for index, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                item = items[index]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'error': str(e)}
+                results[index] = {'entityId': item['entityId'], **result}
+                done += 1
+                if job is not None:
+                    job.report(uploaded=done, total=len(items))
+        with self._lock:
+            self.totals['bulkUploads'] += 1
+            self.totals['bulkImages'] += len(items)
+        return results
+
+    def collect(self, images, referenced, candidates=None, dry_run=False, job=None):
+        """
+        Delete unreferenced assets
+
+        Args:
+            images: The image helper module (cloudinary_helper)
+            referenced: Zero-argument callable returning the set of public IDs
+                still used by the graph; called after listing so that it is as
+                fresh as possible
+            candidates: Optional public IDs to check instead of listing every
+                asset (e.g. the images of an entity that was just deleted)
+            dry_run: Report what would be deleted without deleting it
+            job: Optional background job to report progress to
+
+        Returns:
+            dict: Counters of the pass and the deleted (or deletable) public IDs
+        """
+        store = images.store
+        now = time.time()
+        if candidates is None:
+            assets = []
+            for folder in images.asset_folders():
+                assets.extend(store.list_assets(folder, before_call=self._throttle))
+        else:
+            # Targeted pass: the candidates were just dereferenced, age does not matter
+            assets = [{'public_id': public_id, 'created_at': 0} for public_id in set(candidates)]
+
+        in_use = referenced()
+        recent = 0
+        garbage = []
+        for asset in assets:
+            public_id = asset['public_id']
+            if public_id in in_use:
+                continue
+            used = max(asset['created_at'], images.last_used(public_id) or 0)
+            if now - used < self.grace_seconds:
+                recent += 1
+                continue
+            garbage.append(public_id)
+
+        deleted, missing, failed = [], 0, []
+        batch_size = min(self.batch_size, getattr(store, 'max_batch', self.batch_size))
+        for start in range(0, len(garbage), batch_size):
+            batch = garbage[start:start + batch_size]
+            if dry_run:
+                deleted.extend(batch)
+                continue
+            self._throttle()
+            try:
+                outcome = store.destroy_many(batch)
+            except Exception as e:
+                print(f"⚠️ Asset GC batch failed: {e}")
+                failed.extend(batch)
+                continue
+            for public_id in batch:
+                images.forget(public_id)
+                if outcome.get(public_id) == 'deleted':
+                    deleted.append(public_id)
+                else:
+                    missing += 1
+            if job is not None:
+                job.report(deleted=len(deleted), garbage=len(garbage))
+
+        summary = {
+            'scanned': len(assets),
+            'referenced': len(assets) - len(garbage) - recent,
+            'keptRecent': recent,
+            'deleted': len(deleted),
+            'notFound': missing,
+            'failed': len(failed),
+            'dryRun': dry_run,
+            'publicIds': deleted
+        }
+        with self._lock:
+            self.totals['gcPasses'] += 1
+            if not dry_run:
+                self.totals['deleted'] += len(deleted)
+            self.last_pass = {**{k: v for k, v in summary.items() if k != 'publicIds'}, 'finishedAt': time.time()}
+        return summary
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.totals,
+                'lastPass': self.last_pass,
+                'graceSeconds': self.grace_seconds,
+                'batchSize': self.batch_size,
+                'rateLimit': self._bucket.snapshot()
+            }
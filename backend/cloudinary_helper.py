@@ -1,69 +1,315 @@
 """
 Cloudinary Image Upload Helper
-Handles profile image uploads to Cloudinary
+Handles profile and station image uploads to Cloudinary
+
+Images are downscaled and re-encoded locally to their display size before
+being sent, and stored under a content-hash public ID so re-submitting the
+same photo never uploads it twice. Set IMAGE_STORE=local to keep the images
+on disk instead of Cloudinary (development, tests, offline use).
 """
 
+import base64
+import hashlib
+import io
 import os
-import cloudinary
-import cloudinary.uploader
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
 from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET'),
-    secure=True
+IMAGE_STORE = os.getenv('IMAGE_STORE', 'cloudinary').lower()
+LOCAL_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join(os.path.dirname(__file__), 'media'))
+LOCAL_STORE_URL = os.getenv('IMAGE_STORE_URL', 'http://localhost:5001/media')
+
+# Target size of each kind of image, matching the Cloudinary transformations below
+PRESETS = {
+    'profile': {
+        'folder': 'smart_city_profiles',
+        'prefix': 'user',
+        'size': (400, 400),
+        'transformation': [
+            {'width': 400, 'height': 400, 'crop': 'fill', 'gravity': 'face'},
+            {'quality': 'auto:good'},
+            {'fetch_format': 'auto'}
+        ]
+    },
+    'station': {
+        'folder': 'smart_city_stations',
+        'prefix': 'station',
+        'size': (800, 600),
+        'transformation': [
+            {'width': 800, 'height': 600, 'crop': 'fill'},
+            {'quality': 'auto:good'},
+            {'fetch_format': 'auto'}
+        ]
+    },
+}
+
+JPEG_QUALITY = 85
+
+UPLOAD_SECONDS = metrics.histogram(
+    'smartcity_image_upload_seconds', "Image store upload latency (deduplicated images excluded)",
+    ['store', 'preset'], buckets=metrics.SLOW_BUCKETS
 )
 
+# Content hashes already stored, so identical images are not sent again
+_DEDUP_ENTRIES = 4096
+
+
+class CloudinaryStore:
+    """Image store backed by the Cloudinary upload API"""
+
+    name = 'cloudinary'
+
+    def __init__(self):
+        import cloudinary
+        import cloudinary.api
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+            secure=True
+        )
+        self._uploader = cloudinary.uploader
+        self._api = cloudinary.api
+
+    def upload(self, data, folder, public_id, transformation):
+        result = self._uploader.upload(
+            io.BytesIO(data),
+            folder=folder,
+            public_id=public_id,
+            overwrite=True,
+            resource_type="image",
+            transformation=transformation
+        )
+        return {'url': result.get('secure_url'), 'public_id': result.get('public_id')}
+
+    def destroy(self, public_id):
+        return self._uploader.destroy(public_id)
+
+    # The Admin API deletes up to 100 assets per call
+    max_batch = 100
+
+    def destroy_many(self, public_ids):
+        """Delete several assets in one call; returns public_id -> 'deleted' or 'not_found'"""
+        return self._api.delete_resources(list(public_ids)).get('deleted', {})
+
+    def list_assets(self, folder, before_call=None):
+        """
+        Yield {'public_id', 'created_at' (epoch seconds)} for every asset under a folder
+
+        before_call, if given, is called before each paginated Admin API request
+        (e.g. to rate-limit them).
+        """
+        cursor = None
+        while True:
+            if before_call is not None:
+                before_call()
+            page = self._api.resources(type='upload', prefix=f"{folder}/", max_results=500,
+                                       **({'next_cursor': cursor} if cursor else {}))
+            for resource in page.get('resources', []):
+                created = datetime.fromisoformat(resource['created_at'].replace('Z', '+00:00'))
+                yield {'public_id': resource['public_id'], 'created_at': created.timestamp()}
+            cursor = page.get('next_cursor')
+            if not cursor:
+                break
+
+    _URL_ID = re.compile(r'/image/upload/(?:[^/]+/)*?v\d+/(?P<id>.+?)(?:\.\w+)?$')
+
+    def public_id_from_url(self, url):
+        match = self._URL_ID.search(url or '')
+        return match.group('id') if match else None
+
+
+class LocalStore:
+    """Image store writing files to a local directory, served by the API under /media"""
+
+    name = 'local'
+
+    def __init__(self, root=LOCAL_STORE_DIR, base_url=LOCAL_STORE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def _path(self, public_id):
+        path = os.path.normpath(os.path.join(self.root, public_id))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid public ID: {public_id}")
+        return path
+
+    def upload(self, data, folder, public_id, transformation):
+        # Keep the extension so the files are served with the right content type
+        with Image.open(io.BytesIO(data)) as image:
+            extension = (image.format or 'img').lower()
+        full_id = f"{folder}/{public_id}.{extension}"
+        path = self._path(full_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return {'url': f"{self.base_url}/{full_id}", 'public_id': full_id}
+
+    def destroy(self, public_id):
+        try:
+            os.remove(self._path(public_id))
+            return {'result': 'ok'}
+        except FileNotFoundError:
+            return {'result': 'not found'}
+
+    max_batch = 100
+
+    def destroy_many(self, public_ids):
+        return {public_id: 'deleted' if self.destroy(public_id)['result'] == 'ok' else 'not_found'
+                for public_id in public_ids}
+
+    def list_assets(self, folder, before_call=None):
+        directory = self._path(folder)
+        if not os.path.isdir(directory):
+            return
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                yield {'public_id': f"{folder}/{entry.name}", 'created_at': entry.stat().st_mtime}
+
+    def public_id_from_url(self, url):
+        prefix = f"{self.base_url}/"
+        return url[len(prefix):] if url and url.startswith(prefix) else None
+
+
+def create_store(name=IMAGE_STORE):
+    """Build the image store selected by IMAGE_STORE ('cloudinary' or 'local')"""
+    if name == 'local':
+        return LocalStore()
+    if name == 'cloudinary':
+        return CloudinaryStore()
+    raise ValueError(f"Unknown IMAGE_STORE: {name}")
+
+
+store = create_store()
+
+_dedup = OrderedDict()
+# Last time each asset was uploaded or reused, so garbage collection spares
+# assets an entity is about to reference
+_last_used = {}
+_lock = threading.Lock()
+_stats = {'uploads': 0, 'deduplicated': 0, 'originalBytes': 0, 'sentBytes': 0}
+
+
+def _read_image_data(image_data):
+    """Raw bytes of an image given as bytes, a file path, or base64 (plain or data URL)"""
+    if isinstance(image_data, (bytes, bytearray)):
+        return bytes(image_data)
+    if os.path.isfile(image_data):
+        with open(image_data, 'rb') as f:
+            return f.read()
+    if image_data.startswith('data:'):
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
+
+
+def prepare_image(raw, size):
+    """
+    Crop to the target aspect ratio, downscale to at most the target size and re-encode
+
+    Smaller images are not upscaled, Cloudinary's fill transformation still
+    produces the exact size. Images with transparency stay PNG, others become
+    progressive JPEG.
+
+    Returns:
+        bytes: The encoded image, or the original bytes if they are already smaller
+    """
+    with Image.open(io.BytesIO(raw)) as original:
+        # JPEGs can be decoded directly at 1/2, 1/4 or 1/8 scale: keep both sides
+        # above the largest target side so any crop still covers the target size
+        longest = max(size)
+        original.draft('RGB', (longest, longest))
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        target_w, target_h = size
+        # Largest centered crop with the target aspect ratio, never upscaled
+        crop_w, crop_h = min(width, height * target_w / target_h), min(height, width * target_h / target_w)
+        output = size if crop_w > target_w else (max(1, round(crop_w)), max(1, round(crop_h)))
+        # Centered crop: the face gravity of the remote transformation has no local equivalent
+        image = ImageOps.fit(image, output, method=Image.LANCZOS, centering=(0.5, 0.5))
+
+        out = io.BytesIO()
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image.save(out, format='PNG', optimize=True)
+        else:
+            image.convert('RGB').save(out, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    encoded = out.getvalue()
+    return encoded if len(encoded) < len(raw) else raw
+
+
+def _upload(image_data, preset_name):
+    preset = PRESETS[preset_name]
+    raw = _read_image_data(image_data)
+    digest = hashlib.sha256(raw).hexdigest()
+    key = (store.name, preset_name, digest)
+
+    with _lock:
+        _stats['originalBytes'] += len(raw)
+        known = _dedup.get(key)
+        if known is not None:
+            _dedup.move_to_end(key)
+            _last_used[known['public_id']] = time.time()
+            _stats['deduplicated'] += 1
+            return {**known, 'deduplicated': True, 'bytes': 0}
+
+    data = prepare_image(raw, preset['size'])
+    # Content-addressed ID: identical images share one asset, a new image never
+    # overwrites an asset another entity still points to
+    with UPLOAD_SECONDS.time(store.name, preset_name):
+        result = store.upload(data, preset['folder'], f"{preset['prefix']}_{digest[:24]}", preset['transformation'])
+
+    with _lock:
+        _dedup[key] = result
+        _last_used[result['public_id']] = time.time()
+        if len(_dedup) > _DEDUP_ENTRIES:
+            _dedup.popitem(last=False)
+        _stats['uploads'] += 1
+        _stats['sentBytes'] += len(data)
+    return {**result, 'deduplicated': False, 'bytes': len(data)}
+
+
 def upload_profile_image(image_data, user_id):
     """
     Upload a profile image to Cloudinary
-    
+
     Args:
-        image_data: Base64 encoded image data or file path
-        user_id: User ID for unique naming
-        
+        image_data: Base64 encoded image data, raw bytes or file path
+        user_id: User ID the image belongs to
+
     Returns:
         dict: Contains 'url' and 'public_id' on success, or 'error' on failure
     """
     try:
-        # Upload image to Cloudinary
-        result = cloudinary.uploader.upload(
-            image_data,
-            folder="smart_city_profiles",
-            public_id=f"user_{user_id}",
-            overwrite=True,
-            resource_type="image",
-            transformation=[
-                {'width': 400, 'height': 400, 'crop': 'fill', 'gravity': 'face'},
-                {'quality': 'auto:good'},
-                {'fetch_format': 'auto'}
-            ]
-        )
-        
-        return {
-            'url': result.get('secure_url'),
-            'public_id': result.get('public_id')
-        }
+        return _upload(image_data, 'profile')
     except Exception as e:
         return {'error': str(e)}
 
 def delete_profile_image(public_id):
     """
     Delete a profile image from Cloudinary
-    
+
     Args:
         public_id: The Cloudinary public ID of the image
-        
+
     Returns:
         dict: Result of deletion
     """
     try:
-        result = cloudinary.uploader.destroy(public_id)
+        result = store.destroy(public_id)
+        forget(public_id)
         return result
     except Exception as e:
         return {'error': str(e)}
@@ -71,31 +317,59 @@ def delete_profile_image(public_id):
 def upload_station_image(image_data, station_id):
     """
     Upload a station image to Cloudinary
-    
+
     Args:
-        image_data: Base64 encoded image data or file path
-        station_id: Station ID for unique naming
-        
+        image_data: Base64 encoded image data, raw bytes or file path
+        station_id: Station ID the image belongs to
+
     Returns:
         dict: Contains 'url' and 'public_id' on success, or 'error' on failure
     """
     try:
-        result = cloudinary.uploader.upload(
-            image_data,
-            folder="smart_city_stations",
-            public_id=f"station_{station_id}",
-            overwrite=True,
-            resource_type="image",
-            transformation=[
-                {'width': 800, 'height': 600, 'crop': 'fill'},
-                {'quality': 'auto:good'},
-                {'fetch_format': 'auto'}
-            ]
-        )
-        
-        return {
-            'url': result.get('secure_url'),
-            'public_id': result.get('public_id')
-        }
+        return _upload(image_data, 'station')
     except Exception as e:
         return {'error': str(e)}
+
+def forget(public_id):
+    """Drop a deleted asset from the deduplication index"""
+    with _lock:
+        for key in [k for k, v in _dedup.items() if v['public_id'] == public_id]:
+            del _dedup[key]
+        _last_used.pop(public_id, None)
+
+def last_used(public_id):
+    """Epoch time this process last uploaded or reused an asset, or None"""
+    with _lock:
+        return _last_used.get(public_id)
+
+def asset_folders():
+    """Folders holding the images managed by this helper"""
+    return [preset['folder'] for preset in PRESETS.values()]
+
+def get_upload_stats():
+    """Return upload/deduplication counters and the bytes saved by local pre-processing"""
+    with _lock:
+        stats = dict(_stats)
+    stats['store'] = store.name
+    stats['savedBytes'] = stats['originalBytes'] - stats['sentBytes']
+    return stats
+
+
+if __name__ == '__main__':
+    # Benchmark on the local store: IMAGE_STORE=local python cloudinary_helper.py
+    import tempfile
+    import time
+
+    store = LocalStore(root=tempfile.mkdtemp(), base_url='http://localhost/media')
+    photo = Image.effect_mandelbrot((4032, 3024), (-2.0, -1.2, 1.0, 1.2), 100).convert('RGB')
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=95)
+    original = buffer.getvalue()
+
+    for label, upload in (('profile', upload_profile_image), ('station', upload_station_image)):
+        for attempt in ('first upload', 'same photo again'):
+            t0 = time.perf_counter()
+            result = upload(original, 'bench')
+            print(f"{label:>7} {attempt:>16}: {len(original) / 1024:7.0f} KB -> {result['bytes'] / 1024:5.0f} KB sent "
+                  f"in {(time.perf_counter() - t0) * 1000:6.1f} ms (deduplicated={result['deduplicated']})")
+    print(get_upload_stats())
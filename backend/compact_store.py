@@ -0,0 +1,378 @@
+"""
+Compact Triple Store
+rdflib store that interns every term into an integer ID and keeps the triples
+as sorted columns of 32-bit IDs (SPO, POS and OSP orders), instead of the
+nested dicts of rdflib's Memory store, so one process holds several times more
+city data
+
+Used as the store of the app graph with RDF_STORE=compact. Benchmark against
+the default store:
+    python compact_store.py 500000
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+from rdflib import plugin
+from rdflib.store import Store
+
+# Column orders of the three sorted indexes, as positions in (s, p, o)
+SPO, POS, OSP = (0, 1, 2), (1, 2, 0), (2, 0, 1)
+ORDERS = (SPO, POS, OSP)
+
+# Pending changes are merged into the columns past this share of the store (at least MIN_MERGE)
+MERGE_RATIO = 16
+MIN_MERGE = 10_000
+
+
+def _permute(row, order):
+    return (row[order[0]], row[order[1]], row[order[2]])
+
+
+def _restore(row, order):
+    # Inverse of _permute: back to (s, p, o)
+    spo = [0, 0, 0]
+    for position, value in zip(order, row):
+        spo[position] = value
+    return tuple(spo)
+
+
+def _prefix_range(columns, key):
+    """[lo, hi) of the rows of sorted columns starting with key (1 to 3 IDs)"""
+    lo, hi = 0, len(columns[0])
+    for column, value in zip(columns, key):
+        lo = bisect_left(column, value, lo, hi)
+        hi = bisect_right(column, value, lo, hi)
+        if lo == hi:
+            break
+    return lo, hi
+
+
+def _lower_bound(columns, row):
+    a, b, c = columns
+    lo = bisect_left(a, row[0])
+    hi = bisect_right(a, row[0], lo)
+    lo = bisect_left(b, row[1], lo, hi)
+    hi = bisect_right(b, row[1], lo, hi)
+    return bisect_left(c, row[2], lo, hi)
+
+
+class CompactStore(Store):
+    """
+    Dictionary-encoded, non-context-aware triple store
+
+    Terms are interned once in a dictionary (term -> ID, ID -> term); a triple
+    then costs three 32-bit IDs in each of the three sorted indexes, so every
+    pattern is answered by binary search on the index whose columns start
+    with its bound terms.
+
+    Sorted arrays are cheap to read and expensive to insert into, so changes
+    first go to a small pending set (added rows, indexed by term, and removed
+    rows) that queries consult too; it is merged into the columns once it
+    reaches 1/MERGE_RATIO of the store, by copying slices around the changed
+    positions. Terms of removed triples stay in the dictionary until restart.
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration)
+        self.identifier = identifier
+        self._ids = {}
+        self._terms = []
+        self._columns = [tuple(array('I') for _ in range(3)) for _ in ORDERS]
+        self._added = set()
+        # Added rows by term, per position: {id: set of rows}
+        self._added_by = ({}, {}, {})
+        self._removed = set()
+        self._namespace = {}
+        self._prefix = {}
+        self.merges = 0
+
+    # ----- terms -----
+
+    def _intern(self, term):
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = len(self._terms)
+            self._ids[term] = term_id
+            self._terms.append(term)
+        return term_id
+
+    def _encode(self, pattern):
+        # IDs of the bound terms of a pattern (None when unbound), or None if a term is unknown
+        row = []
+        for term in pattern:
+            if term is None:
+                row.append(None)
+            else:
+                term_id = self._ids.get(term)
+                if term_id is None:
+                    return None
+                row.append(term_id)
+        return row
+
+    # ----- rows -----
+
+    def _stored(self, row):
+        # In the columns (not removed since the last merge)?
+        columns = self._columns[0]
+        position = _lower_bound(columns, row)
+        return (
+            position < len(columns[0])
+            and columns[0][position] == row[0]
+            and columns[1][position] == row[1]
+            and columns[2][position] == row[2]
+        )
+
+    def _contains(self, row):
+        if row in self._added:
+            return True
+        return row not in self._removed and self._stored(row)
+
+    def _add_row(self, row):
+        if row in self._added:
+            return False
+        if self._stored(row):
+            if row not in self._removed:
+                return False
+            self._removed.discard(row)
+        else:
+            self._added.add(row)
+            for position, term_id in enumerate(row):
+                self._added_by[position].setdefault(term_id, set()).add(row)
+        self._maybe_merge()
+        return True
+
+    def _remove_row(self, row):
+        if row in self._added:
+            self._added.discard(row)
+            for position, term_id in enumerate(row):
+                rows = self._added_by[position][term_id]
+                rows.discard(row)
+                if not rows:
+                    del self._added_by[position][term_id]
+        else:
+            self._removed.add(row)
+            self._maybe_merge()
+
+    def _maybe_merge(self):
+        pending = len(self._added) + len(self._removed)
+        if pending >= max(MIN_MERGE, len(self._columns[0][0]) // MERGE_RATIO):
+            self.merge()
+
+    def merge(self):
+        """Apply the pending changes to the sorted columns"""
+        if not self._added and not self._removed:
+            return
+        added, removed = self._added, self._removed
+        columns = []
+        for order, old in zip(ORDERS, self._columns):
+            if len(added) + len(removed) > len(old[0]) // 4:
+                # Large batch (e.g. the initial load): sorting everything again is cheaper
+                dropped = {_permute(row, order) for row in removed}
+                rows = [row for row in zip(*old) if row not in dropped] if dropped else list(zip(*old))
+                rows.extend(_permute(row, order) for row in added)
+                rows.sort()
+                columns.append(tuple(array('I', column) for column in zip(*rows)) if rows
+                               else tuple(array('I') for _ in range(3)))
+                continue
+            # (position in the old columns, 0 = insert before / 1 = drop, row in this order)
+            events = [(_lower_bound(old, row), 0, row) for row in map(lambda r: _permute(r, order), added)]
+            events += [(_lower_bound(old, row), 1, row) for row in map(lambda r: _permute(r, order), removed)]
+            events.sort()
+            new = tuple(array('I') for _ in range(3))
+            start = 0
+            for position, drop, row in events:
+                for target, column in zip(new, old):
+                    target.extend(column[start:position])
+                if drop:
+                    start = position + 1
+                else:
+                    for target, value in zip(new, row):
+                        target.append(value)
+                    start = position
+            for target, column in zip(new, old):
+                target.extend(column[start:])
+            columns.append(new)
+        # Readers still iterating keep the old columns and pending sets, which stay consistent
+        self._columns = columns
+        self._added = set()
+        self._added_by = ({}, {}, {})
+        self._removed = set()
+        self.merges += 1
+
+    def _matches(self, pattern):
+        """IDs of the stored (s, p, o) rows matching an encoded pattern"""
+        s, p, o = pattern
+        if s is not None:
+            if p is not None:
+                order, key = SPO, (s, p) if o is None else (s, p, o)
+            elif o is not None:
+                order, key = OSP, (o, s)
+            else:
+                order, key = SPO, (s,)
+        elif p is not None:
+            order, key = POS, (p,) if o is None else (p, o)
+        elif o is not None:
+            order, key = OSP, (o,)
+        else:
+            order, key = SPO, ()
+
+        columns, added, removed = self._columns[ORDERS.index(order)], self._added, self._removed
+        # Pending rows are copied first: they may change while the caller iterates
+        if s is not None or p is not None or o is not None:
+            position, term_id = next((i, t) for i, t in enumerate(pattern) if t is not None)
+            candidates = self._added_by[position].get(term_id, ())
+        else:
+            candidates = added
+        pending = [
+            row for row in candidates
+            if (s is None or row[0] == s) and (p is None or row[1] == p) and (o is None or row[2] == o)
+        ]
+
+        lo, hi = _prefix_range(columns, key)
+        a, b, c = columns
+        for i in range(lo, hi):
+            row = _restore((a[i], b[i], c[i]), order)
+            if not removed or row not in removed:
+                yield row
+        yield from pending
+
+    # ----- rdflib Store API -----
+
+    def add(self, triple, context=None, quoted=False):
+        Store.add(self, triple, context, quoted)
+        self._add_row(tuple(self._intern(term) for term in triple))
+
+    def addN(self, quads):
+        for s, p, o, _ in quads:
+            self._add_row((self._intern(s), self._intern(p), self._intern(o)))
+
+    def remove(self, triple_pattern, context=None):
+        pattern = self._encode(triple_pattern)
+        if pattern is None:
+            return
+        for row in list(self._matches(pattern)):
+            self._remove_row(row)
+
+    def triples(self, triple_pattern, context=None):
+        pattern = self._encode(triple_pattern)
+        if pattern is None:
+            return
+        terms = self._terms
+        if None not in pattern:
+            # Fully bound: a membership test
+            if self._contains(tuple(pattern)):
+                yield triple_pattern, iter(())
+            return
+        for s, p, o in self._matches(pattern):
+            yield (terms[s], terms[p], terms[o]), iter(())
+
+    def __len__(self, context=None):
+        return len(self._columns[0][0]) - len(self._removed) + len(self._added)
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        # Same rules as rdflib's Memory store
+        bound_namespace = self._namespace.get(prefix)
+        bound_prefix = self._prefix.get(namespace)
+        if bound_prefix is None and bound_namespace is not None:
+            bound_prefix = self._prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self._namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self._prefix[bound_namespace]
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+        else:
+            namespace = bound_namespace if bound_namespace is not None else namespace
+            prefix = bound_prefix if bound_prefix is not None else prefix
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self._namespace.get(prefix)
+
+    def prefix(self, namespace):
+        return self._prefix.get(namespace)
+
+    def namespaces(self):
+        yield from list(self._namespace.items())
+
+    def stats(self):
+        return {
+            'triples': len(self),
+            'terms': len(self._terms),
+            'pendingAdded': len(self._added),
+            'pendingRemoved': len(self._removed),
+            'merges': self.merges
+        }
+
+
+# Graph(store='compact')
+plugin.register('compact', Store, __name__, 'CompactStore')
+
+
+if __name__ == '__main__':
+    # Benchmark: memory per triple and pattern/SPARQL latency against rdflib's Memory store
+    import gc
+    import sys
+    import time
+    import tracemalloc
+
+    from rdflib import Graph, Literal, Namespace, RDF, URIRef, XSD
+
+    ONT = Namespace("http://www.co-ode.org/ontologies/ont.owl#")
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    QUERY = "SELECT ?nom WHERE { ?c a ont:Capteur ; ont:Nom ?nom ; ont:aLatitude ?lat . FILTER(?lat > 36.79) }"
+
+    def sensor_triples():
+        # Same shape as ingest.generate_sensor_ntriples: a new term object per occurrence, like a parser
+        for n in range(count // 4):
+            subject = URIRef(f"{ONT}Capteur_{n}")
+            yield subject, URIRef(str(RDF.type)), URIRef(f"{ONT}Capteur")
+            yield subject, URIRef(f"{ONT}Nom"), Literal(f"Capteur {n}")
+            yield subject, URIRef(f"{ONT}aLatitude"), Literal(f"{36.7 + (n % 1000) / 10000:.4f}", datatype=XSD.decimal)
+            yield subject, URIRef(f"{ONT}aLongitude"), Literal(f"{10.1 + (n % 997) / 10000:.4f}", datatype=XSD.decimal)
+
+    def timed(function, rounds):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            function()
+        return (time.perf_counter() - start) / rounds
+
+    for store in ('default', 'compact'):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        graph = Graph(store=store)
+        graph.addN((s, p, o, graph) for s, p, o in sensor_triples())
+        if store == 'compact':
+            graph.store.merge()
+        loaded = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        subject = URIRef(f"{ONT}Capteur_{count // 8}")
+        name = Literal(f"Capteur {count // 8}")
+        latencies = {
+            's ? ?': timed(lambda: list(graph.triples((subject, None, None))), 2000),
+            '? p o': timed(lambda: list(graph.triples((None, ONT.Nom, name))), 2000),
+            's p o': timed(lambda: (subject, RDF.type, ONT.Capteur) in graph, 2000),
+            '? type Capteur': timed(lambda: sum(1 for _ in graph.subjects(RDF.type, ONT.Capteur)), 3),
+            'SPARQL': timed(lambda: len(list(graph.query(QUERY, initNs={'ont': ONT}))), 1),
+            'add+remove': timed(lambda: (graph.add((subject, ONT.Nom, Literal('x'))),
+                                         graph.remove((subject, ONT.Nom, Literal('x')))), 2000),
+        }
+        print(f"{store:>8}: {len(graph)} triples, {memory / len(graph):6.0f} bytes/triple, loaded in {loaded:.1f} s")
+        for label, seconds in latencies.items():
+            unit, scale = ('ms', 1e3) if seconds > 1e-3 else ('µs', 1e6)
+            print(f"          {label:<15} {seconds * scale:8.1f} {unit}")
+        del graph
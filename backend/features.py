@@ -0,0 +1,136 @@
+"""
+Feature Registry
+Optional integrations (AI, image hosting, station planner) are imported and
+configured on first use, so the core RDF API starts fast and runs without
+their dependencies or credentials
+"""
+
+import importlib
+import os
+import threading
+import time
+
+
+class FeatureUnavailable(Exception):
+    """Raised when an optional feature cannot be loaded"""
+
+    def __init__(self, feature, reason):
+        super().__init__(f"Feature '{feature}' unavailable: {reason}")
+        self.feature = feature
+        self.reason = reason
+
+
+class Feature:
+    """
+    One lazily loaded integration
+
+    The module is imported on the first get(). A failed load (missing package
+    or environment variable) is remembered, so later calls fail fast.
+    """
+
+    def __init__(self, name, module, required_env=(), check=None, description=""):
+        self.name = name
+        self.module_name = module
+        self.required_env = tuple(required_env)
+        self.check = check
+        self.description = description
+        self._module = None
+        self._error = None
+        self._load_seconds = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the loaded module, importing it on first use"""
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None and self._error is None:
+                self._load()
+        if self._error is not None:
+            raise FeatureUnavailable(self.name, self._error)
+        return self._module
+
+    def _load(self):
+        missing = [var for var in self.required_env if not os.getenv(var)]
+        if missing:
+            self._error = f"missing environment variable(s) {', '.join(missing)}"
+            return
+        if self.check is not None:
+            problem = self.check()
+            if problem:
+                self._error = problem
+                return
+        start = time.perf_counter()
+        try:
+            module = importlib.import_module(self.module_name)
+        except Exception as e:
+            self._error = f"{type(e).__name__}: {e}"
+            return
+        self._load_seconds = time.perf_counter() - start
+        self._module = module
+        print(f"🔌 Feature '{self.name}' loaded in {self._load_seconds * 1000:.0f} ms")
+
+    def reset(self):
+        """Forget a failed load, e.g. after the environment was fixed"""
+        with self._lock:
+            self._error = None
+
+    def status(self):
+        return {
+            'description': self.description,
+            'loaded': self._module is not None,
+            'error': self._error,
+            'loadMillis': round(self._load_seconds * 1000, 1) if self._load_seconds is not None else None
+        }
+
+
+_registry = {}
+
+
+def register(name, module, required_env=(), check=None, description=""):
+    """Declare an optional feature backed by a module"""
+    _registry[name] = Feature(name, module, required_env, check, description)
+    return _registry[name]
+
+
+def require(name):
+    """
+    Get the module of a feature, loading it on first use
+
+    Raises:
+        FeatureUnavailable: When the feature cannot be loaded
+    """
+    return _registry[name].get()
+
+
+def status():
+    """Load state of every registered feature"""
+    return {name: feature.status() for name, feature in _registry.items()}
+
+
+def _check_llm_credentials():
+    if os.getenv('LLM_BACKEND', 'gemini').lower() == 'gemini' and not os.getenv('GEMINI_API_KEY'):
+        return "GEMINI_API_KEY not found in environment variables (or set LLM_BACKEND=local)"
+    return None
+
+
+def _check_image_store_credentials():
+    if os.getenv('IMAGE_STORE', 'cloudinary').lower() != 'cloudinary':
+        return None
+    missing = [var for var in ('CLOUDINARY_CLOUD_NAME', 'CLOUDINARY_API_KEY', 'CLOUDINARY_API_SECRET')
+               if not os.getenv(var)]
+    if missing:
+        return f"missing environment variable(s) {', '.join(missing)} (or set IMAGE_STORE=local)"
+    return None
+
+
+register('ai', 'ai_helper', check=_check_llm_credentials,
+         description="Natural language queries, suggestions and insights")
+register('llm', 'llm_backend', check=_check_llm_credentials,
+         description="Shared LLM backend (Gemini or local stand-in)")
+register('dispatch', 'gemini_dispatch',
+         description="Hedged dispatch over several Gemini models")
+register('images', 'cloudinary_helper', check=_check_image_store_credentials,
+         description="Image uploads to Cloudinary (or a local directory)")
+register('planner', 'station_planner',
+         description="Local station placement (NumPy)")
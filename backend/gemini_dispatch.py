@@ -0,0 +1,262 @@
+"""
+Gemini Model Dispatch
+Sends one prompt to several Gemini models with hedged requests over a shared
+keep-alive connection pool, and returns the first valid answer
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+
+# Models tried for the free tier, in order of preference
+DEFAULT_MODEL_CONFIGS = [
+    ('gemini-2.5-flash', 'v1beta'),          # Stable release - BEST FOR FREE TIER
+    ('gemini-2.0-flash', 'v1beta'),          # Also stable
+    ('gemini-flash-latest', 'v1beta'),       # Latest version
+    ('gemini-2.5-flash-lite', 'v1beta'),     # Lighter version
+    ('gemini-2.0-flash-lite', 'v1beta'),     # Lighter 2.0
+]
+
+# Delay before the next model is started while the previous one is still running
+DEFAULT_HEDGE_DELAY = float(os.getenv('GEMINI_HEDGE_DELAY', '2.5'))
+DEFAULT_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '30'))
+
+_POOL_SIZE = 16
+
+# One session for every Gemini call so TLS connections are kept alive and reused
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=_POOL_SIZE))
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=_POOL_SIZE))
+_session.headers.update({'Content-Type': 'application/json'})
+
+_executor = ThreadPoolExecutor(max_workers=_POOL_SIZE, thread_name_prefix='gemini')
+
+
+class GeminiDispatchError(Exception):
+    """Raised when no model produced a valid answer"""
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def build_payload(prompt, temperature=0.7, max_output_tokens=2048):
+    """Build a generateContent request body for a single text prompt"""
+    return {
+        "contents": [{
+            "parts": [{
+                "text": prompt
+            }]
+        }],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_output_tokens,
+        }
+    }
+
+
+def get_session():
+    """The keep-alive session shared by every Gemini call"""
+    return _session
+
+
+def model_url(model_name, api_version, method='generateContent'):
+    """REST URL of a Gemini model method"""
+    return f'{GEMINI_API_BASE}/{api_version}/models/{model_name}:{method}'
+
+
+def call_model(model_name, api_version, payload, api_key, timeout=DEFAULT_TIMEOUT):
+    """
+    Call one Gemini model through the pooled session
+
+    Returns:
+        str: The text of the first candidate
+
+    Raises:
+        RuntimeError: On a non-200 status or a response without candidates
+    """
+    response = _session.post(model_url(model_name, api_version), params={'key': api_key},
+                             json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"Model {model_name} returned {response.status_code}: {response.text[:200]}")
+
+    result = response.json()
+    if 'candidates' not in result or len(result['candidates']) == 0:
+        raise RuntimeError(f"Model {model_name} returned no candidates: {str(result)[:200]}")
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+
+def generate_hedged(prompt, backend, model_configs=None, hedge_delay=DEFAULT_HEDGE_DELAY,
+                    timeout=DEFAULT_TIMEOUT, parse=None):
+    """
+    Send a prompt to several models, starting the next one after a short delay
+
+    The first model starts immediately. Each following model starts when the
+    previous attempts have all failed or when hedge_delay elapses without an
+    answer, so a slow model no longer blocks for its full timeout. The first
+    valid answer wins and attempts that have not started yet are cancelled.
+    An HTTP call already in flight cannot be interrupted: the losing attempt
+    is abandoned, ends at the latest at the overall deadline (its timeout),
+    and its answer is dropped without being parsed.
+
+    Args:
+        prompt: Prompt text
+        backend: LLM backend (see llm_backend) the attempts are sent to
+        model_configs: List of (model_name, api_version), in order of preference
+        hedge_delay: Seconds to wait before hedging with the next model;
+            None tries the models strictly one after another
+        timeout: Per-attempt timeout and overall deadline, in seconds
+        parse: Optional callable turning the text into the final value;
+            raising marks the answer invalid and moves on to the next model
+
+    Returns:
+        dict: Contains 'value', 'text', 'model', 'elapsed' and 'attempts'
+
+    Raises:
+        GeminiDispatchError: When every model failed
+    """
+    configs = list(model_configs or DEFAULT_MODEL_CONFIGS)
+    cancelled = threading.Event()
+    attempts = []
+    start = time.perf_counter()
+    deadline = start + timeout
+
+    def attempt(model_name):
+        if cancelled.is_set():
+            raise RuntimeError(f"Model {model_name} cancelled")
+        text = backend.generate(prompt, model=model_name,
+                                timeout=max(0.1, deadline - time.perf_counter()))
+        if cancelled.is_set():
+            raise RuntimeError(f"Model {model_name} answered after the dispatch ended")
+        value = parse(text) if parse else text
+        return text, value
+
+    pending = {}
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        model_name, _ = configs[next_index]
+        next_index += 1
+        future = _executor.submit(attempt, model_name)
+        pending[future] = (model_name, time.perf_counter())
+
+    launch()
+    try:
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            can_hedge = hedge_delay is not None and next_index < len(configs)
+            done, _ = wait(list(pending), timeout=min(hedge_delay, remaining) if can_hedge else remaining,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                model_name, started = pending.pop(future)
+                elapsed = time.perf_counter() - started
+                try:
+                    text, value = future.result()
+                except Exception as e:
+                    attempts.append({'model': model_name, 'ok': False, 'error': str(e), 'elapsed': elapsed})
+                    continue
+                attempts.append({'model': model_name, 'ok': True, 'elapsed': elapsed})
+                return {
+                    'value': value,
+                    'text': text,
+                    'model': model_name,
+                    'elapsed': time.perf_counter() - start,
+                    'attempts': attempts
+                }
+
+            # An attempt failed, or the hedge delay passed without an answer
+            if next_index < len(configs) and time.perf_counter() < deadline:
+                launch()
+    finally:
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+    for model_name, started in pending.values():
+        attempts.append({'model': model_name, 'ok': False, 'error': 'deadline exceeded',
+                         'elapsed': time.perf_counter() - started})
+    last_error = attempts[-1]['error'] if attempts else 'No model attempted'
+    raise GeminiDispatchError(last_error, attempts)
+
+
+if __name__ == '__main__':
+    # Latency benchmark against a local fake Gemini server:
+    #   python gemini_dispatch.py [requests]
+    import json
+    import random
+    import statistics
+    import sys
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    # Per-model behaviour of the fake server: (median latency in s, failure rate)
+    FAKE_MODELS = {
+        'gemini-2.5-flash': (0.4, 0.35),
+        'gemini-2.0-flash': (0.3, 0.10),
+        'gemini-flash-latest': (0.5, 0.05),
+        'gemini-2.5-flash-lite': (0.2, 0.05),
+        'gemini-2.0-flash-lite': (0.2, 0.05),
+    }
+
+    class FakeGemini(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            model_name = self.path.split('/models/')[1].split(':')[0]
+            median, failure_rate = FAKE_MODELS.get(model_name, (0.3, 0.0))
+            # Long-tailed latency: most calls near the median, some very slow
+            time.sleep(random.lognormvariate(0, 0.6) * median)
+            if random.random() < failure_rate:
+                body, status = json.dumps({'error': {'code': 429, 'message': 'quota'}}), 429
+            else:
+                body, status = json.dumps({'candidates': [{'content': {'parts': [{'text': '[]'}]}}]}), 200
+            data = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    GEMINI_API_BASE = f'http://127.0.0.1:{server.server_port}'
+
+    from llm_backend import GeminiBackend
+    import gemini_dispatch
+    gemini_dispatch.GEMINI_API_BASE = GEMINI_API_BASE
+    backend = GeminiBackend('fake-key')
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    def percentiles(samples):
+        ordered = sorted(samples)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return (f"p50={pick(0.50) * 1000:7.1f}ms p95={pick(0.95) * 1000:7.1f}ms "
+                f"p99={pick(0.99) * 1000:7.1f}ms mean={statistics.mean(ordered) * 1000:7.1f}ms")
+
+    for label, delay in (('sequential', None), ('hedged 0.5s', 0.5), ('hedged 0.25s', 0.25)):
+        random.seed(42)
+        samples, failures = [], 0
+        for _ in range(count):
+            t0 = time.perf_counter()
+            try:
+                generate_hedged('benchmark', backend, hedge_delay=delay, timeout=10, parse=json.loads)
+            except GeminiDispatchError:
+                failures += 1
+            samples.append(time.perf_counter() - t0)
+        print(f"{label:>13}: {percentiles(samples)} failures={failures}/{count}")
+
+    server.shutdown()
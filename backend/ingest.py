@@ -0,0 +1,209 @@
+"""
+Bulk RDF Ingest
+Streams N-Triples, Turtle or RDF/XML files into the graph in batches, so large
+sensor dumps can be loaded without building a second in-memory graph
+
+Usable from the API (POST /api/import) or offline:
+    python ingest.py capteurs.nt --rdf ../Projet.rdf
+"""
+
+import os
+import time
+
+from rdflib import Graph
+
+# Content type / file extension -> rdflib parser name
+FORMATS = {
+    'application/n-triples': 'nt',
+    'text/plain': 'nt',
+    'text/turtle': 'turtle',
+    'application/x-turtle': 'turtle',
+    'application/rdf+xml': 'xml',
+    'application/xml': 'xml',
+    'text/xml': 'xml',
+}
+EXTENSIONS = {'.nt': 'nt', '.ttl': 'turtle', '.rdf': 'xml', '.owl': 'xml', '.xml': 'xml'}
+PARSERS = {'nt', 'turtle', 'xml'}
+
+
+def detect_format(name=None, mimetype=None, requested=None):
+    """
+    Parser name from an explicit format, the content type or the file name
+
+    Raises:
+        ValueError: When the format is not supported
+    """
+    if requested:
+        aliases = {'ntriples': 'nt', 'n-triples': 'nt', 'ttl': 'turtle', 'rdfxml': 'xml', 'rdf': 'xml'}
+        fmt = aliases.get(requested.lower(), requested.lower())
+    elif mimetype in FORMATS:
+        fmt = FORMATS[mimetype]
+    else:
+        fmt = EXTENSIONS.get(os.path.splitext(name or '')[1].lower())
+    if fmt not in PARSERS:
+        raise ValueError(f"Unsupported RDF format: {requested or mimetype or name}; use nt, turtle or xml")
+    return fmt
+
+
+class _BatchSink(Graph):
+    """
+    Parser target that buffers triples and hands them over in batches
+
+    rdflib parsers call add() once per triple; nothing is stored here. The
+    N-Triples parser reads its input line by line and the RDF/XML one through
+    SAX, so memory stays bounded by the batch size (Turtle documents are read
+    whole by rdflib, the triples are still applied in batches).
+    """
+
+    def __init__(self, batch_size, flush):
+        super().__init__()
+        self.batch_size = batch_size
+        self._flush = flush
+        self._buffer = []
+
+    def add(self, triple):
+        self._buffer.append(triple)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return self
+
+    def flush(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self._flush(batch)
+
+
+class Ingestor:
+    """
+    Applies a streamed RDF file to a graph, batch by batch
+
+    Each batch is added with graph.addN under the lock, which is released in
+    between so API requests keep being served; the parser waits while a batch
+    is applied, which throttles reading to the speed of the graph. Callbacks
+    receive every batch after it was applied, to keep derived indexes (user
+    index, ID sequences...) up to date incrementally.
+
+    An import is not atomic: if the file turns out to be invalid halfway, the
+    batches applied so far stay in the graph and the error reports how many.
+    """
+
+    def __init__(self, graph, lock, batch_size=10_000, on_batch=(), max_triples=None):
+        self.graph = graph
+        self.lock = lock
+        self.batch_size = batch_size
+        self.on_batch = tuple(on_batch)
+        self.max_triples = max_triples
+
+    def ingest(self, path, fmt, report=None):
+        """
+        Stream a file into the graph
+
+        Args:
+            path: File to read
+            fmt: Parser name ('nt', 'turtle' or 'xml')
+            report: Optional callable receiving progress keyword arguments
+
+        Returns:
+            dict: Triples read and added, batches, bytes, seconds and rate
+        """
+        size = os.path.getsize(path)
+        counters = {'triples': 0, 'added': 0, 'batches': 0}
+        start = time.perf_counter()
+
+        with open(path, 'rb') as source:
+            def apply(batch):
+                if self.max_triples is not None and counters['triples'] + len(batch) > self.max_triples:
+                    raise ValueError(f"Import larger than {self.max_triples} triples")
+                with self.lock:
+                    before = len(self.graph)
+                    self.graph.addN((s, p, o, self.graph) for s, p, o in batch)
+                    counters['added'] += len(self.graph) - before
+                for callback in self.on_batch:
+                    callback(batch)
+                counters['triples'] += len(batch)
+                counters['batches'] += 1
+                if report is not None:
+                    elapsed = time.perf_counter() - start
+                    report(
+                        stage='parsing',
+                        # rdflib closes the file once parsed: the last batch is flushed after that
+                        bytesRead=size if source.closed else min(source.tell(), size),
+                        totalBytes=size,
+                        triplesPerSecond=round(counters['triples'] / elapsed) if elapsed else None,
+                        **counters
+                    )
+
+            sink = _BatchSink(self.batch_size, apply)
+            try:
+                sink.parse(file=source, format=fmt)
+                sink.flush()
+            except Exception as e:
+                raise ValueError(f"{e} (after {counters['triples']} triples were imported)") from e
+
+        elapsed = time.perf_counter() - start
+        return {
+            **counters,
+            'bytes': size,
+            'format': fmt,
+            'seconds': round(elapsed, 3),
+            'triplesPerSecond': round(counters['triples'] / elapsed) if elapsed else None
+        }
+
+
+def generate_sensor_ntriples(path, count):
+    """Write a synthetic Capteur feed of about count triples, for benchmarks"""
+    ont = "http://www.co-ode.org/ontologies/ont.owl#"
+    xsd = "http://www.w3.org/2001/XMLSchema#"
+    rdf_type = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+    with open(path, 'w', encoding='utf-8') as out:
+        for n in range(1, count // 4 + 1):
+            subject = f"<{ont}Capteur_{n + 1000}>"
+            out.write(f"{subject} <{rdf_type}> <{ont}Capteur> .\n")
+            out.write(f'{subject} <{ont}Nom> "Capteur {n}" .\n')
+            out.write(f'{subject} <{ont}aLatitude> "{36.7 + (n % 1000) / 10000:.4f}"^^<{xsd}decimal> .\n')
+            out.write(f'{subject} <{ont}aLongitude> "{10.1 + (n % 997) / 10000:.4f}"^^<{xsd}decimal> .\n')
+
+
+if __name__ == '__main__':
+    import argparse
+    import threading
+
+    parser = argparse.ArgumentParser(description="Stream an RDF file into the smart city graph")
+    parser.add_argument('file', nargs='?', help="N-Triples (.nt), Turtle (.ttl) or RDF/XML (.rdf) file")
+    parser.add_argument('--format', help="nt, turtle or xml (default: from the extension)")
+    parser.add_argument('--rdf', default=os.path.join(os.path.dirname(__file__), '..', 'Projet.rdf'),
+                        help="Graph to load before importing")
+    parser.add_argument('--output', help="Where to save the result (default: --rdf; nothing with --dry-run)")
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--dry-run', action='store_true', help="Import without saving, to measure the rate")
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help="Benchmark: write a synthetic Capteur feed of N triples and import it")
+    args = parser.parse_args()
+
+    if args.generate:
+        import tempfile
+        args.file = os.path.join(tempfile.gettempdir(), f'capteurs_{args.generate}.nt')
+        print(f"📝 Writing {args.generate} triples to {args.file}")
+        generate_sensor_ntriples(args.file, args.generate)
+        args.dry_run = True
+    if not args.file:
+        parser.error("a file (or --generate N) is required")
+
+    graph = Graph()
+    graph.parse(args.rdf, format='xml')
+    before = len(graph)
+
+    def progress(**state):
+        if state['batches'] % 20 == 0:
+            print(f"  {state['triples']:>10} triples, {state['triplesPerSecond']} triples/s, "
+                  f"{state['bytesRead'] * 100 // max(state['totalBytes'], 1)}%")
+
+    ingestor = Ingestor(graph, threading.Lock(), batch_size=args.batch_size)
+    summary = ingestor.ingest(args.file, detect_format(args.file, requested=args.format), report=progress)
+    print(f"✅ {summary['triples']} triples read ({summary['added']} new) in {summary['seconds']} s: "
+          f"{summary['triplesPerSecond']} triples/s; graph {before} -> {len(graph)} triples")
+
+    if not args.dry_run:
+        output = args.output or args.rdf
+        graph.serialize(destination=output, format='xml')
+        print(f"💾 Saved to {output}")
@@ -0,0 +1,142 @@
+"""
+Background Jobs
+Bounded worker pool for slow work (image uploads, imports...) that is answered
+with a job ID right away and polled through a status endpoint
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already queued or running"""
+
+
+class Job:
+    """State of one background job, updated by the worker running it"""
+
+    def __init__(self, kind, meta=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = dict(meta or {})
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def report(self, **progress):
+        """Publish progress counters while the job runs"""
+        self.progress.update(progress)
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'result': self.result,
+            'error': self.error,
+            'createdAt': self.created,
+            'startedAt': self.started,
+            'finishedAt': self.finished,
+            **self.meta
+        }
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded thread pool and keeps their state for polling
+
+    At most max_pending jobs may be queued or running at once; submit()
+    raises QueueFull beyond that so callers can answer 503 instead of piling
+    up work. Finished jobs are kept for ttl seconds (max_entries at most).
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, max_entries=1000, ttl=3600, name='jobs'):
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, kind, fn, *args, meta=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) and return its Job
+
+        Raises:
+            QueueFull: When max_pending jobs are already queued or running
+        """
+        job = Job(kind, meta)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self._pending} jobs already pending, try again later")
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            print(f"❌ {job.kind} job {job.id} failed: {e}")
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._pending -= 1
+                if job.status == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job._done.set()
+
+    def get(self, job_id, wait_seconds=0):
+        """Get a job, optionally waiting for it to finish; None if unknown or expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and wait_seconds > 0:
+            job.wait(wait_seconds)
+        return job
+
+    def _evict(self):
+        now = time.time()
+        while self._jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.finished is None and len(self._jobs) <= self.max_entries:
+                break
+            if len(self._jobs) <= self.max_entries and now - oldest.created < self.ttl:
+                break
+            self._jobs.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'maxPending': self.max_pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'tracked': len(self._jobs)
+            }
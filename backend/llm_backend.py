@@ -0,0 +1,391 @@
+"""
+LLM Backends
+One interface for every AI call: Gemini over the pooled REST session, or a
+deterministic local stand-in for offline benchmarks and load tests.
+Identical prompts in flight at the same time share a single backend call, and
+every model sits behind a circuit breaker and a quota-matched rate limiter.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+
+from gemini_dispatch import (
+    DEFAULT_MODEL_CONFIGS,
+    DEFAULT_TIMEOUT,
+    build_payload,
+    call_model,
+    get_session,
+    model_url
+)
+import metrics
+from resilience import BackendUnavailable, CircuitBreaker, TokenBucket, is_throttling_error
+
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+# Calls that reached the backend; shed calls are counted in ResilientBackend.shed
+CALL_SECONDS = metrics.histogram(
+    'smartcity_llm_call_seconds', "LLM call latency per model, streams until their last chunk",
+    ['backend', 'model', 'outcome'], buckets=metrics.SLOW_BUCKETS
+)
+
+
+class LLMBackend(ABC):
+    """Interface of an LLM backend"""
+
+    name = 'base'
+
+    @abstractmethod
+    def generate(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        """Return the full text generated for a prompt"""
+
+    def stream(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        """Yield text chunks as they are generated (one chunk by default)"""
+        yield self.generate(prompt, model=model, timeout=timeout)
+
+
+class GeminiBackend(LLMBackend):
+    """Gemini REST API, through the keep-alive session shared with the model dispatcher"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, default_model=DEFAULT_MODEL):
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables. Please check your .env file.")
+        self.api_key = api_key
+        self.default_model = default_model
+        self._versions = dict(DEFAULT_MODEL_CONFIGS)
+
+    def generate(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        model = model or self.default_model
+        return call_model(model, self._versions.get(model, 'v1beta'), build_payload(prompt),
+                          self.api_key, timeout=timeout)
+
+    def stream(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        model = model or self.default_model
+        url = model_url(model, self._versions.get(model, 'v1beta'), 'streamGenerateContent')
+        response = get_session().post(url, params={'key': self.api_key, 'alt': 'sse'},
+                                      json=build_payload(prompt), timeout=timeout, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Model {model} returned {response.status_code}: {response.text[:200]}")
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                chunk = json.loads(line[5:])
+                for candidate in chunk.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        if part.get('text'):
+                            yield part['text']
+
+
+class LocalBackend(LLMBackend):
+    """
+    Deterministic stand-in for Gemini
+
+    Answers are derived from a hash of the prompt, in the shape each AI
+    function expects, and latencies follow a seeded log-normal distribution
+    so the AI endpoints can be load-tested without network access.
+    """
+
+    name = 'local'
+
+    def __init__(self, median_latency=0.8, sigma=0.5, failure_rate=0.0, seed=0, chunk_size=24):
+        self.median_latency = median_latency
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            return self._rng.lognormvariate(0, self.sigma) * self.median_latency, self._rng.random()
+
+    def generate(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        latency, roll = self._draw()
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"Local model {model or DEFAULT_MODEL} timed out after {timeout}s")
+        if roll < self.failure_rate:
+            raise RuntimeError(f"Local model {model or DEFAULT_MODEL} returned 429: simulated quota error")
+        return self._answer(prompt)
+
+    def stream(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        latency, roll = self._draw()
+        if roll < self.failure_rate:
+            raise RuntimeError(f"Local model {model or DEFAULT_MODEL} returned 429: simulated quota error")
+        text = self._answer(prompt)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or ['']
+        # Time to first token is a fraction of the full latency, the rest is spread over chunks
+        time.sleep(latency * 0.2)
+        for chunk in chunks:
+            yield chunk
+            time.sleep(latency * 0.8 / len(chunks))
+
+    def _answer(self, prompt):
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        pick = lambda options, i=0: options[digest[i] % len(options)]
+
+        if 'Return ONLY the SPARQL query' in prompt:
+            cls = pick(['Transport', 'Station', 'Utilisateur', 'EvenementDeCirculation', 'ZoneUrbaine'])
+            return ("PREFIX smartcity: <http://example.org/smartcity#>\n"
+                    "PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n"
+                    "PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>\n"
+                    f"SELECT ?entity ?type WHERE {{ ?entity rdf:type ?type . "
+                    f"?type rdfs:subClassOf* smartcity:{cls} . }}")
+        if 'Separate them with "---"' in prompt:
+            return ("SELECT ?s WHERE { ?s a <http://example.org/smartcity#Station> }\n---\n"
+                    "SELECT ?s WHERE { ?s a <http://example.org/smartcity#Trajet> }")
+        if '"reason"' in prompt and 'JSON array' in prompt:
+            match = re.search(r'JSON array of (\d+) objects', prompt)
+            if match:
+                return json.dumps([
+                    {'name': f"Station {pick(['Lac', 'Medina', 'Ariana', 'Marsa', 'Bardo'], i)} {i + 1}",
+                     'reason': "Zone peu desservie par les stations existantes."}
+                    for i in range(int(match.group(1)))
+                ])
+            return json.dumps([
+                {'type': pick(['StationBus', 'StationMétro', 'Parking'], i),
+                 'name': f"Station {pick(['Lac', 'Medina', 'Ariana', 'Marsa', 'Bardo'], i)}",
+                 'latitude': round(36.75 + digest[i] / 2550, 4),
+                 'longitude': round(10.10 + digest[i + 3] / 2550, 4),
+                 'reason': "Zone peu desservie par les stations existantes.",
+                 'priority': pick(['high', 'medium', 'low'], i)}
+                for i in range(3)
+            ])
+        if 'SPARQL query suggestions' in prompt:
+            return ("Description: Lister les transports électriques\n"
+                    "Description: Compter les événements par zone\n"
+                    "Description: Trouver les stations les plus proches du centre")
+        if 'Explain in 1-2 simple sentences' in prompt:
+            return "Cette requête liste les entités demandées ; les résultats correspondent aux données actuelles."
+        return ("La mobilité urbaine est stable. "
+                f"Le réseau {pick(['de bus', 'de métro', 'de vélos'])} gagnerait à être renforcé aux heures de pointe. "
+                "Les événements de circulation restent concentrés dans le centre-ville.")
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Wraps a backend with one circuit breaker and one token bucket per model
+
+    Calls to a model whose circuit is open, or that get no token within
+    max_wait seconds, are shed at once with BackendUnavailable instead of
+    waiting out the provider's timeout.
+    """
+
+    def __init__(self, backend, rate_per_minute=60, burst=10, max_wait=2.0,
+                 failure_threshold=0.5, min_calls=5, window=60, open_seconds=30):
+        self.backend = backend
+        self.name = backend.name
+        self.max_wait = max_wait
+        self._breaker_settings = dict(failure_threshold=failure_threshold, min_calls=min_calls,
+                                      window=window, open_seconds=open_seconds)
+        self._bucket_settings = dict(rate_per_minute=rate_per_minute, burst=burst)
+        self._guards = {}
+        self._lock = threading.Lock()
+        self.shed = {'circuit_open': 0, 'rate_limited': 0}
+
+    def _guard(self, model):
+        with self._lock:
+            guard = self._guards.get(model)
+            if guard is None:
+                guard = (CircuitBreaker(**self._breaker_settings), TokenBucket(**self._bucket_settings))
+                self._guards[model] = guard
+            return guard
+
+    def _admit(self, model, timeout):
+        """Return the model's breaker and bucket, or raise if the call must be shed"""
+        breaker, bucket = self._guard(model)
+        if not breaker.allow():
+            self._count_shed('circuit_open')
+            raise BackendUnavailable(f"Model {model} circuit open, call shed", 'circuit_open')
+        if not bucket.acquire(min(self.max_wait, timeout)):
+            breaker.release()
+            self._count_shed('rate_limited')
+            raise BackendUnavailable(f"Model {model} rate limit reached, call shed", 'rate_limited')
+        return breaker, bucket
+
+    def _count_shed(self, reason):
+        with self._lock:
+            self.shed[reason] += 1
+
+    @staticmethod
+    def _record(breaker, bucket, error=None):
+        breaker.record(error is None)
+        if error is None:
+            bucket.on_success()
+        elif is_throttling_error(error):
+            bucket.on_throttled()
+
+    def available(self, model=None):
+        """Whether calls to a model are currently let through (no open circuit)"""
+        breaker = self._guard(model or DEFAULT_MODEL)[0].snapshot()
+        return breaker['state'] != CircuitBreaker.OPEN or breaker['retryInSeconds'] == 0
+
+    def generate(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        breaker, bucket = self._admit(model or DEFAULT_MODEL, timeout)
+        start = time.perf_counter()
+        try:
+            text = self.backend.generate(prompt, model=model, timeout=timeout)
+        except Exception as e:
+            CALL_SECONDS.observe(time.perf_counter() - start, self.name, model or DEFAULT_MODEL, 'error')
+            self._record(breaker, bucket, e)
+            raise
+        CALL_SECONDS.observe(time.perf_counter() - start, self.name, model or DEFAULT_MODEL, 'success')
+        self._record(breaker, bucket)
+        return text
+
+    def stream(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        breaker, bucket = self._admit(model or DEFAULT_MODEL, timeout)
+        start = time.perf_counter()
+        try:
+            yield from self.backend.stream(prompt, model=model, timeout=timeout)
+        except GeneratorExit:
+            # Client went away mid-stream: no verdict on the model
+            breaker.release()
+            raise
+        except Exception as e:
+            CALL_SECONDS.observe(time.perf_counter() - start, self.name, model or DEFAULT_MODEL, 'error')
+            self._record(breaker, bucket, e)
+            raise
+        CALL_SECONDS.observe(time.perf_counter() - start, self.name, model or DEFAULT_MODEL, 'success')
+        self._record(breaker, bucket)
+
+    def stats(self):
+        with self._lock:
+            guards = dict(self._guards)
+            shed = dict(self.shed)
+        return {
+            'shed': shed,
+            'models': {
+                model: {'breaker': breaker.snapshot(), 'rateLimit': bucket.snapshot()}
+                for model, (breaker, bucket) in guards.items()
+            }
+        }
+
+
+class CoalescingBackend(LLMBackend):
+    """
+    Wraps a backend so concurrent identical prompts share one call
+
+    Only generate() is coalesced; every stream gets its own generation.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def generate(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        key = (model, prompt)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if owner:
+            try:
+                future.set_result(self.backend.generate(prompt, model=model, timeout=timeout))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+        return future.result()
+
+    def stream(self, prompt, model=None, timeout=DEFAULT_TIMEOUT):
+        return self.backend.stream(prompt, model=model, timeout=timeout)
+
+    def available(self, model=None):
+        return self.backend.available(model) if hasattr(self.backend, 'available') else True
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'backend': self.name,
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'inFlight': len(self._inflight)
+            }
+        if hasattr(self.backend, 'stats'):
+            stats.update(self.backend.stats())
+        return stats
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None):
+    """Build the backend selected by LLM_BACKEND ('gemini' by default, or 'local')"""
+    name = (name or os.getenv('LLM_BACKEND', 'gemini')).lower()
+    if name == 'local':
+        return LocalBackend(
+            median_latency=float(os.getenv('LLM_LOCAL_LATENCY_MS', '800')) / 1000,
+            sigma=float(os.getenv('LLM_LOCAL_SIGMA', '0.5')),
+            failure_rate=float(os.getenv('LLM_LOCAL_FAILURE_RATE', '0')),
+            seed=int(os.getenv('LLM_LOCAL_SEED', '0'))
+        )
+    if name == 'gemini':
+        return GeminiBackend(os.getenv('GEMINI_API_KEY'))
+    raise ValueError(f"Unknown LLM_BACKEND: {name}")
+
+
+def create_resilient_backend(backend):
+    """Wrap a backend with the breaker and rate limit settings from the environment"""
+    return ResilientBackend(
+        backend,
+        rate_per_minute=float(os.getenv('LLM_RATE_PER_MINUTE', '60')),
+        burst=float(os.getenv('LLM_RATE_BURST', '10')),
+        max_wait=float(os.getenv('LLM_RATE_MAX_WAIT', '2')),
+        failure_threshold=float(os.getenv('LLM_BREAKER_FAILURE_RATE', '0.5')),
+        min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', '5')),
+        open_seconds=float(os.getenv('LLM_BREAKER_OPEN_SECONDS', '30'))
+    )
+
+
+def get_backend():
+    """Shared coalescing backend used by every AI function"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = CoalescingBackend(create_resilient_backend(create_backend()))
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the shared backend, e.g. with a LocalBackend in a load test"""
+    global _backend
+    with _backend_lock:
+        _backend = backend if isinstance(backend, CoalescingBackend) else CoalescingBackend(backend)
+
+
+if __name__ == '__main__':
+    # Coalescing demo on the local backend: python llm_backend.py [clients]
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    backend = CoalescingBackend(LocalBackend(median_latency=0.3))
+    prompts = [f"Explain in 1-2 simple sentences query #{i % 5}" for i in range(clients)]
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(backend.generate, prompts))
+    print(f"{clients} concurrent requests over 5 distinct prompts in {time.perf_counter() - t0:.2f}s: {backend.stats()}")
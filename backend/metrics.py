@@ -0,0 +1,247 @@
+"""
+Metrics
+Counters, gauges and latency histograms exposed in the Prometheus text
+format by GET /api/metrics, without any dependency
+
+Subsystems declare their metrics once, at import time, on the shared registry:
+    UPLOAD_SECONDS = metrics.histogram('smartcity_image_upload_seconds', "Image upload latency", ['store'])
+    UPLOAD_SECONDS.observe(elapsed, 'cloudinary')
+
+Recording a value is a dict lookup, a bisect and two additions under a lock
+(about a microsecond). Values that already exist elsewhere (triple
+count, cache counters) are read by callbacks when the metrics are scraped.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds, from fast graph lookups to slow HTTP calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(int(value))
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _check(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {values}")
+
+    def _header(self):
+        return [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+            for values, value in series
+        ]
+
+
+class Counter(_Metric):
+    """Monotonic count (requests, errors, bytes sent)"""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            if labels not in self._series:
+                self._check(labels)
+                self._series[labels] = 0
+            self._series[labels] += amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (size of the last save, queue depth)"""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            if labels not in self._series:
+                self._check(labels)
+            self._series[labels] = value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(_Metric):
+    """Distribution of a duration over fixed buckets, with its sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # Bucket i counts values in (buckets[i-1], buckets[i]]; the last one is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                self._check(labels)
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        lines = self._header()
+        bounds = [_format_value(float(bound)) for bound in self.buckets] + ['+Inf']
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Callback(_Metric):
+    """Metric read from a function at scrape time: a number, or {label values tuple: number}"""
+
+    def __init__(self, name, documentation, kind, function, labels=()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.function = function
+
+    def render(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            # One failing source must not break the whole scrape
+            return self._header() + [f"# {self.name} unavailable: {_escape(e)}"]
+        series = value.items() if isinstance(value, dict) else [((), value)]
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(number)}"
+            for values, number in sorted(series) if number is not None
+        ]
+
+
+class Registry:
+    """Named metrics, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def callback(self, name, documentation, function, kind='gauge', labels=()):
+        """Register (or replace) a metric whose value is computed by function when scraped"""
+        with self._lock:
+            self._metrics[name] = _Callback(name, documentation, kind, function, labels)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+callback = REGISTRY.callback
+render = REGISTRY.render
+
+
+if __name__ == '__main__':
+    # Benchmark: cost of recording one value
+    N = 1_000_000
+    registry = Registry()
+    requests = registry.counter('bench_requests_total', "Requests", ['method', 'route', 'status'])
+    latency = registry.histogram('bench_request_seconds', "Latency", ['method', 'route'])
+
+    start = time.perf_counter()
+    for n in range(N):
+        requests.inc('GET', '/api/buses', '200')
+    print(f"Counter.inc: {(time.perf_counter() - start) / N * 1e9:.0f} ns")
+
+    start = time.perf_counter()
+    for n in range(N):
+        latency.observe(0.0123, 'GET', '/api/buses')
+    print(f"Histogram.observe: {(time.perf_counter() - start) / N * 1e9:.0f} ns")
+
+    start = time.perf_counter()
+    for n in range(N):
+        with latency.time('GET', '/api/buses'):
+            pass
+    print(f"Histogram.time(): {(time.perf_counter() - start) / N * 1e9:.0f} ns")
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"render: {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1e3:.2f} ms")
@@ -0,0 +1,210 @@
+"""
+Slow Query Log
+Groups executed SPARQL queries by fingerprint (the query with its literals
+replaced by ?) and aggregates their latency and result size, so the most
+expensive query shapes stand out even when every call uses different values
+
+Queries slower than the threshold are kept as samples and appended as JSON
+lines to a rotating log file.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# IRIs are kept (they are the query's structure), literals and numbers become ?
+_TOKENS = re.compile(
+    r'(?P<iri><[^<>"{}|^`\\\s]*>)'
+    r'|(?P<string>(?:"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+    r'(?:@[A-Za-z]+(?:-[A-Za-z0-9]+)*|\^\^(?:<[^>\s]*>|[\w.-]*:[\w.-]*))?)'
+    r'|(?P<comment>#[^\n]*)'
+    r'|(?P<number>(?<![\w.?$:-])[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)'
+    r'|(?P<space>\s+)'
+)
+_PUNCTUATION_SPACE = re.compile(r'\s*([{}()\[\].;,])\s*')
+
+
+def normalize(query):
+    """The query with literals replaced by ?, comments removed and whitespace collapsed"""
+    def replace(match):
+        kind = match.lastgroup
+        if kind == 'iri':
+            return match.group()
+        if kind in ('string', 'number'):
+            return '?'
+        return ' '
+
+    # Literals are gone and IRIs hold no spaces: the remaining whitespace is layout only
+    text = _TOKENS.sub(replace, query)
+    return _PUNCTUATION_SPACE.sub(r'\1', ' '.join(text.split()))
+
+
+def fingerprint(query):
+    """
+    Stable ID of a query's shape
+
+    Returns:
+        tuple: (fingerprint, normalized query)
+    """
+    normalized = normalize(query)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)] if ordered else None
+
+
+class _Fingerprint:
+    def __init__(self, normalized, window, samples):
+        self.normalized = normalized
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.latencies = deque(maxlen=window)
+        self.rows = 0
+        self.sized = 0
+        self.max_rows = 0
+        self.slow = 0
+        self.sources = {}
+        self.samples = deque(maxlen=samples)
+        self.last_seen = None
+
+
+class QueryLog:
+    """
+    Latency and result size per query fingerprint, with slow samples
+
+    p95 is computed over the last `window` executions of each fingerprint.
+    At most `max_fingerprints` are tracked; past that, the one with the least
+    total time is forgotten to make room.
+    """
+
+    def __init__(self, path=None, threshold_ms=200, max_bytes=5 * 1024 * 1024, backups=5,
+                 samples=5, window=1000, max_fingerprints=1000):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.samples = samples
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._logger = None
+        if path:
+            # Own logger writing bare JSON lines, rotated at max_bytes
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger = logging.getLogger(f'smartcity.slow_queries.{id(self)}')
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+
+    def record(self, query, seconds, rows=None, source=None):
+        """
+        Account one execution of a query
+
+        Args:
+            query: SPARQL text as executed
+            seconds: Wall time of the execution, rows included
+            rows: Result size (rows, or triples for CONSTRUCT), None if unknown
+            source: What ran it, e.g. the endpoint path
+
+        Returns:
+            str: The query's fingerprint
+        """
+        key, normalized = fingerprint(query)
+        slow = seconds >= self.threshold
+        with self._lock:
+            entry = self._fingerprints.get(key)
+            if entry is None:
+                if len(self._fingerprints) >= self.max_fingerprints:
+                    cheapest = min(self._fingerprints, key=lambda k: self._fingerprints[k].seconds)
+                    del self._fingerprints[cheapest]
+                entry = self._fingerprints[key] = _Fingerprint(normalized, self.window, self.samples)
+            entry.count += 1
+            entry.seconds += seconds
+            entry.max_seconds = max(entry.max_seconds, seconds)
+            entry.latencies.append(seconds)
+            if rows is not None:
+                entry.rows += rows
+                entry.sized += 1
+                entry.max_rows = max(entry.max_rows, rows)
+            if source:
+                entry.sources[source] = entry.sources.get(source, 0) + 1
+            entry.last_seen = time.time()
+            if slow:
+                entry.slow += 1
+                sample = {
+                    'at': entry.last_seen,
+                    'ms': round(seconds * 1000, 3),
+                    'rows': rows,
+                    'source': source,
+                    'query': query
+                }
+                entry.samples.append(sample)
+
+        if slow and self._logger is not None:
+            self._logger.info(json.dumps({'fingerprint': key, **sample}, ensure_ascii=False))
+        return key
+
+    def _summary(self, key, entry):
+        return {
+            'fingerprint': key,
+            'query': entry.normalized,
+            'count': entry.count,
+            'slow': entry.slow,
+            'totalMs': round(entry.seconds * 1000, 3),
+            'meanMs': round(entry.seconds * 1000 / entry.count, 3),
+            'p95Ms': round(_percentile(entry.latencies, 95) * 1000, 3),
+            'maxMs': round(entry.max_seconds * 1000, 3),
+            'meanRows': round(entry.rows / entry.sized, 1) if entry.sized else None,
+            'maxRows': entry.max_rows,
+            'sources': dict(entry.sources),
+            'lastSeen': entry.last_seen,
+            'samples': list(entry.samples)
+        }
+
+    def top(self, limit=20, sort='total'):
+        """
+        Fingerprints costing the most
+
+        Args:
+            sort: 'total' (time), 'p95', 'max', 'mean', 'count' or 'slow'
+        """
+        keys = {'total': 'totalMs', 'p95': 'p95Ms', 'max': 'maxMs', 'mean': 'meanMs', 'count': 'count', 'slow': 'slow'}
+        if sort not in keys:
+            raise ValueError(f"sort must be one of: {', '.join(keys)}")
+        with self._lock:
+            summaries = [self._summary(key, entry) for key, entry in self._fingerprints.items()]
+        summaries.sort(key=lambda summary: summary[keys[sort]], reverse=True)
+        return summaries[:limit]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._fingerprints.get(key)
+            return self._summary(key, entry) if entry is not None else None
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+            self.started_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fingerprints': len(self._fingerprints),
+                'executions': sum(entry.count for entry in self._fingerprints.values()),
+                'slowExecutions': sum(entry.slow for entry in self._fingerprints.values()),
+                'thresholdMs': round(self.threshold * 1000, 3),
+                'logFile': os.path.abspath(self.path) if self.path else None,
+                'since': self.started_at
+            }
@@ -0,0 +1,381 @@
+"""
+Natural Language Query Templates
+Answers the most common question shapes locally with parameterized SPARQL,
+so the Gemini translation is only needed for questions no template matches
+"""
+
+import re
+import threading
+import time
+import unicodedata
+
+PREFIXES = """PREFIX smartcity: <http://example.org/smartcity#>
+PREFIX ont: <http://www.co-ode.org/ontologies/ont.owl#>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+"""
+
+# Vocabulary for the ontology classes (accent-free, lower case).
+# Longer aliases are tried first so "station de bus" wins over "bus".
+CLASS_ALIASES = {
+    'transports': 'smartcity:Transport', 'transport': 'smartcity:Transport',
+    'vehicules': 'smartcity:Transport', 'vehicule': 'smartcity:Transport',
+    'vehicles': 'smartcity:Transport', 'vehicle': 'smartcity:Transport',
+    'bus': 'ont:Bus',
+    'metros': 'ont:Métro', 'metro': 'ont:Métro',
+    'velos': 'ont:Vélo', 'velo': 'ont:Vélo', 'bikes': 'ont:Vélo', 'bike': 'ont:Vélo',
+    'trottinettes': 'ont:Trottinette', 'trottinette': 'ont:Trottinette',
+    'scooters': 'ont:Trottinette', 'scooter': 'ont:Trottinette',
+    'voitures partagees': 'ont:VoiturePartagée', 'voiture partagee': 'ont:VoiturePartagée',
+    'shared cars': 'ont:VoiturePartagée',
+    'utilisateurs': 'smartcity:Utilisateur', 'utilisateur': 'smartcity:Utilisateur',
+    'users': 'smartcity:Utilisateur', 'user': 'smartcity:Utilisateur',
+    'citoyens': 'ont:Citoyen', 'citoyen': 'ont:Citoyen',
+    'citizens': 'ont:Citoyen', 'citizen': 'ont:Citoyen',
+    'touristes': 'ont:Touriste', 'touriste': 'ont:Touriste',
+    'tourists': 'ont:Touriste', 'tourist': 'ont:Touriste',
+    'stations de bus': 'ont:StationBus', 'station de bus': 'ont:StationBus',
+    'bus stations': 'ont:StationBus', 'bus stops': 'ont:StationBus',
+    'stations de metro': 'ont:StationMétro', 'station de metro': 'ont:StationMétro',
+    'metro stations': 'ont:StationMétro',
+    'stations': 'smartcity:Station', 'station': 'smartcity:Station',
+    'parkings': 'ont:Parking', 'parking': 'ont:Parking',
+    'trajets': 'smartcity:Trajet', 'trajet': 'smartcity:Trajet',
+    'trips': 'smartcity:Trajet', 'trip': 'smartcity:Trajet',
+    'zones urbaines': 'smartcity:ZoneUrbaine', 'zones': 'smartcity:ZoneUrbaine',
+    'zone': 'smartcity:ZoneUrbaine',
+    'evenements': 'smartcity:EvenementDeCirculation', 'evenement': 'smartcity:EvenementDeCirculation',
+    'events': 'smartcity:EvenementDeCirculation', 'event': 'smartcity:EvenementDeCirculation',
+    'accidents': 'ont:Accident', 'accident': 'ont:Accident',
+    'embouteillages': 'ont:Embouteillage', 'embouteillage': 'ont:Embouteillage',
+    'traffic jams': 'ont:Embouteillage',
+    'capteurs': 'smartcity:Capteur', 'capteur': 'smartcity:Capteur',
+    'sensors': 'smartcity:Capteur', 'sensor': 'smartcity:Capteur',
+    'tickets': 'smartcity:Ticket', 'ticket': 'smartcity:Ticket',
+    'energies': 'smartcity:Energie', 'energie': 'smartcity:Energie',
+}
+
+# Classes whose members are linked to a ZoneUrbaine, and through which property
+ZONE_PROPERTIES = {
+    'smartcity:Transport': 'smartcity:circuleDans',
+    'ont:Bus': 'smartcity:circuleDans',
+    'ont:Métro': 'smartcity:circuleDans',
+    'ont:Vélo': 'smartcity:circuleDans',
+    'ont:Trottinette': 'smartcity:circuleDans',
+    'ont:VoiturePartagée': 'smartcity:circuleDans',
+    'smartcity:EvenementDeCirculation': 'smartcity:organiseDans',
+    'ont:Accident': 'smartcity:organiseDans',
+    'ont:Embouteillage': 'smartcity:organiseDans',
+}
+
+COMPARATORS = {
+    '>': '>', '>=': '>=', '<': '<', '<=': '<=', '=': '=',
+    'superieure a': '>', 'superieur a': '>', 'plus de': '>', 'greater than': '>',
+    'more than': '>', 'above': '>', 'older than': '>',
+    'inferieure a': '<', 'inferieur a': '<', 'moins de': '<', 'less than': '<',
+    'below': '<', 'younger than': '<',
+    'egale a': '=', 'egal a': '=', 'equal to': '=',
+}
+
+_ALIAS_PATTERN = '|'.join(sorted((re.escape(a) for a in CLASS_ALIASES), key=len, reverse=True))
+_CMP_PATTERN = '|'.join(sorted((re.escape(c) for c in COMPARATORS), key=len, reverse=True))
+_LIST_VERBS = r'(?:list(?:e[rz]?)?|show(?: me)?|affiche[rz]?|donne[rz]?(?: moi)?|get|find|trouve[rz]?|quels sont|quelles sont|what are|which are)?'
+_ARTICLE = r'(?:(?:all|tous|toutes)\s+)?(?:(?:the|les|des|de|la|le|l\')\s*)?'
+
+
+def _normalize(text):
+    """Lower-case, strip accents and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[?!.;,]+', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _escape_literal(value):
+    """Escape a value for use inside a double-quoted SPARQL literal"""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _label(class_curie):
+    return class_curie.split(':', 1)[1]
+
+
+def _members(class_curie):
+    """Graph pattern binding ?entity, ?nom and ?type for every member of a class"""
+    return f"""?entity rdf:type ?typeUri .
+    ?typeUri rdfs:subClassOf* {class_curie} .
+    OPTIONAL {{ ?entity ont:Nom ?n1 }}
+    OPTIONAL {{ ?entity ont:aNomStation ?n2 }}
+    BIND(COALESCE(?n1, ?n2) AS ?nom)
+    BIND(STRAFTER(STR(?typeUri), "#") AS ?type)"""
+
+
+# ---------- Template builders: each returns (sparql, explanation) ----------
+
+def _count_by_type(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    return (f"""{PREFIXES}
+SELECT ?type (COUNT(DISTINCT ?entity) AS ?count)
+WHERE {{
+    ?entity rdf:type ?typeUri .
+    ?typeUri rdfs:subClassOf* {cls} .
+    BIND(STRAFTER(STR(?typeUri), "#") AS ?type)
+}}
+GROUP BY ?type
+ORDER BY DESC(?count)""",
+            f"Nombre de {_label(cls)} regroupés par type.")
+
+
+def _count_by_zone(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    prop = ZONE_PROPERTIES.get(cls)
+    if not prop:
+        return None
+    return (f"""{PREFIXES}
+SELECT ?zone (COUNT(DISTINCT ?entity) AS ?count)
+WHERE {{
+    ?entity rdf:type/rdfs:subClassOf* {cls} .
+    ?entity {prop} ?zoneUri .
+    OPTIONAL {{ ?zoneUri ont:Nom ?zoneNom }}
+    BIND(COALESCE(?zoneNom, STRAFTER(STR(?zoneUri), "#")) AS ?zone)
+}}
+GROUP BY ?zone
+ORDER BY DESC(?count)""",
+            f"Nombre de {_label(cls)} par zone urbaine.")
+
+
+def _count(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    return (f"""{PREFIXES}
+SELECT (COUNT(DISTINCT ?entity) AS ?count)
+WHERE {{
+    ?entity rdf:type/rdfs:subClassOf* {cls} .
+}}""",
+            f"Nombre total de {_label(cls)} dans la base.")
+
+
+def _list_in_zone(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    prop = ZONE_PROPERTIES.get(cls)
+    if not prop:
+        return None
+    zone = m.group('zone').strip()
+    zone_literal = _escape_literal(zone)
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type ?zone
+WHERE {{
+    {_members(cls)}
+    ?entity {prop} ?zoneUri .
+    OPTIONAL {{ ?zoneUri ont:Nom ?zoneNom }}
+    BIND(COALESCE(?zoneNom, STRAFTER(STR(?zoneUri), "#")) AS ?zone)
+    FILTER(CONTAINS(LCASE(STR(?zone)), LCASE("{zone_literal}"))
+           || LCASE(STRAFTER(STR(?zoneUri), "#")) = LCASE("{zone_literal}"))
+}}""",
+            f"{_label(cls)} situés dans la zone « {zone} ».")
+
+
+def _events_by_gravity(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    if ZONE_PROPERTIES.get(cls) != 'smartcity:organiseDans':
+        return None
+    op = COMPARATORS[m.group('cmp')]
+    value = int(m.group('value'))
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type ?gravite
+WHERE {{
+    {_members(cls)}
+    ?entity ont:aGravite ?gravite .
+    FILTER(?gravite {op} {value})
+}}
+ORDER BY DESC(?gravite)""",
+            f"{_label(cls)} dont la gravité est {op} {value}.")
+
+
+def _users_by_age(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    if cls not in ('smartcity:Utilisateur', 'ont:Citoyen', 'ont:Touriste'):
+        return None
+    op = COMPARATORS[m.group('cmp')]
+    value = int(m.group('value'))
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type ?age
+WHERE {{
+    {_members(cls)}
+    ?entity ont:Age ?age .
+    FILTER(?age {op} {value})
+}}
+ORDER BY ?age""",
+            f"{_label(cls)} dont l'âge est {op} {value}.")
+
+
+def _transports_by_capacity(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    if ZONE_PROPERTIES.get(cls) != 'smartcity:circuleDans':
+        return None
+    op = COMPARATORS[m.group('cmp')]
+    value = int(m.group('value'))
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type ?capacite
+WHERE {{
+    {_members(cls)}
+    ?entity ont:Capacite ?capacite .
+    FILTER(?capacite {op} {value})
+}}
+ORDER BY DESC(?capacite)""",
+            f"{_label(cls)} dont la capacité est {op} {value}.")
+
+
+def _electric_transports(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    if ZONE_PROPERTIES.get(cls) != 'smartcity:circuleDans':
+        return None
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type
+WHERE {{
+    {_members(cls)}
+    ?entity ont:estElectrique true .
+}}""",
+            f"{_label(cls)} électriques.")
+
+
+def _list(m):
+    cls = CLASS_ALIASES[m.group('cls')]
+    return (f"""{PREFIXES}
+SELECT DISTINCT ?entity ?nom ?type
+WHERE {{
+    {_members(cls)}
+}}""",
+            f"Liste des {_label(cls)} enregistrés dans la base.")
+
+
+_CLS = rf'(?P<cls>{_ALIAS_PATTERN})'
+_CMP = rf'(?P<cmp>{_CMP_PATTERN})\s*(?P<value>\d+)'
+
+# Ordered from most to least specific; every pattern must match the whole question
+TEMPLATES = [
+    ('count_by_type', re.compile(
+        rf'^(?:count|compte[rz]?|combien(?: de| d\')?|nombre (?:de|d\')|how many|number of)\s*{_ARTICLE}{_CLS}'
+        rf'(?: (?:are there|y a-t-il|il y a))? (?:by|per|par) (?:type|categorie|category)$'), _count_by_type),
+    ('count_by_zone', re.compile(
+        rf'^(?:count|compte[rz]?|combien(?: de| d\')?|nombre (?:de|d\')|how many|number of)\s*{_ARTICLE}{_CLS}'
+        rf'(?: (?:are there|y a-t-il|il y a))? (?:by|per|par|in each) zone$'), _count_by_zone),
+    ('count', re.compile(
+        rf'^(?:count|compte[rz]?|combien(?: de| d\')?|nombre (?:de|d\')|how many|number of|total (?:de |d\'|of )?)\s*{_ARTICLE}{_CLS}'
+        rf'(?: (?:are there|y a-t-il|il y a|exist|existent))?$'), _count),
+    ('list_in_zone', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}{_CLS} (?:in|dans|en)(?: the| la| le)? zone (?P<zone>[\w\' -]+)$'), _list_in_zone),
+    ('events_by_gravity', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}{_CLS} (?:with|avec|ayant|having|dont la|where)?\s*(?:une )?'
+        rf'(?:gravite|severity|gravity)(?: est)?\s*{_CMP}$'), _events_by_gravity),
+    ('users_by_age', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}{_CLS} (?:with|avec|ayant|having|dont l\'|where|aged?|de)?\s*'
+        rf'(?:age|l\'age)?(?: est)?\s*{_CMP}(?: ans| years(?: old)?)?$'), _users_by_age),
+    ('transports_by_capacity', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}{_CLS} (?:with|avec|ayant|having|dont la|where)?\s*(?:une )?'
+        rf'(?:capacite|capacity)(?: est)?\s*{_CMP}(?: places| seats)?$'), _transports_by_capacity),
+    ('electric_transports', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}(?:electric {_CLS}|(?P<cls2>{_ALIAS_PATTERN}) electriques?)$'), _electric_transports),
+    ('list', re.compile(
+        rf'^{_LIST_VERBS}\s*{_ARTICLE}{_CLS}$'), _list),
+]
+
+
+class _TemplateStats:
+    """Thread-safe hit/miss counters for the template matcher"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.by_template = {}
+        self.match_seconds = 0.0
+
+    def record(self, template_name, elapsed):
+        with self._lock:
+            self.match_seconds += elapsed
+            if template_name:
+                self.hits += 1
+                self.by_template[template_name] = self.by_template.get(template_name, 0) + 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'total': total,
+                'hitRate': round(self.hits / total, 4) if total else 0.0,
+                'avgMatchMicros': round(self.match_seconds / total * 1e6, 2) if total else 0.0,
+                'byTemplate': dict(self.by_template)
+            }
+
+
+_stats = _TemplateStats()
+
+
+def match_natural_query(question):
+    """
+    Match a natural language question against the local templates
+
+    Args:
+        question: The user's question (French or English)
+
+    Returns:
+        dict: Contains 'template', 'query' and 'explanation' on a match, or None
+    """
+    start = time.perf_counter()
+    normalized = _normalize(question)
+    for name, pattern, builder in TEMPLATES:
+        m = pattern.match(normalized)
+        if not m:
+            continue
+        if 'cls2' in pattern.groupindex and not m.group('cls'):
+            m = _Cls2Match(m)
+        built = builder(m)
+        if built:
+            _stats.record(name, time.perf_counter() - start)
+            sparql, explanation = built
+            return {'template': name, 'query': sparql, 'explanation': explanation}
+    _stats.record(None, time.perf_counter() - start)
+    return None
+
+
+def match_keywords(question):
+    """
+    Loose fallback used when the LLM is unavailable: list the members of the
+    first class mentioned anywhere in the question
+
+    Returns:
+        dict: Same shape as match_natural_query, or None when no class is mentioned
+    """
+    m = re.search(rf'\b{_CLS}\b', _normalize(question))
+    if not m:
+        return None
+    sparql, explanation = _list(m)
+    return {'template': 'keyword_fallback', 'query': sparql, 'explanation': explanation}
+
+
+# Questions the templates answer locally, offered when AI suggestions are unavailable
+EXAMPLE_QUESTIONS = [
+    "Combien de transports par type ?",
+    "Lister les événements avec une gravité > 3",
+    "Quels sont les transports électriques ?",
+    "Combien de bus par zone ?",
+]
+
+
+class _Cls2Match:
+    """Exposes the alternate 'cls2' group of a match under the name 'cls'"""
+
+    def __init__(self, match):
+        self._match = match
+
+    def group(self, name):
+        return self._match.group('cls2' if name == 'cls' else name)
+
+
+def get_template_stats():
+    """Return hit-rate metrics showing how often the LLM translation is avoided"""
+    return _stats.snapshot()
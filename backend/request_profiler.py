@@ -0,0 +1,313 @@
+"""
+Request Profiler
+Runs single requests under a profiler on demand, in production, and keeps
+the results for the /api/admin/profiles endpoints
+
+A request is profiled when it carries `X-Profile: cprofile` (or `stacks`) with
+the `X-Profile-Token` configured in PROFILE_TOKEN, or when it is picked by
+the PROFILE_SAMPLE_RATE sampling. Two profilers are available:
+
+- cprofile: every Python call of the request thread (calls, own and
+  cumulative time per function), downloadable as a .prof file for pstats,
+  snakeviz...
+- stacks: the request thread's stack sampled every few milliseconds, as
+  folded stacks (`a;b;c 12` lines) for flamegraph.pl or speedscope; much
+  lighter, so it is the one used for sampled requests
+
+One request is profiled at a time; others arriving meanwhile run normally.
+"""
+
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+MODES = ('cprofile', 'stacks')
+SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stack of one thread until stopped"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            # A sample taken while stop() was being called shows the profiler itself
+            if stack and not self._stopped.is_set():
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class _Session:
+    """Profiler running for one request"""
+
+    def __init__(self, mode, trigger, interval):
+        self.mode = mode
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self.seconds = None
+        if mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = _StackSampler(threading.get_ident(), interval)
+            self._profiler.start()
+
+    def stop(self):
+        if self.seconds is None:
+            if self.mode == 'cprofile':
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+            self.seconds = time.perf_counter() - self.started
+
+    def result(self):
+        if self.mode == 'cprofile':
+            return pstats.Stats(self._profiler)
+        return self._profiler.stacks
+
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled and keeps their last `keep` profiles
+
+    Args:
+        token: Secret of the X-Profile-Token header (None: only sampling profiles requests)
+        sample_rate: Share of requests profiled with the stack sampler (0 to 1)
+        keep: Number of profiles kept, oldest dropped first
+        interval: Seconds between two stack samples
+    """
+
+    def __init__(self, token=None, sample_rate=0.0, keep=50, interval=0.005):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.interval = interval
+        self._profiles = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Held while a request is profiled (cProfile can only run once per process on Python 3.12+)
+        self._running = threading.Lock()
+        self.skipped = 0
+
+    def authorized(self, token):
+        """Whether a request presented the configured token"""
+        return bool(self.token) and token is not None and hmac.compare_digest(token, self.token)
+
+    def begin(self, mode=None, token=None):
+        """
+        Start profiling the current thread if the request asks for it or is sampled
+
+        Args:
+            mode: Value of the X-Profile header, if any
+            token: Value of the X-Profile-Token header, if any
+
+        Returns:
+            _Session or None
+        """
+        if mode and self.authorized(token):
+            if mode not in MODES:
+                mode = 'cprofile'
+            trigger = 'header'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            mode, trigger = 'stacks', 'sample'
+        else:
+            return None
+        if not self._running.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return None
+        try:
+            return _Session(mode, trigger, self.interval)
+        except BaseException:
+            self._running.release()
+            raise
+
+    def finish(self, session, **request_info):
+        """
+        Stop a session and keep its profile
+
+        Args:
+            request_info: method, path, status... stored with the profile
+
+        Returns:
+            str: The profile ID
+        """
+        try:
+            session.stop()
+        finally:
+            self._running.release()
+        result = session.result()
+        with self._lock:
+            profile_id = str(next(self._ids))
+            self._profiles[profile_id] = {
+                'info': {
+                    'id': profile_id,
+                    'at': time.time(),
+                    'mode': session.mode,
+                    'trigger': session.trigger,
+                    'ms': round(session.seconds * 1000, 3),
+                    **request_info
+                },
+                'result': result
+            }
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def abort(self, session):
+        """Stop a session without keeping it (the request failed before finish())"""
+        if session.seconds is None:
+            try:
+                session.stop()
+            finally:
+                self._running.release()
+
+    def list(self):
+        with self._lock:
+            return [profile['info'] for profile in reversed(self._profiles.values())]
+
+    def _get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def report(self, profile_id, sort='cumulative', limit=30):
+        """
+        Summary of a profile: the most expensive functions (cprofile) or stacks (stacks)
+
+        Returns:
+            dict or None: None for an unknown profile
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+        profile = self._get(profile_id)
+        if profile is None:
+            return None
+        if profile['info']['mode'] == 'cprofile':
+            stats = profile['result'].stats
+            rows = sorted(stats.items(), key=lambda item: item[1][SORT_KEYS[sort]], reverse=True)[:limit]
+            return {
+                **profile['info'],
+                'totalCalls': profile['result'].total_calls,
+                'functions': [
+                    {
+                        'function': function,
+                        'file': filename,
+                        'line': line,
+                        'calls': calls,
+                        'primitiveCalls': primitive,
+                        'ownMs': round(own * 1000, 3),
+                        'cumulativeMs': round(cumulative * 1000, 3)
+                    }
+                    for (filename, line, function), (primitive, calls, own, cumulative, _) in rows
+                ]
+            }
+
+        stacks = profile['result']
+        # Samples where a function was running (leaf frame) vs on the stack at all
+        own, cumulative = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                cumulative[frame] += count
+        ranking = own if sort == 'tottime' else cumulative
+        return {
+            **profile['info'],
+            'samples': sum(stacks.values()),
+            'intervalMs': self.interval * 1000,
+            'functions': [
+                {'function': frame, 'ownSamples': own[frame], 'cumulativeSamples': cumulative[frame]}
+                for frame, _ in ranking.most_common(limit)
+            ]
+        }
+
+    def pstats_dump(self, profile_id):
+        """A cprofile profile in the .prof format read by pstats.Stats(), or None"""
+        profile = self._get(profile_id)
+        if profile is None or profile['info']['mode'] != 'cprofile':
+            return None
+        return marshal.dumps(profile['result'].stats)
+
+    def folded(self, profile_id):
+        """
+        A profile as folded stacks (one `frame;frame;frame count` line per stack), or None
+
+        cprofile profiles have no full stacks: each caller -> callee edge is
+        given with its cumulative time in microseconds instead.
+        """
+        profile = self._get(profile_id)
+        if profile is None:
+            return None
+        if profile['info']['mode'] == 'stacks':
+            return ''.join(f"{stack} {count}\n" for stack, count in sorted(profile['result'].items()))
+
+        out = io.StringIO()
+        for (filename, line, function), (_, _, _, _, callers) in profile['result'].stats.items():
+            callee = f"{function} ({os.path.basename(filename)}:{line})"
+            for (caller_file, caller_line, caller), timing in callers.items():
+                micros = round(timing[3] * 1e6)
+                if micros:
+                    out.write(f"{caller} ({os.path.basename(caller_file)}:{caller_line});{callee} {micros}\n")
+        return out.getvalue()
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._profiles),
+                'keep': self.keep,
+                'sampleRate': self.sample_rate,
+                'headerEnabled': bool(self.token),
+                'skippedBusy': self.skipped
+            }
+
+
+if __name__ == '__main__':
+    # Overhead of both profilers on a CPU-bound function
+    def work():
+        return sorted(str(n * 7919 % 10007) for n in range(200_000))
+
+    profiler = RequestProfiler(token='demo', keep=5, interval=0.005)
+    work()
+    start = time.perf_counter()
+    work()
+    baseline = time.perf_counter() - start
+    print(f"unprofiled: {baseline * 1000:.1f} ms")
+    for mode in MODES:
+        session = profiler.begin(mode, 'demo')
+        work()
+        profile_id = profiler.finish(session, path='work')
+        report = profiler.report(profile_id, limit=3)
+        print(f"{mode}: {report['ms']:.1f} ms ({(report['ms'] / 1000 / baseline - 1) * 100:+.0f}%), "
+              f"top: {report['functions'][0]['function']}")
+    print(profiler.folded(profile_id).splitlines()[:3])
@@ -0,0 +1,175 @@
+"""
+LLM Call Resilience
+Circuit breaker and adaptive token bucket used to fail fast and stay within
+quota when the LLM provider is slow, failing or throttling
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class BackendUnavailable(RuntimeError):
+    """Raised instead of calling the LLM when a call is shed"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker for one model endpoint
+
+    The circuit opens when at least min_calls calls finished within the last
+    window seconds and the share of failures reaches failure_threshold. While
+    open, calls are rejected at once. After open_seconds a single probe call is
+    let through (half-open): its success closes the circuit, its failure opens
+    it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=0.5, min_calls=5, window=60, open_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """Whether a call may go through now; rejected calls are counted"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """Give back an allowed call that was not made, e.g. shed by the rate limiter"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok):
+        """Record the outcome of a call that was allowed through"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, success in self._outcomes if not success)
+            if (self.state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_threshold):
+                self._open(now)
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def snapshot(self):
+        with self._lock:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                'state': self.state,
+                'windowCalls': len(self._outcomes),
+                'windowFailures': failures,
+                'rejected': self.rejected,
+                'timesOpened': self.times_opened,
+                'retryInSeconds': round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+                if self.state == self.OPEN else 0.0
+            }
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to the provider's throttling
+
+    Every throttled call (HTTP 429) halves the rate, down to min_rate; every
+    successful call raises it back by a small step up to the configured quota
+    (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, rate_per_minute=60, burst=10, min_rate_per_minute=2, increase_per_minute=1):
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = min(min_rate_per_minute / 60.0, self.max_rate)
+        self.increase = increase_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait=0.0):
+        """
+        Take one token, waiting up to max_wait seconds for it
+
+        Returns:
+            bool: False when no token became available in time
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if now + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def snapshot(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'ratePerMinute': round(self.rate * 60, 2),
+                'maxRatePerMinute': round(self.max_rate * 60, 2),
+                'tokens': round(self._tokens, 2),
+                'throttled': self.throttled
+            }
+
+
+def is_throttling_error(error):
+    """Whether an exception reports a quota/rate limit error from the provider"""
+    message = str(error)
+    return '429' in message or 'RESOURCE_EXHAUSTED' in message or 'quota' in message.lower()
@@ -0,0 +1,242 @@
+"""
+Sharded RDF Storage
+Keeps the data in a directory of RDF files (e.g. one per entity class)
+instead of the single Projet.rdf: the files are parsed in parallel worker
+processes at startup, and a save only rewrites the files whose subjects changed
+
+The app still queries one in-memory graph holding every triple; each subject
+is owned by one shard (file), which is its named graph in N-Quads exports.
+
+Split an existing file into per-class shards:
+    python sharding.py split ../Projet.rdf ../data
+"""
+
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rdflib import BNode, Graph, OWL, RDF, RDFS, URIRef
+
+# File extension -> rdflib format
+SHARD_FORMATS = {'.rdf': 'xml', '.owl': 'xml', '.xml': 'xml', '.ttl': 'turtle', '.nt': 'nt'}
+
+# Shard of subjects without an entity class (ontology classes, properties, restrictions...)
+SCHEMA_SHARD = 'ontology'
+
+_SCHEMA_NAMESPACES = (str(RDF), str(RDFS), str(OWL))
+
+# Mode of new shard files, as open() would create them (mkstemp uses 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def shard_name(graph, subject):
+    """Name of the shard a subject belongs to by default: the local name of its entity class"""
+    for rdf_type in sorted(graph.objects(subject, RDF.type)):
+        if isinstance(rdf_type, URIRef) and not str(rdf_type).startswith(_SCHEMA_NAMESPACES):
+            return str(rdf_type).rsplit('#', 1)[-1].rsplit('/', 1)[-1]
+    return SCHEMA_SHARD
+
+
+def _parse_shard(path):
+    # Runs in a worker process: terms pickle back to the parent
+    graph = Graph()
+    graph.parse(path, format=SHARD_FORMATS[os.path.splitext(path)[1].lower()])
+    return list(graph), list(graph.namespaces())
+
+
+class ShardedStore:
+    """
+    Maps the subjects of a graph to the RDF files of a directory
+
+    A subject found in several files is owned by the first one (in file name
+    order); the others are rewritten without it on the next save. New
+    subjects go to the shard of their entity class (Bus.rdf, Station.rdf...),
+    created in the default format when missing.
+    """
+
+    def __init__(self, directory, workers=None, default_extension='.rdf', graph_base='urn:smartcity:shard:'):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.default_extension = default_extension
+        self.graph_base = graph_base
+        self.owner = {}
+        self.subjects = {}
+        self.files = {}
+        self._dirty_shards = set()
+        self.load_seconds = None
+        self.saves = 0
+        self.files_written = 0
+
+    def _paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if os.path.splitext(name)[1].lower() in SHARD_FORMATS
+        )
+
+    def load_into(self, graph):
+        """
+        Parse every shard (in parallel when there are several) into graph
+
+        Returns:
+            int: Number of shards loaded
+        """
+        start = time.perf_counter()
+        paths = self._paths()
+        if len(paths) > 1 and self.workers > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+                parsed = list(pool.map(_parse_shard, paths))
+        else:
+            parsed = [_parse_shard(path) for path in paths]
+
+        for path, (triples, namespaces) in zip(paths, parsed):
+            name = os.path.splitext(os.path.basename(path))[0]
+            self.files[name] = path
+            self.subjects.setdefault(name, set())
+            for prefix, namespace in namespaces:
+                graph.bind(prefix, namespace, override=False)
+            for s, _, _ in triples:
+                owner = self.owner.setdefault(s, name)
+                if owner == name:
+                    self.subjects[name].add(s)
+                else:
+                    # Split subject: the non-owning file is rewritten without it
+                    self._dirty_shards.add(name)
+            graph.addN((s, p, o, graph) for s, p, o in triples)
+
+        self.load_seconds = time.perf_counter() - start
+        return len(paths)
+
+    def graph_name(self, subject):
+        """Named graph of a subject in N-Quads exports"""
+        return URIRef(f"{self.graph_base}{self.owner.get(subject, SCHEMA_SHARD)}")
+
+    def save(self, graph, changed_subjects):
+        """
+        Rewrite the shards owning changed subjects
+
+        Args:
+            graph: The graph holding every triple
+            changed_subjects: Subjects added, modified or removed since the last save
+
+        Returns:
+            list: Names of the shards written
+        """
+        for subject in changed_subjects:
+            present = (subject, None, None) in graph
+            name = self.owner.get(subject)
+            if name is None:
+                if not present:
+                    continue
+                name = self._route(graph, subject)
+                self.owner[subject] = name
+                self.subjects.setdefault(name, set()).add(subject)
+            elif not present:
+                del self.owner[subject]
+                self.subjects[name].discard(subject)
+            self._dirty_shards.add(name)
+
+        written = sorted(self._dirty_shards)
+        for name in written:
+            self._write(graph, name)
+        self._dirty_shards.clear()
+        self.saves += 1
+        self.files_written += len(written)
+        return written
+
+    def _route(self, graph, subject, depth=0):
+        # Blank nodes only have an identity within one file: keep them with the subject using them
+        if isinstance(subject, BNode) and depth < 10:
+            for referrer in graph.subjects(None, subject):
+                return self.owner.get(referrer) or self._route(graph, referrer, depth + 1)
+        return shard_name(graph, subject)
+
+    def _write(self, graph, name):
+        path = self.files.get(name) or os.path.join(self.directory, name + self.default_extension)
+        shard = Graph()
+        for prefix, namespace in graph.namespaces():
+            shard.bind(prefix, namespace, override=False)
+        for subject in self.subjects.get(name, ()):
+            for triple in graph.triples((subject, None, None)):
+                shard.add(triple)
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix=f'.{name}_', suffix='.tmp')
+        os.close(handle)
+        try:
+            shard.serialize(destination=temporary, format=SHARD_FORMATS[os.path.splitext(path)[1].lower()])
+            # Keep the permissions of the file being replaced, other readers of the directory rely on them
+            mode = os.stat(path).st_mode & 0o7777 if os.path.exists(path) else NEW_FILE_MODE
+            os.chmod(temporary, mode)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.files[name] = path
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'loadSeconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'workers': self.workers,
+            'saves': self.saves,
+            'filesWritten': self.files_written,
+            'shards': [
+                {
+                    'name': name,
+                    'graph': f"{self.graph_base}{name}",
+                    'file': os.path.basename(self.files[name]) if name in self.files else None,
+                    'subjects': len(subjects),
+                    'bytes': os.path.getsize(self.files[name]) if os.path.exists(self.files.get(name, '')) else 0
+                }
+                for name, subjects in sorted(self.subjects.items())
+            ]
+        }
+
+
+def split(source, directory, extension='.rdf'):
+    """Write the subjects of an RDF file into one shard per entity class"""
+    graph = Graph()
+    graph.parse(source)
+    store = ShardedStore(directory, default_extension=extension)
+    written = store.save(graph, set(graph.subjects()))
+    return {name: len(store.subjects[name]) for name in written}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sharded RDF storage tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser('split', help="Split an RDF file into per-class shards")
+    split_parser.add_argument('source')
+    split_parser.add_argument('directory')
+    split_parser.add_argument('--extension', default='.rdf', choices=sorted(SHARD_FORMATS))
+    bench_parser = commands.add_parser('bench', help="Compare sequential and parallel loading of a directory")
+    bench_parser.add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        for name, count in sorted(split(args.source, args.directory, args.extension).items()):
+            print(f"  {name}{args.extension}: {count} subjects")
+    else:
+        for workers in (1, os.cpu_count() or 1):
+            graph = Graph()
+            store = ShardedStore(args.directory, workers=workers)
+            shards = store.load_into(graph)
+            print(f"{workers:>2} worker(s): {shards} shards, {len(graph)} triples in {store.load_seconds:.2f} s")
+
+        graph = Graph()
+        store = ShardedStore(args.directory)
+        store.load_into(graph)
+        subject = next(iter(store.subjects[max(store.subjects, key=lambda n: len(store.subjects[n]))]))
+        start = time.perf_counter()
+        store.save(graph, {subject})
+        print(f"Save after one change: {time.perf_counter() - start:.3f} s "
+              f"(whole graph as RDF/XML: ", end='')
+        start = time.perf_counter()
+        graph.serialize(format='xml')
+        print(f"{time.perf_counter() - start:.3f} s)")
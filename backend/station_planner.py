@@ -0,0 +1,266 @@
+"""
+Station Placement Planner
+Deterministic local recommendation of new station locations from a vectorized
+coverage/distance field over the area spanned by the existing stations
+"""
+
+import numpy as np
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON_EQUATOR = 111.320
+
+# Grid resolution of the coverage field (cells per side)
+DEFAULT_GRID_SIZE = 96
+
+# Distance chunking keeps the cells x stations matrix around 16 MB
+_CHUNK_CELLS = 1 << 22
+
+
+def _bounds(points, center, padding):
+    """Bounding box (lat_min, lat_max, lon_min, lon_max) around the points, padded"""
+    if len(points) >= 2:
+        lat_min, lon_min = points.min(axis=0)
+        lat_max, lon_max = points.max(axis=0)
+    else:
+        lat, lon = points[0] if len(points) else center
+        lat_min = lat_max = lat
+        lon_min = lon_max = lon
+    # Never collapse to a line or a point: keep at least ~1 km on each side
+    lat_pad = max((lat_max - lat_min) * padding, 0.01)
+    lon_pad = max((lon_max - lon_min) * padding, 0.01)
+    return lat_min - lat_pad, lat_max + lat_pad, lon_min - lon_pad, lon_max + lon_pad
+
+
+def _to_km(lat, lon, lat0):
+    """Project lat/lon degrees onto a local plane in km (equirectangular)"""
+    return lat * KM_PER_DEG_LAT, lon * KM_PER_DEG_LON_EQUATOR * np.cos(np.radians(lat0))
+
+
+def _nearest_distance(cells_y, cells_x, sites_y, sites_x):
+    """Distance in km from every grid cell to its nearest site, in chunks of sites"""
+    best = np.full(cells_y.shape, np.inf, dtype=np.float32)
+    step = max(1, _CHUNK_CELLS // max(1, cells_y.size))
+    for start in range(0, len(sites_y), step):
+        dy = cells_y[:, None] - sites_y[None, start:start + step]
+        dx = cells_x[:, None] - sites_x[None, start:start + step]
+        np.minimum(best, np.min(dy * dy + dx * dx, axis=1), out=best)
+    return np.sqrt(best)
+
+
+def _convex_hull(xs, ys):
+    """Convex hull of 2D points (Andrew's monotone chain), counter-clockwise"""
+    pts = sorted(set(zip(xs.tolist(), ys.tolist())))
+    if len(pts) < 3:
+        return pts
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def _inside_hull(hull, xs, ys, tolerance):
+    """Mask of the points lying inside (or within tolerance of) a convex polygon"""
+    if len(hull) < 3:
+        return np.ones(xs.shape, dtype=bool)
+    inside = np.ones(xs.shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(hull, hull[1:] + hull[:1]):
+        edge = np.hypot(x2 - x1, y2 - y1) or 1.0
+        # Signed distance to the edge line, positive on the inner side
+        inside &= ((x2 - x1) * (ys - y1) - (y2 - y1) * (xs - x1)) / edge >= -tolerance
+    return inside
+
+
+def _box_blur(field, radius):
+    """Separable box blur with edge clamping, used to spread point demand"""
+    if radius <= 0:
+        return field
+    size = 2 * radius + 1
+    for axis in (0, 1):
+        padded = np.pad(field, [(radius, radius) if a == axis else (0, 0) for a in (0, 1)], mode='edge')
+        csum = np.cumsum(padded, axis=axis, dtype=np.float64)
+        csum = np.insert(csum, 0, 0, axis=axis)
+        upper = np.take(csum, np.arange(size, csum.shape[axis]), axis=axis)
+        lower = np.take(csum, np.arange(0, csum.shape[axis] - size), axis=axis)
+        field = (upper - lower) / size
+    return field
+
+
+def coverage_field(stations, demand_points=None, grid_size=DEFAULT_GRID_SIZE, padding=0.1,
+                   center=(36.8065, 10.1815)):
+    """
+    Build the coverage field over the area spanned by the stations
+
+    Args:
+        stations: Array-like of (latitude, longitude) rows
+        demand_points: Optional array-like of (latitude, longitude, weight) rows,
+            e.g. traffic events, used to weight under-served areas
+        grid_size: Number of cells per side
+        padding: Fraction of the station extent added around it
+        center: Fallback (latitude, longitude) when there are fewer than two stations
+
+    Returns:
+        dict: Grid axes, distance field (km to nearest station), candidate mask
+            (cells inside the stations' convex hull) and normalized demand field
+    """
+    points = np.asarray(stations, dtype=np.float64).reshape(-1, 2)
+    lat_min, lat_max, lon_min, lon_max = _bounds(points, center, padding)
+    lat0 = (lat_min + lat_max) / 2
+
+    lats = np.linspace(lat_min, lat_max, grid_size)
+    lons = np.linspace(lon_min, lon_max, grid_size)
+    grid_lat, grid_lon = np.meshgrid(lats, lons, indexing='ij')
+    cells_y, cells_x = _to_km(grid_lat.ravel(), grid_lon.ravel(), lat0)
+    cells_y = cells_y.astype(np.float32)
+    cells_x = cells_x.astype(np.float32)
+
+    if len(points):
+        # Stations sharing a grid cell are interchangeable at this resolution, so
+        # the distance field only needs one representative per occupied cell
+        rows = np.clip(np.rint((points[:, 0] - lat_min) / (lat_max - lat_min) * (grid_size - 1)), 0, grid_size - 1)
+        cols = np.clip(np.rint((points[:, 1] - lon_min) / (lon_max - lon_min) * (grid_size - 1)), 0, grid_size - 1)
+        _, first = np.unique(rows.astype(np.int64) * grid_size + cols.astype(np.int64), return_index=True)
+        sites_y, sites_x = _to_km(points[first, 0], points[first, 1], lat0)
+        distance = _nearest_distance(cells_y, cells_x, sites_y.astype(np.float32), sites_x.astype(np.float32))
+        # Only the area spanned by the stations is a candidate, not the empty
+        # corners of the bounding box
+        cell_size = max(cells_y.max() - cells_y.min(), cells_x.max() - cells_x.min()) / grid_size
+        candidates = _inside_hull(_convex_hull(sites_x, sites_y), cells_x, cells_y, cell_size)
+    else:
+        distance = np.full(cells_y.shape, np.float32(np.inf))
+        candidates = np.ones(cells_y.shape, dtype=bool)
+
+    demand = np.zeros((grid_size, grid_size))
+    if demand_points is not None and len(demand_points):
+        demand_arr = np.asarray(demand_points, dtype=np.float64).reshape(-1, 3)
+        demand, _, _ = np.histogram2d(demand_arr[:, 0], demand_arr[:, 1], bins=grid_size,
+                                      range=[[lat_min, lat_max], [lon_min, lon_max]],
+                                      weights=demand_arr[:, 2])
+        demand = _box_blur(demand, max(1, grid_size // 32))
+        if demand.max() > 0:
+            demand = demand / demand.max()
+
+    return {
+        'lats': lats,
+        'lons': lons,
+        'lat0': lat0,
+        'cells_y': cells_y,
+        'cells_x': cells_x,
+        'distance': distance,
+        'candidates': candidates,
+        'demand': demand.ravel()
+    }
+
+
+def recommend_locations(stations, count=3, demand_points=None, demand_weight=1.0,
+                        grid_size=DEFAULT_GRID_SIZE, center=(36.8065, 10.1815)):
+    """
+    Propose under-served locations with greedy max-min-distance selection
+
+    Each pick is the cell whose distance to the nearest station (existing or
+    already proposed), scaled by local demand, is the largest. The result is
+    fully deterministic for a given input.
+
+    Args:
+        stations: Array-like of (latitude, longitude) rows
+        count: Number of locations to propose
+        demand_points: Optional (latitude, longitude, weight) rows
+        demand_weight: How strongly demand boosts a cell's score
+        grid_size: Number of cells per side of the coverage field
+        center: Fallback map center when there are fewer than two stations
+
+    Returns:
+        list: Dicts with 'latitude', 'longitude', 'nearestStationKm', 'demand' and 'score'
+    """
+    field = coverage_field(stations, demand_points, grid_size=grid_size, center=center)
+    distance = field['distance'].copy()
+    boost = 1.0 + demand_weight * field['demand']
+    cells_y, cells_x = field['cells_y'], field['cells_x']
+
+    picks = []
+    for _ in range(max(0, count)):
+        if np.isfinite(distance).any():
+            score = np.where(field['candidates'], distance * boost, -1.0)
+        else:
+            # No station at all yet: start from the densest, most central cell
+            score = boost - 1e-6 * np.hypot(cells_y - cells_y.mean(), cells_x - cells_x.mean())
+        best = int(np.argmax(score))
+        row, col = divmod(best, grid_size)
+        picks.append({
+            'latitude': round(float(field['lats'][row]), 6),
+            'longitude': round(float(field['lons'][col]), 6),
+            'nearestStationKm': round(float(distance[best]), 3) if np.isfinite(distance[best]) else None,
+            'demand': round(float(field['demand'][best]), 3),
+            'score': round(float(score[best]), 3)
+        })
+        # The proposed station now covers its surroundings too
+        picked = np.hypot(cells_y - cells_y[best], cells_x - cells_x[best])
+        np.minimum(distance, picked, out=distance)
+    return picks
+
+
+def describe_recommendations(picks, station_type='StationBus'):
+    """
+    Turn planner picks into the recommendation format used by the frontend
+
+    Priority is relative to the best pick so the ranking stays meaningful at any scale.
+    """
+    top = max((p['score'] for p in picks), default=0) or 1
+    recommendations = []
+    for index, pick in enumerate(picks, start=1):
+        ratio = pick['score'] / top
+        priority = 'high' if ratio >= 0.75 else 'medium' if ratio >= 0.4 else 'low'
+        if pick['nearestStationKm'] is None:
+            reason = "Aucune station existante : emplacement central proposé."
+        else:
+            reason = f"Zone mal desservie : la station la plus proche est à {pick['nearestStationKm']:.2f} km."
+        if pick['demand'] >= 0.5:
+            reason += " Forte densité d'événements de circulation à proximité."
+        recommendations.append({
+            'type': station_type,
+            'name': f"Station proposée {index}",
+            'latitude': pick['latitude'],
+            'longitude': pick['longitude'],
+            'reason': reason,
+            'priority': priority,
+            'nearestStationKm': pick['nearestStationKm'],
+            'demand': pick['demand']
+        })
+    return recommendations
+
+
+if __name__ == '__main__':
+    # Benchmark: python station_planner.py [stations]
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = np.random.default_rng(0)
+    # Stations spread over the city except two uncovered areas: a wide one in the
+    # south-west and a smaller one in the north-east, where the events happen
+    stations = np.column_stack([rng.uniform(36.70, 36.90, n), rng.uniform(10.05, 10.30, n)])
+    wide_gap = np.hypot(stations[:, 0] - 36.75, stations[:, 1] - 10.10) < 0.03
+    event_gap = np.hypot(stations[:, 0] - 36.85, stations[:, 1] - 10.25) < 0.02
+    stations = stations[~(wide_gap | event_gap)]
+    events = np.column_stack([rng.normal(36.85, 0.005, 2000), rng.normal(10.25, 0.005, 2000), np.ones(2000)])
+
+    runs = {}
+    for label, demand in (('coverage only', None), ('event-weighted', events)):
+        t0 = time.perf_counter()
+        picks = runs[label] = recommend_locations(stations, count=3, demand_points=demand)
+        print(f"{label:>15}: {len(stations)} stations in {(time.perf_counter() - t0) * 1000:.1f} ms -> "
+              + ', '.join(f"({p['latitude']}, {p['longitude']}, {p['nearestStationKm']} km)" for p in picks))
+
+    # Coverage alone fills the wide gap first; demand must move the first pick to the events
+    first, weighted_first = runs['coverage only'][0], runs['event-weighted'][0]
+    assert abs(first['latitude'] - 36.75) < 0.01 and abs(first['longitude'] - 10.10) < 0.01, first
+    assert abs(weighted_first['latitude'] - 36.85) < 0.01 and abs(weighted_first['longitude'] - 10.25) < 0.01, weighted_first
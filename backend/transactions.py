@@ -0,0 +1,108 @@
+"""
+Graph Transactions
+Undo journal for the in-memory graph, so a batch of changes (or a single
+CRUD request failing halfway) can be rolled back instead of leaving the
+graph partly modified
+"""
+
+import threading
+from contextlib import contextmanager
+
+from rdflib import Graph
+
+
+class TransactionalGraph(Graph):
+    """
+    rdflib Graph that journals add/remove while a transaction is open
+
+    Journaling is per thread: only the changes made by the thread that opened
+    the transaction are recorded (callers serialize writers with a lock).
+    Outside a transaction the graph behaves exactly like a plain Graph.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tx = threading.local()
+        # Subjects changed since the last save, when tracking is enabled (sharded storage)
+        self.dirty_subjects = None
+
+    def _journal(self):
+        return getattr(self._tx, 'journal', None)
+
+    def track_changes(self):
+        """Start recording changed subjects in dirty_subjects"""
+        self.dirty_subjects = set()
+
+    def add(self, triple):
+        journal = self._journal()
+        if journal is not None and triple not in self:
+            journal.append((True, triple))
+        if self.dirty_subjects is not None:
+            self.dirty_subjects.add(triple[0])
+        return super().add(triple)
+
+    def addN(self, quads):
+        # Graph += triples (used by SPARQL Update) goes through addN
+        if self._journal() is None:
+            if self.dirty_subjects is not None:
+                quads = self._tracked(quads)
+            return super().addN(quads)
+        for s, p, o, _ in quads:
+            self.add((s, p, o))
+        return self
+
+    def _tracked(self, quads):
+        for quad in quads:
+            self.dirty_subjects.add(quad[0])
+            yield quad
+
+    def remove(self, triple):
+        journal = self._journal()
+        if journal is not None or self.dirty_subjects is not None:
+            removed = list(self.triples(triple))
+            if journal is not None:
+                journal.extend((False, t) for t in removed)
+            if self.dirty_subjects is not None:
+                self.dirty_subjects.update(t[0] for t in removed)
+        return super().remove(triple)
+
+    def _undo(self, mark):
+        journal = self._journal()
+        while len(journal) > mark:
+            added, triple = journal.pop()
+            # Undone subjects stay dirty: their shard is rewritten unchanged, which is harmless
+            if added:
+                Graph.remove(self, triple)
+            else:
+                Graph.add(self, triple)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Apply changes atomically: any exception rolls them back, then propagates
+
+        Transactions nest: an inner one acts as a savepoint, undoing only its
+        own changes when it fails. Nothing is persisted here; the caller saves
+        the graph once the outermost transaction succeeded.
+        """
+        outermost = self._journal() is None
+        if outermost:
+            self._tx.journal = []
+        mark = len(self._tx.journal)
+        try:
+            yield self
+        except BaseException:
+            self._undo(mark)
+            raise
+        finally:
+            if outermost:
+                self._tx.journal = None
+
+    def pending_changes(self):
+        """Number of journaled changes of the current thread's open transaction"""
+        journal = self._journal()
+        return len(journal) if journal is not None else 0
+
+    def changes(self):
+        """Journaled (added, triple) pairs of the current thread's open transaction, oldest first"""
+        return list(self._journal() or ())
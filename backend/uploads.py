@@ -0,0 +1,106 @@
+"""
+Upload Spooling
+Copies incoming uploads (images, RDF imports) to disk in chunks, with a size
+limit, so the request can return while a background job processes the file
+"""
+
+import base64
+import binascii
+import os
+import re
+import tempfile
+
+# Largest accepted image, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+
+SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'smart_city_uploads'))
+
+ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp'}
+
+_CHUNK_SIZE = 64 * 1024
+_DATA_URL = re.compile(r'^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?:;[\w=.+-]+)*;base64,')
+
+
+class UploadRejected(Exception):
+    """Raised for uploads that are too large or not images"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _spool_file(suffix=''):
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=SPOOL_DIR, prefix='upload_', suffix=suffix, delete=False)
+
+
+def spool_stream(stream, mimetype, max_bytes=MAX_UPLOAD_BYTES, allowed_types=ALLOWED_MIME_TYPES):
+    """
+    Copy an uploaded file stream to a spool file, chunk by chunk
+
+    Args:
+        stream: Readable binary stream (e.g. a multipart FileStorage)
+        mimetype: Declared content type of the file
+        max_bytes: Size limit; larger uploads are rejected with status 413
+        allowed_types: Accepted content types (status 415 otherwise), None for any
+
+    Returns:
+        tuple: (path of the spool file, number of bytes written)
+    """
+    if allowed_types is not None and mimetype not in allowed_types:
+        raise UploadRejected(f"Unsupported image type: {mimetype or 'unknown'}", 415)
+
+    size = 0
+    spool = _spool_file()
+    try:
+        with spool:
+            while True:
+                chunk = stream.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"Image larger than {max_bytes} bytes", 413)
+                spool.write(chunk)
+    except BaseException:
+        discard(spool.name)
+        raise
+    if size == 0:
+        discard(spool.name)
+        raise UploadRejected("Empty file")
+    return spool.name, size
+
+
+def spool_base64(data, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Decode a base64 image (plain or data URL, as sent by the legacy JSON API) to a spool file
+
+    Returns:
+        tuple: (path of the spool file, number of bytes written)
+    """
+    match = _DATA_URL.match(data)
+    if match and match.group('mime') and match.group('mime') not in ALLOWED_MIME_TYPES:
+        raise UploadRejected(f"Unsupported image type: {match.group('mime')}", 415)
+    encoded = data[match.end():] if match else data
+    # 4 base64 characters encode 3 bytes
+    if len(encoded) * 3 // 4 > max_bytes + 3:
+        raise UploadRejected(f"Image larger than {max_bytes} bytes", 413)
+    try:
+        raw = base64.b64decode(encoded, validate=False)
+    except (binascii.Error, ValueError):
+        raise UploadRejected("image_data is not valid base64")
+    if not raw:
+        raise UploadRejected("Empty image")
+
+    spool = _spool_file()
+    with spool:
+        spool.write(raw)
+    return spool.name, len(raw)
+
+
+def discard(path):
+    """Remove a spool file, ignoring files that are already gone"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,147 @@
+"""
+User Index
+In-memory hash index of user names and emails, so registration uniqueness
+checks and login lookups do not scan the graph
+"""
+
+import threading
+
+from rdflib import Literal, RDF
+
+
+class UserIndex:
+    """
+    Name and email -> user URI maps, kept in sync with the graph
+
+    Built once from the graph with rebuild(), then maintained by the routes
+    that create, update or delete users. Names are not unique in older data
+    (the CRUD form never checked them), so each name maps to a set of URIs.
+    """
+
+    def __init__(self, user_types, name_property, email_property):
+        self.user_types = tuple(user_types)
+        self.name_property = name_property
+        self.email_property = email_property
+        self._by_name = {}
+        self._by_email = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def rebuild(self, graph):
+        """Index every user of the graph, replacing the current content"""
+        with self._lock:
+            self._by_name.clear()
+            self._by_email.clear()
+            self._entries.clear()
+            for user_type in self.user_types:
+                for uri in graph.subjects(RDF.type, user_type):
+                    self.add(uri, graph.value(uri, self.name_property), graph.value(uri, self.email_property))
+        return len(self._entries)
+
+    def add(self, uri, name=None, email=None):
+        """Index a user (re-adding a known URI replaces its entry)"""
+        with self._lock:
+            self.remove(uri)
+            name = str(name) if name is not None else None
+            email = str(email) if email is not None else None
+            self._entries[uri] = (name, email)
+            if name is not None:
+                self._by_name.setdefault(name, set()).add(uri)
+            if email is not None:
+                self._by_email.setdefault(email, set()).add(uri)
+
+    def remove(self, uri):
+        """Drop a user from the index; unknown URIs are ignored"""
+        with self._lock:
+            entry = self._entries.pop(uri, None)
+            if entry is None:
+                return
+            for index, key in ((self._by_name, entry[0]), (self._by_email, entry[1])):
+                uris = index.get(key)
+                if uris is not None:
+                    uris.discard(uri)
+                    if not uris:
+                        del index[key]
+
+    def refresh(self, graph, uri):
+        """Re-index one user from the graph (drops it if it is no longer a user)"""
+        with self._lock:
+            if any((uri, RDF.type, user_type) in graph for user_type in self.user_types):
+                self.add(uri, graph.value(uri, self.name_property), graph.value(uri, self.email_property))
+            else:
+                self.remove(uri)
+
+    def find_by_name(self, name):
+        """URIs of the users with this exact name"""
+        with self._lock:
+            return list(self._by_name.get(name, ()))
+
+    def name_taken(self, name):
+        with self._lock:
+            return name in self._by_name
+
+    def email_taken(self, email):
+        with self._lock:
+            return email in self._by_email
+
+    def authenticate(self, graph, name, password, password_property):
+        """
+        URI of the user with this name and password, or None
+
+        Only the (usually single) user with that name is checked, with a
+        direct triple lookup instead of a query.
+        """
+        secret = Literal(password)
+        for uri in self.find_by_name(name):
+            if (uri, password_property, secret) in graph:
+                return uri
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._entries),
+                'names': len(self._by_name),
+                'emails': len(self._by_email)
+            }
+
+
+if __name__ == '__main__':
+    # Benchmark: login lookups against a growing user base
+    import time
+
+    from rdflib import Graph, Namespace
+
+    ONT = Namespace("http://www.co-ode.org/ontologies/ont.owl#")
+
+    for size in (1_000, 10_000, 100_000):
+        graph = Graph()
+        for n in range(1, size + 1):
+            uri = ONT[f"Utilisateur_{n}"]
+            graph.add((uri, RDF.type, ONT.Citoyen))
+            graph.add((uri, ONT.Nom, Literal(f"user{n}")))
+            graph.add((uri, ONT.Email, Literal(f"user{n}@example.org")))
+            graph.add((uri, ONT.MotDePasse, Literal(f"secret{n}")))
+
+        index = UserIndex((ONT.Citoyen, ONT.Touriste), ONT.Nom, ONT.Email)
+        start = time.perf_counter()
+        index.rebuild(graph)
+        build = time.perf_counter() - start
+
+        rounds = 10_000
+        start = time.perf_counter()
+        for i in range(rounds):
+            n = i % size + 1
+            assert index.authenticate(graph, f"user{n}", f"secret{n}", ONT.MotDePasse) is not None
+        indexed = (time.perf_counter() - start) / rounds
+
+        sparql_rounds = 5
+        start = time.perf_counter()
+        for i in range(sparql_rounds):
+            list(graph.query(
+                f'SELECT ?user WHERE {{ ?user <{ONT.Nom}> "user{i + 1}" . ?user <{ONT.MotDePasse}> "secret{i + 1}" }}'
+            ))
+        sparql = (time.perf_counter() - start) / sparql_rounds
+
+        print(f"{size:>7} users: build {build * 1000:7.1f} ms, "
+              f"login {indexed * 1e6:5.1f} µs indexed vs {sparql * 1000:7.1f} ms SPARQL")
@@ -1,5 +1,6 @@
 // EventManagement.js - Module CRUD pour Aymen Jallouli
 import React, { useState, useEffect } from 'react';
+import { uploadImage } from '../utils/uploadImage';
 
 const API_URL = 'http://localhost:5001/api';
 
@@ -68,18 +69,12 @@ const EventManagement = ({ onUpdate }) => {
       
       // Only upload if there's a NEW image (imageFile exists)
       if (imageFile && imagePreview) {
-        const uploadResponse = await fetch(`${API_URL}/upload/event-image`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            event_id: editingEvent ? editingEvent.id : `event_${Date.now()}`,
-            image_data: imagePreview
-          })
-        });
-
-        const uploadData = await uploadResponse.json();
+        const uploadData = await uploadImage(
+          'event-image',
+          'event_id',
+          editingEvent ? editingEvent.id : `event_${Date.now()}`,
+          imageFile
+        );
         if (uploadData.success) {
           imageUrl = uploadData.url;
         } else {
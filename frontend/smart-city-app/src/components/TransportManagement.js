@@ -1,5 +1,6 @@
 // TransportManagement.js - Module CRUD pour Wael Marouani
 import React, { useState, useEffect } from 'react';
+import { uploadImage } from '../utils/uploadImage';
 
 const API_URL = 'http://localhost:5001/api';
 
@@ -11,7 +12,6 @@ const TransportManagement = ({ onUpdate }) => {
   const [searchTerm, setSearchTerm] = useState('');
   const [filterType, setFilterType] = useState('all');
   const [notification, setNotification] = useState({ show: false, message: '', type: '' });
-  // eslint-disable-next-line no-unused-vars
   const [imageFile, setImageFile] = useState(null);
   const [imagePreview, setImagePreview] = useState(null);
   const [formData, setFormData] = useState({
@@ -52,19 +52,13 @@ const TransportManagement = ({ onUpdate }) => {
     try {
       // First, upload image if there's one
       let imageUrl = null;
-      if (imagePreview) {
-        const uploadResponse = await fetch(`${API_URL}/upload/transport-image`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            transport_id: editingTransport ? editingTransport.id : `Transport_${Date.now()}`,
-            image_data: imagePreview
-          })
-        });
-
-        const uploadData = await uploadResponse.json();
+      if (imageFile) {
+        const uploadData = await uploadImage(
+          'transport-image',
+          'transport_id',
+          editingTransport ? editingTransport.id : `Transport_${Date.now()}`,
+          imageFile
+        );
         if (uploadData.success) {
           imageUrl = uploadData.url;
         }
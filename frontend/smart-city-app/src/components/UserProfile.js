@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { uploadImage } from '../utils/uploadImage';
 
 const API_URL = 'http://localhost:5001/api';
 
@@ -53,18 +54,7 @@ const UserProfile = ({ user, onUpdate, onClose }) => {
     try {
       // Upload profile image to Cloudinary if changed
       if (profileImage && imagePreview) {
-        const uploadResponse = await fetch(`${API_URL}/upload/profile-image`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            user_id: user.id,
-            image_data: imagePreview
-          })
-        });
-
-        const uploadData = await uploadResponse.json();
+        const uploadData = await uploadImage('profile-image', 'user_id', user.id, profileImage);
         
         if (uploadData.success) {
           // Save Cloudinary URL to localStorage
@@ -0,0 +1,49 @@
+// uploadImage.js - Upload asynchrone des images (multipart + suivi du job)
+
+const API_URL = 'http://localhost:5001/api';
+
+// Longest time the server holds a status request open while the upload runs
+const POLL_WAIT_SECONDS = 10;
+const MAX_POLLS = 30;
+
+/**
+ * Upload an image file and wait for the background job to finish.
+ *
+ * @param {string} endpoint - Upload endpoint, e.g. 'transport-image'
+ * @param {string} idField - Entity ID form field, e.g. 'transport_id'
+ * @param {string} entityId - ID of the entity the image belongs to
+ * @param {File} file - Image selected by the user
+ * @returns {Promise<{success: boolean, url?: string, public_id?: string, error?: string}>}
+ */
+export const uploadImage = async (endpoint, idField, entityId, file) => {
+  const formData = new FormData();
+  formData.append(idField, entityId);
+  formData.append('image', file);
+
+  const response = await fetch(`${API_URL}/upload/${endpoint}`, {
+    method: 'POST',
+    body: formData
+  });
+  const accepted = await response.json();
+  if (!accepted.success) {
+    return { success: false, error: accepted.error };
+  }
+
+  // The upload runs in the background: long-poll its status until it is done
+  for (let i = 0; i < MAX_POLLS; i++) {
+    const statusResponse = await fetch(`${API_URL}/upload/jobs/${accepted.jobId}?wait=${POLL_WAIT_SECONDS}`);
+    const job = await statusResponse.json();
+    if (!job.success) {
+      return { success: false, error: job.error };
+    }
+    if (job.status === 'done') {
+      return { success: true, url: job.url, public_id: job.public_id };
+    }
+    if (job.status === 'failed') {
+      return { success: false, error: job.error };
+    }
+  }
+  return { success: false, error: 'Image upload timed out' };
+};
+
+export default uploadImage;